@@ -1,14 +1,20 @@
+from .snapshot import EMPTY_BODIES, Snapshot
+from functools import lru_cache
+from . import json_codec
 import aio_pika
 import logging
 import asyncio
-import json
 import os
+import re
 
 TYPE_TICKER = 'ticker'
 TYPE_CANDLES = 'candles'
 TYPE_CUP = 'cup'
 TYPE_LISTING = 'listing_info'
 
+# type.exchange.pair[.time_frame], without wildcards of topic exchange
+DATA_ID_PATTERN = re.compile(r'\w+(\.[^.*#\s]+){2,3}')
+
 logger = logging.getLogger('cryptocurrency_error_log')
 logger.setLevel(logging.DEBUG)
 ch = logging.StreamHandler()
@@ -18,20 +24,55 @@ ch.setFormatter(formatter)
 logger.addHandler(ch)
 
 
+def _encode_frame(data):
+    """Encode WebSocket frame once for all observers"""
+    return json_codec.dumps(data).decode('utf-8')
+
+
+@lru_cache(maxsize=10000)
+def _frame_prefix(data_id):
+    return '{"data_id":' + json_codec.dumps(data_id).decode('utf-8') + ',"data":'
+
+
+def _splice_frame(data_id, body):
+    """Frame {data_id, data} with raw JSON body of message as data, body is not decoded
+
+    Market data service send valid JSON, so body is inserted in envelope as is.
+
+    """
+    return _frame_prefix(data_id) + body.decode('utf-8') + '}'
+
+
+def _broadcast(observers, frame, is_update=False):
+    """Queue one encoded frame for all observers, writers of observers send it, so slow client not delay others"""
+    for observer in observers:
+        observer.send(frame, is_update)
+
+
 class CryptoCurrencyAggregator:
     """Consume and send message to micro service crypto_currency"""
 
     ERR_SECOND_SUB = 'You already subscribed to this data'
+    ERR_BAD_DATA_ID = "Bad 'data_id' value"
 
     def __init__(self):
-        # ws, that wait first data
+        # ws, that wait first data: {data_id: set(observers)}
         self.waiters_first_msg = dict()
-        # after getting message, ws move to subscribers and will getting update data
+        # after getting message, ws move to subscribers and will getting update data: {data_id: set(observers)}
         self.subscribers = dict()
+        # reverse index: {observer: set(data_id)}, that observer wait or subscribed, detach of observer touch only them
+        self.observer_data_ids = dict()
+        # {data_id: Snapshot} of data_id with subscribers
+        self.snapshots = dict()
 
         # rabbitMQ variables
         self.connection = None
         self.channel = None
+        self.topic_exchange = None
+        self.queue_topic = None
+        # data_id, that queue_topic is bound to, bind and unbind of data_id are not interleaved
+        self.bound_data_ids = set()
+        self._bindings_lock = asyncio.Lock()
 
         self.mq_connection_str = os.environ.get('RABBIT_MQ_STR_CONN')
         self.queue_crypto_quotes_service = os.environ.get('QUEUE_SERVICE_CRYPTO_QUOTES')
@@ -49,10 +90,11 @@ class CryptoCurrencyAggregator:
         # market data send with routing key format: message_type.data_type.exchange.pair[.time_frame]
         # message_type == update | starting, data_type == ticker | candles | depth,
         # exchange, pair, time_frame - sending by listing_info
-        binding_mask = '*.*.*.#'
+        # queue is bound to update.<data_id> and starting.<data_id> only while local observers wait or subscribed
         topic_logs_exchange = await self.channel.declare_exchange(self.exchanger, aio_pika.ExchangeType.TOPIC)
         queue_topic = await self.channel.declare_queue('', auto_delete=True)
-        await queue_topic.bind(topic_logs_exchange, routing_key=binding_mask)
+        self.topic_exchange = topic_logs_exchange
+        self.queue_topic = queue_topic
 
         # listener queue for listing information
         queue_for_listing = await self.channel.declare_queue('', auto_delete=True)
@@ -63,9 +105,7 @@ class CryptoCurrencyAggregator:
         await queue_for_error.bind(topic_logs_exchange, routing_key=self.name_queue_for_error)
 
         def callback_crypto_currency_market_data(message):
-            """Callback for consume market data"""
-            body = json.loads(message.body.decode('utf-8'))
-            
+            """Callback for consume market data, body is passed to clients without decoding"""
             # routing_key have view: message_type.data_type.exchange.pair[.time_frame]
             # message_type == update | starting, data_type == ticker | candles | depth,
             # exchange, pair, time_frame - sending by listing_info
@@ -74,61 +114,54 @@ class CryptoCurrencyAggregator:
             data_id = '.'.join(message.routing_key.split('.')[1:])
 
             if message_type == 'update':
-                for observer in self.subscribers.get(data_id):
-                    asyncio.get_event_loop().create_task(observer.update(
-                        dict(
-                            data_id=message.routing_key,
-                            data=body
-                        )
-                    ))
+                if message.body in EMPTY_BODIES:
+                    # subscription failed, data of snapshot is not current more
+                    self.snapshots.pop(data_id, None)
+                else:
+                    snapshot = self.snapshots.get(data_id)
+                    if snapshot is not None:
+                        snapshot.update(message.body)
+                subscribers = self.subscribers.get(data_id)
+                if subscribers:
+                    frame = _splice_frame(message.routing_key, message.body)
+                    _broadcast(subscribers, frame, is_update=True)
             elif message_type == 'starting':
                 # if exist waiters, send data and move waiters in subscribers
-                if not self.waiters_first_msg.get(data_id):
+                new_subscribers = self.waiters_first_msg.pop(data_id, None)
+                if (new_subscribers or data_id in self.subscribers) and message.body not in EMPTY_BODIES:
+                    self.snapshots[data_id] = Snapshot(message.body, is_candles=data_id.startswith(f'{TYPE_CANDLES}.'))
+                if not new_subscribers:
                     return
 
-                new_subscribers = []
-                while self.waiters_first_msg[data_id]:
-                    observer = self.waiters_first_msg[data_id].pop()
-                    asyncio.get_event_loop().create_task(observer.update(
-                        dict(
-                            data_id=message.routing_key,
-                            data=body
-                        )
-                    ))
-                    new_subscribers.append(observer)
-
-                # if not subscribers on this data_id, init new dict-value, else append to exist array
-                subscribers = self.subscribers.get(data_id, None)
-                if not subscribers and new_subscribers:
+                frame = _splice_frame(message.routing_key, message.body)
+                _broadcast(new_subscribers, frame)
+
+                # if not subscribers on this data_id, init new dict-value, else add to exist set
+                subscribers = self.subscribers.get(data_id)
+                if not subscribers:
                     self.subscribers[data_id] = new_subscribers
                     asyncio.get_event_loop().create_task(self._send_message_for_subscribe(data_id))
                 else:
-                    for new_subscriber in new_subscribers:
-                        if new_subscriber not in self.subscribers[data_id]:
-                            self.subscribers[data_id].append(new_subscriber)
+                    subscribers.update(new_subscribers)
 
         def callback_crypto_currency_listing(message):
             """Callback for consume information about access pairs, exchanges and timeframes"""
-            body = json.loads(message.body.decode('utf-8'))
             data_id = TYPE_LISTING
 
-            if not self.waiters_first_msg.get(data_id):
+            waiters = self.waiters_first_msg.pop(data_id, None)
+            if not waiters:
                 return
 
-            while self.waiters_first_msg[data_id]:
-                observer = self.waiters_first_msg[data_id].pop()
-                asyncio.get_event_loop().create_task(observer.update(
-                    dict(
-                        data_id=data_id,
-                        data=body
-                    )
-                ))
+            for observer in waiters:
+                self._forget(observer, data_id)
+            frame = _splice_frame(data_id, message.body)
+            _broadcast(waiters, frame)
 
         def callback_crypto_currency_error(message):
             """Callback for consume error queue"""
             logger.error(message.body.decode('utf-8'))
 
-            body = json.loads(message.body.decode('utf-8'))
+            body = json_codec.loads(message.body)
 
             # validation
             error_place = body.get('error_place')
@@ -137,104 +170,135 @@ class CryptoCurrencyAggregator:
                 return
 
             # send information to ws, that wait or subscribe on error_place
-            waiters = self.waiters_first_msg.get(error_place, ())
-            for observer in waiters:
-                asyncio.get_event_loop().create_task(observer.update(
-                    dict(
-                        data_id=error_place,
-                        error=message
-                    )
-                ))
-
-            subscribers = self.subscribers.get(error_place, ())
-            for observer in subscribers:
-                asyncio.get_event_loop().create_task(observer.update(
-                    dict(
-                        data_id=error_place,
-                        data=message
-                    )
-                ))
+            waiters = self.waiters_first_msg.get(error_place)
+            if waiters:
+                frame = _encode_frame(dict(data_id=error_place, error=message))
+                _broadcast(waiters, frame)
+
+            subscribers = self.subscribers.get(error_place)
+            if subscribers:
+                frame = _encode_frame(dict(data_id=error_place, data=message))
+                _broadcast(subscribers, frame)
 
         await queue_topic.consume(callback_crypto_currency_market_data)
         await queue_for_listing.consume(callback_crypto_currency_listing)
         await queue_for_error.consume(callback_crypto_currency_error)
 
     async def attach(self, observer, data_id):
-        """Append observer in waiters and send message for get starting data"""
-        # init table for waiters if need
-        self.waiters_first_msg.setdefault(data_id, [])
+        """Append observer in waiters and send message for get starting data
+
+        If data_id is active, observer get snapshot at once and become subscriber.
+
+        """
+        if data_id != TYPE_LISTING and not (isinstance(data_id, str) and DATA_ID_PATTERN.fullmatch(data_id)):
+            observer.send(_encode_frame(dict(data_id=data_id, error=CryptoCurrencyAggregator.ERR_BAD_DATA_ID)))
+            return
+
+        snapshot = self.snapshots.get(data_id)
+        if snapshot is not None:
+            if observer in self.subscribers[data_id]:
+                observer.send(_encode_frame(dict(data_id=data_id, error=CryptoCurrencyAggregator.ERR_SECOND_SUB)))
+                return
+            self.subscribers[data_id].add(observer)
+            self.observer_data_ids.setdefault(observer, set()).add(data_id)
+            observer.send(_splice_frame(f'starting.{data_id}', snapshot.body()))
+            return
+
+        waiters = self.waiters_first_msg.setdefault(data_id, set())
 
         # if user want get information, that user already wait (in subscribers), send error
-        if observer in self.waiters_first_msg[data_id]:
-            asyncio.get_event_loop().create_task(observer.update(
-                dict(
-                    data_id=data_id,
-                    error=CryptoCurrencyAggregator.ERR_SECOND_SUB
-                )
-            ))
-
-        self.waiters_first_msg[data_id].append(observer)
+        if observer in waiters:
+            observer.send(_encode_frame(dict(data_id=data_id, error=CryptoCurrencyAggregator.ERR_SECOND_SUB)))
+            return
+
+        waiters.add(observer)
+        self.observer_data_ids.setdefault(observer, set()).add(data_id)
+        if data_id != TYPE_LISTING:
+            await self._bind(data_id)
         await self._send_message_for_get_starting_data(data_id)
 
     async def detach(self, observer, data_id=None):
         """Remove observer from specific data thread or from all data thread"""
         if data_id:
-            if self.subscribers.get(data_id) and observer in self.subscribers[data_id]:
-                self.subscribers[data_id].remove(observer)
+            data_ids = (data_id, )
+            self._forget(observer, data_id)
+        else:  # if not data_id, delete from data threads of observer
+            data_ids = self.observer_data_ids.pop(observer, ())
 
-                # If all subscribers unsubscribe, than stop task in microservice
-                if not self.subscribers[data_id]:
-                    await self._send_message_for_unsubscribe(data_id)
-
-            # check waiters
-            if self.waiters_first_msg.get(data_id) and observer in self.waiters_first_msg[data_id]:
-                self.waiters_first_msg[data_id].remove(observer)
-
-        else:  # if not data_id, delete from all data threads
-            # check subscribers
-            keys = list(self.subscribers.keys())
-            for key in keys:
-                if observer in self.subscribers.get(key, []):
-                    self.subscribers[key].remove(observer)
+        for key in data_ids:
+            subscribers = self.subscribers.get(key)
+            if subscribers and observer in subscribers:
+                subscribers.discard(observer)
 
-                    # If all subscribers unsubscribe, than stop task in microservice
-                    if not self.subscribers[key]:
-                        await self._send_message_for_unsubscribe(key)
+                # If all subscribers unsubscribe, than stop task in microservice
+                if not subscribers:
+                    del self.subscribers[key]
+                    self.snapshots.pop(key, None)
+                    await self._send_message_for_unsubscribe(key)
 
             # check waiters
-            keys = list(self.waiters_first_msg.keys())
-            for key in keys:
-                if observer in self.waiters_first_msg[key]:
-                    self.waiters_first_msg[key].remove(observer)
+            waiters = self.waiters_first_msg.get(key)
+            if waiters and observer in waiters:
+                waiters.discard(observer)
+                if not waiters:
+                    del self.waiters_first_msg[key]
+
+            await self._unbind_if_unused(key)
+
+    async def _bind(self, data_id):
+        """Bind queue to market data of data_id, before starting data is requested"""
+        async with self._bindings_lock:
+            if data_id in self.bound_data_ids:
+                return
+            await self.queue_topic.bind(self.topic_exchange, routing_key=f'starting.{data_id}')
+            await self.queue_topic.bind(self.topic_exchange, routing_key=f'update.{data_id}')
+            self.bound_data_ids.add(data_id)
+
+    async def _unbind_if_unused(self, data_id):
+        """Unbind queue from data_id, that nobody wait or subscribed"""
+        async with self._bindings_lock:
+            if data_id not in self.bound_data_ids or data_id in self.waiters_first_msg or data_id in self.subscribers:
+                return
+            await self.queue_topic.unbind(self.topic_exchange, routing_key=f'update.{data_id}')
+            await self.queue_topic.unbind(self.topic_exchange, routing_key=f'starting.{data_id}')
+            self.bound_data_ids.discard(data_id)
+
+    def _forget(self, observer, data_id):
+        """Remove data_id from reverse index of observer"""
+        data_ids = self.observer_data_ids.get(observer)
+        if data_ids is not None:
+            data_ids.discard(data_id)
+            if not data_ids:
+                del self.observer_data_ids[observer]
 
     async def _send_message_for_unsubscribe(self, data_id):
         """Send message to microservice for stop task"""
-        body = json.dumps(
+        body = json_codec.dumps(
             dict(
                 action='unsub',
                 data_id=data_id
             )
-        ).encode('utf-8')
+        )
         await self._send_message_in_queue(self.queue_crypto_quotes_service, body)
 
     async def _send_message_for_subscribe(self, data_id):
         """Send message to microservice for start task"""
-        body = json.dumps(
+        body = json_codec.dumps(
             dict(
                 action='sub',
                 data_id=data_id
             )
-        ).encode('utf-8')
+        )
         await self._send_message_in_queue(self.queue_crypto_quotes_service, body)
 
     async def _send_message_for_get_starting_data(self, data_id):
         """Send message to microservice for get starting data"""
-        body = json.dumps(
+        body = json_codec.dumps(
             dict(
                 action='get_starting',
                 data_id=data_id
             )
-        ).encode('utf-8')
+        )
         await self._send_message_in_queue(self.queue_crypto_quotes_service, body)
 
     async def _send_message_in_queue(self, queue_name, body, reply_to=None):
@@ -1,9 +1,67 @@
+from collections import deque
+import asyncio
+
+
 class Observer:
+    """WebSocket client of aggregator
+
+    Frames are written to ws by own writer task from queue, so broadcast not wait slow client. If client not read
+    frames and more than max_pending updates wait, oldest update is dropped. Starting data and errors are never
+    dropped, client can not draw data without them.
 
-    def __init__(self, ws):
+    """
+
+    def __init__(self, ws, max_pending=100):
         """ws - WebSocket connection"""
         self.ws = ws
+        self.max_pending = max_pending
+        # (frame, is_update) and count of updates in queue
+        self._pending = deque()
+        self._updates = 0
+        self._ready = asyncio.Event()
+        self._writer = None
+
+    def send(self, text, is_update=False):
+        """Queue encoded JSON frame for ws, same frame is shared by all observers of broadcast
+
+        is_update - frame is update of market data, it can be dropped, if client is slow
+
+        """
+        if self.ws.closed:
+            return
+        if is_update:
+            if self._updates >= self.max_pending:
+                self._drop_oldest_update()
+            self._updates += 1
+        self._pending.append((text, is_update))
+        self._ready.set()
+        if self._writer is None:
+            self._writer = asyncio.ensure_future(self._write())
+
+    def close(self):
+        """Stop writer, is called when ws is closed"""
+        if self._writer is not None:
+            self._writer.cancel()
+            self._writer = None
+        self._pending.clear()
+        self._updates = 0
+
+    def _drop_oldest_update(self):
+        for i, (_, is_update) in enumerate(self._pending):
+            if is_update:
+                del self._pending[i]
+                self._updates -= 1
+                return
 
-    async def update(self, data):
-        """Send new data to ws"""
-        await self.ws.send_json(data)
+    async def _write(self):
+        while not self.ws.closed:
+            await self._ready.wait()
+            self._ready.clear()
+            while self._pending:
+                text, is_update = self._pending.popleft()
+                if is_update:
+                    self._updates -= 1
+                try:
+                    await self.ws.send_str(text)
+                except (ConnectionError, RuntimeError):
+                    return
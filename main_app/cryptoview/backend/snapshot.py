@@ -0,0 +1,48 @@
+from collections import deque
+from . import json_codec
+
+# bodies, that market data service send instead of data, if request or subscription failed
+EMPTY_BODIES = frozenset(json_codec.dumps(data) for data in ([], [0, 0], [[], []]))
+
+
+class Snapshot:
+    """Latest market data of active data_id, new subscribers get it without request to microservice
+
+    ticker and depth: update contain full value, so snapshot is last raw body.
+    candles: window of starting candles, live updates are merged in it (candle with time of last candle replace it,
+    newer candle is appended and displace oldest). Window is limited by max_candles, that is count of candles in
+    starting data of market data service. Window is encoded once for all joiners between updates.
+    Snapshot is not made of empty body (EMPTY_BODIES), so joiners request starting data again.
+
+    """
+
+    def __init__(self, body, is_candles, max_candles=1000):
+        self.is_candles = is_candles
+        self._body = body
+        self._candles = None
+        if is_candles:
+            self._candles = deque(json_codec.loads(body), maxlen=max_candles)
+
+    def update(self, body):
+        """Apply raw body of update message"""
+        if not self.is_candles:
+            self._body = body
+            return
+
+        candle = json_codec.loads(body)
+        if not isinstance(candle, list) or len(candle) != 6:
+            return
+        candles = self._candles
+        if candles and candle[5] == candles[-1][5]:
+            candles[-1] = candle
+        elif not candles or candle[5] > candles[-1][5]:
+            candles.append(candle)
+        else:
+            return
+        self._body = None
+
+    def body(self):
+        """Return raw JSON body of snapshot"""
+        if self._body is None:
+            self._body = json_codec.dumps(list(self._candles))
+        return self._body
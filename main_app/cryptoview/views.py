@@ -1,8 +1,7 @@
-from cryptoview.backend import Observer
+from cryptoview.backend import Observer, json_codec
 from aiohttp import web, WSMsgType
 from asyncio import CancelledError
 import aiohttp_jinja2
-import json
 
 
 @aiohttp_jinja2.template('index.html')
@@ -105,12 +104,12 @@ async def ws_api_crypto_currency(request):
 
             if message.type == WSMsgType.text:
                 try:
-                    message = json.loads(message.data)
+                    message = json_codec.loads(message.data)
                     action = message.get('action')
                     data_id = message.get('data_id')
 
                     if not action or not data_id:
-                        await ws.send_json(dict(error=ERR_NOT_FULL_REQUEST))
+                        observer.send(json_codec.dumps(dict(error=ERR_NOT_FULL_REQUEST)).decode('utf-8'))
                         continue
 
                     if action == 'sub':
@@ -118,12 +117,14 @@ async def ws_api_crypto_currency(request):
                     elif action == 'unsub':
                         await request.app['Aggregator'].detach(observer, data_id)
                     else:
-                        await ws.send_json(dict(error=ERR_BAD_ACTION))
-                except json.JSONDecodeError:
-                    await ws.send_json(dict(error=ERR_NOT_JSON))
+                        observer.send(json_codec.dumps(dict(error=ERR_BAD_ACTION)).decode('utf-8'))
+                except json_codec.JSONDecodeError:
+                    observer.send(json_codec.dumps(dict(error=ERR_NOT_JSON)).decode('utf-8'))
             else:
                 await request.app['Aggregator'].detach(observer)
+                observer.close()
                 return ws
     except CancelledError as e:
         await request.app['Aggregator'].detach(observer)
+        observer.close()
         raise e
@@ -0,0 +1,174 @@
+from cryptoview.backend.aggregator import CryptoCurrencyAggregator
+from cryptoview.backend import json_codec
+from collections import namedtuple
+from unittest import TestCase, mock
+import asyncio
+
+Message = namedtuple('Message', ['routing_key', 'body'])
+
+
+class FakeExchange:
+
+    def __init__(self):
+        self.published = []
+
+    async def publish(self, message, routing_key):
+        self.published.append((routing_key, json_codec.loads(message.body)))
+
+
+class FakeQueue:
+
+    def __init__(self):
+        self.routing_keys = set()
+        self.callback = None
+
+    async def bind(self, exchange, routing_key):
+        self.routing_keys.add(routing_key)
+
+    async def unbind(self, exchange, routing_key):
+        self.routing_keys.discard(routing_key)
+
+    async def consume(self, callback):
+        self.callback = callback
+
+
+class FakeChannel:
+
+    def __init__(self):
+        self.default_exchange = FakeExchange()
+        self.queues = []
+
+    async def channel(self):
+        return self
+
+    async def declare_exchange(self, name, type):
+        return FakeExchange()
+
+    async def declare_queue(self, name, auto_delete):
+        self.queues.append(FakeQueue())
+        return self.queues[-1]
+
+
+class FakeObserver:
+
+    def __init__(self):
+        self.frames = []
+
+    def send(self, frame, is_update=False):
+        self.frames.append(json_codec.loads(frame))
+
+
+class AggregatorTests(TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.channel = FakeChannel()
+        self.aggregator = CryptoCurrencyAggregator()
+
+        async def connect(*args, **kwargs):
+            return self.channel
+
+        with mock.patch('aio_pika.connect', connect):
+            self.loop.run_until_complete(self.aggregator.run())
+        # queue of market data is declared first
+        self.market_data = self.channel.queues[0]
+
+    def tearDown(self):
+        self.loop.close()
+
+    def run_async(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def publish(self, routing_key, data):
+        self.market_data.callback(Message(routing_key, json_codec.dumps(data)))
+        # let tasks, that callback created, run
+        self.run_async(asyncio.sleep(0))
+
+    def requests(self):
+        """Actions, that were sent to market data service"""
+        return [(body['action'], body['data_id']) for _, body in self.channel.default_exchange.published]
+
+    def test_joiner_served_from_snapshot(self):
+        first, joiner = FakeObserver(), FakeObserver()
+        data_id = 'candles.Binance.BTCUSDT.M1'
+        self.run_async(self.aggregator.attach(first, data_id))
+        self.publish(f'starting.{data_id}', [['1', '2', '0.5', '1.5', '10', 60]])
+        self.publish(f'update.{data_id}', ['1', '2', '0.5', '1.7', '11', 60])
+        self.publish(f'update.{data_id}', ['1.7', '2', '1.7', '1.8', '1', 120])
+
+        self.run_async(self.aggregator.attach(joiner, data_id))
+        self.assertEqual(joiner.frames, [dict(data_id=f'starting.{data_id}',
+                                              data=[['1', '2', '0.5', '1.7', '11', 60],
+                                                    ['1.7', '2', '1.7', '1.8', '1', 120]])])
+        self.assertEqual(self.requests(), [('get_starting', data_id), ('sub', data_id)])
+
+        self.run_async(self.aggregator.attach(joiner, data_id))
+        self.assertEqual(joiner.frames[-1], dict(data_id=data_id, error=CryptoCurrencyAggregator.ERR_SECOND_SUB))
+        self.assertEqual(len(joiner.frames), 2)
+
+    def test_failed_subscription_drop_snapshot(self):
+        first, joiner = FakeObserver(), FakeObserver()
+        data_id = 'candles.Binance.BTCUSDT.M1'
+        self.run_async(self.aggregator.attach(first, data_id))
+        self.publish(f'starting.{data_id}', [['1', '2', '0.5', '1.5', '10', 60]])
+        self.publish(f'update.{data_id}', [])
+        self.assertEqual(first.frames[-1], dict(data_id=f'update.{data_id}', data=[]))
+
+        # joiner request starting data again
+        self.run_async(self.aggregator.attach(joiner, data_id))
+        self.assertEqual(joiner.frames, [])
+        self.assertEqual(self.requests()[-1], ('get_starting', data_id))
+
+    def test_not_snapshot_empty_starting(self):
+        first, joiner = FakeObserver(), FakeObserver()
+        data_id = 'depth.Binance.BTCUSDT'
+        self.run_async(self.aggregator.attach(first, data_id))
+        self.publish(f'starting.{data_id}', [[], []])
+        self.assertNotIn(data_id, self.aggregator.snapshots)
+
+        self.run_async(self.aggregator.attach(joiner, data_id))
+        self.assertEqual(self.requests().count(('get_starting', data_id)), 2)
+
+    def test_detach_only_own_data_ids(self):
+        observer, other = FakeObserver(), FakeObserver()
+        ticker, depth = 'ticker.Binance.BTCUSDT', 'depth.Binance.BTCUSDT'
+        self.run_async(self.aggregator.attach(observer, ticker))
+        self.run_async(self.aggregator.attach(other, ticker))
+        self.run_async(self.aggregator.attach(other, depth))
+        self.publish(f'starting.{ticker}', ['1', '2'])
+
+        self.run_async(self.aggregator.detach(observer))
+        self.assertNotIn(observer, self.aggregator.observer_data_ids)
+        self.assertEqual(self.aggregator.observer_data_ids[other], {ticker, depth})
+        self.assertEqual(self.aggregator.subscribers[ticker], {other})
+        self.assertEqual(self.aggregator.waiters_first_msg[depth], {other})
+        self.assertNotIn(('unsub', ticker), self.requests())
+
+        self.run_async(self.aggregator.detach(other, ticker))
+        self.assertEqual(self.aggregator.observer_data_ids[other], {depth})
+        self.assertNotIn(ticker, self.aggregator.subscribers)
+        self.assertEqual(self.requests()[-1], ('unsub', ticker))
+
+    def test_not_unbind_while_other_observer_wait(self):
+        first, second = FakeObserver(), FakeObserver()
+        data_id = 'ticker.Binance.BTCUSDT'
+        keys = {f'starting.{data_id}', f'update.{data_id}'}
+        self.run_async(self.aggregator.attach(first, data_id))
+        self.run_async(self.aggregator.attach(second, data_id))
+        self.assertEqual(self.market_data.routing_keys, keys)
+
+        self.run_async(self.aggregator.detach(first, data_id))
+        self.assertEqual(self.market_data.routing_keys, keys)
+        self.run_async(self.aggregator.detach(second, data_id))
+        self.assertEqual(self.market_data.routing_keys, set())
+        self.assertEqual(self.aggregator.bound_data_ids, set())
+
+    def test_reject_bad_data_id(self):
+        observer = FakeObserver()
+        for data_id in ('ticker.#', 'ticker.*.BTCUSDT', 'ticker.Binance', 'candles.Binance.BTCUSDT.M1.M5', 5):
+            self.run_async(self.aggregator.attach(observer, data_id))
+            self.assertEqual(observer.frames[-1], dict(data_id=data_id, error=CryptoCurrencyAggregator.ERR_BAD_DATA_ID))
+        self.assertEqual(self.market_data.routing_keys, set())
+        self.assertEqual(self.requests(), [])
+        self.assertNotIn(observer, self.aggregator.observer_data_ids)
@@ -0,0 +1,83 @@
+from cryptoview.backend.aggregator import _broadcast, _splice_frame
+from cryptoview.backend.observer import Observer
+from unittest import TestCase
+import asyncio
+
+
+class FakeWebSocket:
+    """WebSocket, that accept frames only while it is not stalled"""
+
+    def __init__(self):
+        self.closed = False
+        self.sent = []
+        self.free = asyncio.Event()
+        self.free.set()
+
+    async def send_str(self, text):
+        await self.free.wait()
+        self.sent.append(text)
+
+
+class ObserverTests(TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.observers = []
+
+    def tearDown(self):
+        for observer in self.observers:
+            observer.close()
+        # let cancelled writers finish
+        self.run_writers()
+        self.loop.close()
+
+    def observer(self, **kwargs):
+        observer = Observer(FakeWebSocket(), **kwargs)
+        self.observers.append(observer)
+        return observer
+
+    def run_writers(self):
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+
+    def test_keep_order(self):
+        observer = self.observer()
+        for i in range(5):
+            observer.send(str(i), is_update=i > 0)
+        self.run_writers()
+        self.assertEqual(observer.ws.sent, ['0', '1', '2', '3', '4'])
+
+    def test_slow_client_not_block_others(self):
+        fast, slow = self.observer(), self.observer(max_pending=3)
+        slow.ws.free.clear()
+        for i in range(10):
+            _broadcast([fast, slow], str(i), is_update=True)
+        self.run_writers()
+        self.assertEqual(fast.ws.sent, [str(i) for i in range(10)])
+
+        # oldest updates are dropped
+        slow.ws.free.set()
+        self.run_writers()
+        self.assertEqual(slow.ws.sent, ['7', '8', '9'])
+
+    def test_never_drop_starting_and_errors(self):
+        observer = self.observer(max_pending=2)
+        observer.ws.free.clear()
+        starting = _splice_frame('starting.ticker.Binance.BTCUSDT', b'["1","2"]')
+        observer.send('first')
+        observer.send(starting)
+        for i in range(5):
+            observer.send(str(i), is_update=True)
+        observer.send('error')
+        observer.send('5', is_update=True)
+        observer.ws.free.set()
+        self.run_writers()
+        self.assertEqual(observer.ws.sent, ['first', starting, '4', 'error', '5'])
+
+    def test_not_queue_for_closed_ws(self):
+        observer = self.observer()
+        observer.ws.closed = True
+        observer.send('0')
+        self.run_writers()
+        self.assertEqual(observer.ws.sent, [])
+        self.assertIsNone(observer._writer)
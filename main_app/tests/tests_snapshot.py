@@ -0,0 +1,37 @@
+from cryptoview.backend.snapshot import Snapshot
+from cryptoview.backend import json_codec
+from unittest import TestCase
+
+
+def candle(time, close='1.5'):
+    return ['1', '2', '0.5', close, '10', time]
+
+
+def body(data):
+    return json_codec.dumps(data)
+
+
+class SnapshotTests(TestCase):
+
+    def test_merge_candles(self):
+        snapshot = Snapshot(body([candle(60), candle(120)]), is_candles=True)
+        snapshot.update(body(candle(120, close='1.7')))
+        snapshot.update(body(candle(180)))
+        snapshot.update(body(candle(60, close='9')))
+        self.assertEqual(json_codec.loads(snapshot.body()), [candle(60), candle(120, close='1.7'), candle(180)])
+
+    def test_cap_window(self):
+        snapshot = Snapshot(body([]), is_candles=True, max_candles=3)
+        for time in range(60, 360, 60):
+            snapshot.update(body(candle(time)))
+        self.assertEqual([c[5] for c in json_codec.loads(snapshot.body())], [180, 240, 300])
+
+    def test_ignore_empty_update(self):
+        snapshot = Snapshot(body([candle(60)]), is_candles=True)
+        snapshot.update(b'[]')
+        self.assertEqual(json_codec.loads(snapshot.body()), [candle(60)])
+
+    def test_replace_ticker(self):
+        snapshot = Snapshot(b'["1","2"]', is_candles=False)
+        snapshot.update(b'["3","4"]')
+        self.assertEqual(snapshot.body(), b'["3","4"]')
@@ -0,0 +1,168 @@
+"""Partitioned consumption of requests by several instances of service
+
+Instances consume shared queue QUEUE_THIS_SERVICE. Every instance publish heartbeat with its id and active
+subscriptions in EXCHANGER with routing key cluster.<QUEUE_THIS_SERVICE>, so each instance know members of cluster.
+data_id is owned by instance, that is chosen by consistent hashing of exchange and pair. Request of data_id, that
+instance not own, is forwarded in queue of owner: QUEUE_THIS_SERVICE.node.<instance_id>.
+
+Rebalance:
+    member join - subscriptions, that it own now, are moved: old owner unsubscribe and send 'sub' to new owner
+    member leave (close or heartbeats expired) - new owners subscribe its subscriptions from last heartbeat
+Hash ring is changed only for data_id near points of joined or left member, other subscriptions not move.
+
+"""
+from listing_index import parse_data_id
+import json_codec
+import aio_pika
+import asyncio
+import bisect
+import zlib
+
+
+def partition_key(data_id):
+    """All data types and time frames of pair have same owner, so they share M1 stream and candles store"""
+    parsed_id = parse_data_id(data_id)
+    return f'{parsed_id.exchange}.{parsed_id.pair}'
+
+
+class HashRing:
+    """Consistent hashing: every node has replicas points on ring, key belong to node of next point"""
+
+    def __init__(self, nodes, replicas=64):
+        points = sorted((zlib.crc32(f'{node}#{i}'.encode('utf-8')), node) for node in nodes for i in range(replicas))
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def owner(self, key):
+        """Return node of key or None, if ring is empty"""
+        if not self._hashes:
+            return None
+        index = bisect.bisect(self._hashes, zlib.crc32(key.encode('utf-8'))) % len(self._hashes)
+        return self._nodes[index]
+
+
+class Cluster:
+    """Membership of instance in cluster and owners of data_id
+
+    on_take(data_id) - subscribe data_id in this instance, on_release(data_id) - unsubscribe it. Controller report
+    requests, that are processed by this instance, by track.
+
+    """
+
+    def __init__(self, queue_prefix, instance_id, on_take, on_release):
+        self.instance_id = instance_id
+        self.queue_name = f'{queue_prefix}.node.{instance_id}'
+        self._node_queue_prefix = f'{queue_prefix}.node.'
+        self._routing_key = f'cluster.{queue_prefix}'
+        self._on_take = on_take
+        self._on_release = on_release
+
+        # member is expired, if it not send heartbeat member_timeout seconds
+        self.heartbeat_interval = 2
+        self.member_timeout = 6
+        # instance_id -> [time of last heartbeat, data_id of subscriptions]
+        self._members = dict()
+        self._ring = HashRing([instance_id])
+        # data_id of active subscriptions of this instance
+        self.subscriptions = set()
+
+        self._channel = None
+        self._exchanger = None
+        self._heartbeat = None
+
+    def owner(self, data_id):
+        """Return instance_id of owner of data_id"""
+        return self._ring.owner(partition_key(data_id))
+
+    def is_local(self, data_id):
+        return self.owner(data_id) == self.instance_id
+
+    def track(self, data_id, action):
+        """Update subscriptions of this instance by processed request"""
+        if action == 'sub':
+            self.subscriptions.add(data_id)
+        elif action == 'unsub':
+            self.subscriptions.discard(data_id)
+
+    async def start(self, channel, exchanger):
+        """Join cluster, return queue of requests forwarded to this instance
+
+        Heartbeats of members come during first heartbeat_interval, so instance wait them before it take requests.
+
+        """
+        self._channel = channel
+        self._exchanger = exchanger
+        members_queue = await channel.declare_queue(exclusive=True)
+        await members_queue.bind(exchanger, routing_key=self._routing_key)
+        await members_queue.consume(self._on_heartbeat, no_ack=True)
+        node_queue = await channel.declare_queue(self.queue_name, auto_delete=True)
+
+        self._heartbeat = asyncio.ensure_future(self._beat())
+        await asyncio.sleep(self.heartbeat_interval)
+        return node_queue
+
+    async def forward(self, instance_id, body):
+        """Send raw request body in queue of instance"""
+        await self._channel.default_exchange.publish(aio_pika.Message(body=body),
+                                                     routing_key=self._node_queue_prefix + instance_id)
+
+    async def close(self):
+        """Leave cluster, members take over subscriptions of this instance"""
+        if self._heartbeat is None:
+            return
+        self._heartbeat.cancel()
+        self._heartbeat = None
+        await self._send_heartbeat(leave=True)
+
+    async def _beat(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            try:
+                await self._send_heartbeat()
+            except Exception as e:
+                print(f'Cluster heartbeat error: {type(e).__name__}: {e}')
+            await asyncio.sleep(self.heartbeat_interval)
+
+            now = loop.time()
+            expired = [member for member, (seen, _) in self._members.items() if now - seen > self.member_timeout]
+            if expired:
+                print(f'Cluster members {expired} are expired')
+                self._rebalance(left=[self._members.pop(member)[1] for member in expired])
+
+    async def _send_heartbeat(self, leave=False):
+        body = dict(instance=self.instance_id, subscriptions=sorted(self.subscriptions), leave=leave)
+        await self._exchanger.publish(aio_pika.Message(body=json_codec.dumps(body)), routing_key=self._routing_key)
+
+    def _on_heartbeat(self, message):
+        body = json_codec.loads(message.body)
+        member = body['instance']
+        if member == self.instance_id:
+            return
+
+        if body['leave']:
+            if self._members.pop(member, None) is not None:
+                print(f'Cluster member {member} left')
+                self._rebalance(left=[body['subscriptions']])
+            return
+
+        is_new = member not in self._members
+        self._members[member] = [asyncio.get_event_loop().time(), body['subscriptions']]
+        if is_new:
+            print(f'Cluster member {member} joined')
+            self._rebalance()
+
+    def _rebalance(self, left=()):
+        """Rebuild ring, move subscriptions, that changed owner, take over subscriptions of left members"""
+        self._ring = HashRing([self.instance_id, *self._members])
+
+        for data_id in [data_id for data_id in self.subscriptions if not self.is_local(data_id)]:
+            self._on_release(data_id)
+            self.subscriptions.discard(data_id)
+            body = json_codec.dumps(dict(action='sub', data_id=data_id))
+            asyncio.ensure_future(self.forward(self.owner(data_id), body))
+
+        for subscriptions in left:
+            for data_id in subscriptions:
+                if data_id not in self.subscriptions and self.is_local(data_id):
+                    self._on_take(data_id)
+                    self.subscriptions.add(data_id)
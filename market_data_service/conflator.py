@@ -0,0 +1,70 @@
+import asyncio
+
+
+class Conflator:
+    """Stage between connectors and publisher, that suppress not changed updates
+
+    For routing keys, that start with one of prefixes, conflator remember last published body and drop message with
+    same body. If min_interval is set, messages of one routing key are published not often than once per
+    min_interval seconds: intermediate messages are replaced by latest one, latest is published at end of interval.
+
+    Conflator has interface of aio_pika exchange: publish(message, routing_key)
+
+    """
+
+    def __init__(self, publisher, min_interval=0, prefixes=('update.', )):
+        self._publisher = publisher
+        self.min_interval = min_interval
+        self._prefixes = tuple(prefixes)
+
+        # routing_key -> body of last published message
+        self._last_bodies = dict()
+        # routing_key -> loop time of last publish
+        self._last_times = dict()
+        # routing_key -> latest message, that wait end of interval
+        self._pending = dict()
+        # routing_key -> asyncio.TimerHandle, that publish pending message
+        self._timers = dict()
+
+    async def publish(self, message, routing_key):
+        """Publish message, if it is changed and interval is passed"""
+        if not routing_key.startswith(self._prefixes):
+            await self._publisher.publish(message, routing_key=routing_key)
+            return
+
+        if routing_key in self._timers:
+            self._pending[routing_key] = message
+            return
+
+        if message.body == self._last_bodies.get(routing_key):
+            return
+
+        if self.min_interval:
+            loop = asyncio.get_event_loop()
+            next_time = self._last_times.get(routing_key, 0) + self.min_interval
+            if next_time > loop.time():
+                self._pending[routing_key] = message
+                self._timers[routing_key] = loop.call_at(next_time, self._flush, routing_key)
+                return
+
+        await self._send(message, routing_key)
+
+    def forget(self, routing_key):
+        """Drop state of routing key, call it when subscription on data_id is stopped"""
+        timer = self._timers.pop(routing_key, None)
+        if timer:
+            timer.cancel()
+        self._pending.pop(routing_key, None)
+        self._last_bodies.pop(routing_key, None)
+        self._last_times.pop(routing_key, None)
+
+    def _flush(self, routing_key):
+        del self._timers[routing_key]
+        message = self._pending.pop(routing_key)
+        if message.body != self._last_bodies.get(routing_key):
+            asyncio.ensure_future(self._send(message, routing_key))
+
+    async def _send(self, message, routing_key):
+        self._last_bodies[routing_key] = message.body
+        self._last_times[routing_key] = asyncio.get_event_loop().time()
+        await self._publisher.publish(message, routing_key=routing_key)
@@ -1,7 +1,16 @@
 from exchanges.exchange_factory import ExchangeFactory
+from listing_index import ListingIndex, parse_data_id
+from exchanges.rate_limiter import TokenBucket
+from starting_cache import StartingCache
+from exchanges.backoff import Backoff
+from conflator import Conflator
+from publisher import Publisher
+from functools import partial
+from cluster import Cluster
+import json_codec
 import aio_pika
 import asyncio
-import json
+import socket
 import os
 
 DATA_TYPE_CANDLES = 'candles'
@@ -20,8 +29,9 @@ class Controller:
 
     JSON-message format:
         {
-            action: <sub | unsub | get_starting>,
-            data_id: <listing_info | data_type.exchange.pair[.time_frame]>
+            action: <sub | unsub | get_starting | get_history>,
+            data_id: <listing_info | data_type.exchange.pair[.time_frame]>,
+            start: <unix_time>, end: <unix_time>
         }
 
     action:
@@ -29,6 +39,8 @@ class Controller:
         unsub - stop collecting market data task
         get_starting - if requested candlestick, be send several old candles, if requested depth or ticker be send
           current value
+        get_history - candles with start <= time < end from candles store of this MS (only for candles, start and
+          end are optional)
     data_id:
         listing_info - get information about exchanges, pairs and timeframes access
         Send only if 'action' == 'get_starting'
@@ -45,8 +57,8 @@ class Controller:
     RESPONSE:
     If requested listing_info, message be send in ROUTING_KEY_LISTING (env vars) queue
     If requested market, message be send in EXCHANGER rabbitmq exchange with specific routing_key,
-        that equ (update | starting) + data_id from request message. Update - new value (action == 'sub'),
-        starting - starting_data
+        that equ (update | starting | history) + data_id from request message. Update - new value (action == 'sub'),
+        starting - starting_data, history - candles from store
     If request content bad information or exchange connector generate error, message be send in ERROR_QUEUE
 
     All message send in JSON
@@ -64,32 +76,81 @@ class Controller:
     ERR_BAD_TIME_FRAME = "Invalid 'time_frame' value"
     ERR_BAD_LISTING_MESSAGE = "Listing information only with 'action' == 'get_starting' requested"
     ERR_BAD_ACTION = "Invalid 'action' value"
+    ERR_BAD_HISTORY_MESSAGE = "History only for candles requested"
+    ERR_BAD_HISTORY_RANGE = "Invalid 'start' or 'end' value"
     ERR_NOT_JSON = "Message isn't JSON"
 
     ACTION_TYPE_SUB = 'sub'
     ACTION_TYPE_UNSUB = 'unsub'
     ACTION_TYPE_STARTING = 'get_starting'
+    ACTION_TYPE_HISTORY = 'get_history'
 
-    def __init__(self):
+    def __init__(self, queue_for_consume=None, is_worker=False, workers=None, rate_limit_share=1):
         self._mq_connection_str = os.environ.get('RABBIT_MQ_STR_CONN')
-        self._queue_for_consume = os.environ.get('QUEUE_THIS_SERVICE')
+        self._queue_for_consume = queue_for_consume or os.environ.get('QUEUE_THIS_SERVICE')
         self._exchanger_name = os.environ.get('EXCHANGER')
         self._queue_for_error = os.environ.get('ERROR_QUEUE')
         self._queue_for_listing = os.environ.get('ROUTING_KEY_LISTING')
+        # '1' - drop superseded ticker and candles updates, if broker is slow
+        self._publisher_conflation = os.environ.get('PUBLISHER_CONFLATION') == '1'
+        # min seconds between two updates of one data_id, 0 - publish every changed update
+        self._update_interval = float(os.environ.get('UPDATE_MIN_INTERVAL') or 0)
+        # seconds, while starting data is answered from cache
+        self._starting_cache_ttl = float(os.environ.get('STARTING_CACHE_TTL') or 2)
 
         # ExchangeFactory change and create exchange object
         self._factory = None
 
+        # Process pool mode (module workers.py): front validate requests and route them to WorkerPool, worker serve
+        # requests of its queue, that are validated by front
+        self._is_worker = is_worker
+        self._workers = workers
+        self._rate_limit_share = rate_limit_share
+
+        # Several instances of service (env CLUSTER=1): data_id are partitioned between instances, module cluster.py
+        self._cluster = None
+        if os.environ.get('CLUSTER') == '1' and not is_worker:
+            instance_id = os.environ.get('INSTANCE_ID') or f'{socket.gethostname()}-{os.getpid()}'
+            self._cluster = Cluster(self._queue_for_consume, instance_id,
+                                    on_take=lambda data_id: self._dispatch(dict(action='sub', data_id=data_id)),
+                                    on_release=lambda data_id: self._dispatch(dict(action='unsub', data_id=data_id)))
+
         # Storage for async task
         self._futures = dict()
 
+        # Stopped subscription is restarted after random delay, that grow exponentially up to restart_max_delay.
+        # Restarts of one exchange are limited by token bucket, so failure of all subscriptions at once not produce
+        # storm of reconnects: restarts_burst at once, then restarts_burst per restarts_period seconds
+        self.restart_base_delay = 1
+        self.restart_max_delay = 60
+        self.restarts_burst = 50
+        self.restarts_period = 10
+        # exchange name -> TokenBucket
+        self._restart_buckets = dict()
+        # data_id -> in-flight task of get starting data, identical requests share it
+        self._starting_requests = dict()
+
         # variable for rabbitMQ
         self._connection = None
         self._channel = None
         self._exchanger = None
+        self._publisher = None
+        self._conflator = None
+        self._starting_cache = None
 
         # Information about exchanges, time frames and pairs in format: {exchange:[[time_frames], [pairs], ...]}
         self._listing = None
+        self._listing_index = ListingIndex({})
+        # listing is refreshed in background every listing_ttl seconds
+        self.listing_ttl = 3600
+        self._listing_updated = 0
+        # in-flight refresh, concurrent refreshes wait it
+        self._listing_refresh = None
+        self._listing_refresher = None
+
+        # REST API limits usage of exchanges is printed every metrics_interval seconds, 0 - not print
+        self.metrics_interval = int(os.environ.get('METRICS_INTERVAL') or 60)
+        self._metrics_printer = None
 
     async def run(self):
         """Start consume message queue"""
@@ -100,60 +161,115 @@ class Controller:
 
         self._exchanger = await self._channel.declare_exchange(self._exchanger_name, aio_pika.ExchangeType.TOPIC)
 
-        self._factory = ExchangeFactory(self._exchanger)
-        self._listing = await self._get_listing_info()
+        conflate_prefixes = ('update.ticker.', 'update.candles.') if self._publisher_conflation else ()
+        self._publisher = Publisher(self._exchanger, conflate_prefixes=conflate_prefixes)
+        self._publisher.start()
+
+        self._conflator = Conflator(self._publisher, min_interval=self._update_interval)
+        self._starting_cache = StartingCache(self._conflator, ttl=self._starting_cache_ttl)
+        self._factory = ExchangeFactory(self._starting_cache, self._rate_limit_share)
+        if not self._is_worker:
+            await self._refresh_listing()
+            self._listing_refresher = asyncio.ensure_future(self._refresh_listing_periodically())
+        if self._workers:
+            await self._workers.start(self._channel)
+        if self.metrics_interval:
+            self._metrics_printer = asyncio.ensure_future(self._print_metrics_periodically())
+
+        if self._cluster:
+            node_queue = await self._cluster.start(self._channel, self._exchanger)
+            await node_queue.consume(partial(self._on_message, forwarded=True))
+        await queue.consume(self._on_message)
+        print('Start consuming queue "{0}"...'.format(self._queue_for_consume))
 
-        def callback(message):
-            """Callback for process message"""
+    async def close(self):
+        """Stop all tasks, close connections to exchanges and RabbitMQ"""
+        for data_id in list(self._futures.keys()):
+            self._unsubscribe(data_id)
+        if self._listing_refresher:
+            self._listing_refresher.cancel()
+        if self._metrics_printer:
+            self._metrics_printer.cancel()
+
+        if self._cluster:
+            await self._cluster.close()
+        if self._workers:
+            await self._workers.close()
+        if self._factory:
+            await self._factory.close()
+        if self._publisher:
+            await self._publisher.close()
+        if self._connection:
+            await self._connection.close()
+
+    def _on_message(self, message, forwarded=False):
+        """Callback for process message, forwarded - message is forwarded by other instance of cluster"""
+        try:
+            body = json_codec.loads(message.body)
+        except json_codec.JSONDecodeError:
+            asyncio.get_event_loop().create_task(
+                self._send_error_in_exchange(None, Controller.ERR_NOT_JSON)
+            )
+            return
+        print(body)
 
-            try:
-                body = json.loads(message.body.decode('utf-8'))
-            except json.JSONDecodeError:
-                asyncio.get_event_loop().create_task(
-                    self._send_error_in_exchange(None, Controller.ERR_NOT_JSON)
-                )
-                return
-            print(body)
+        if not self._is_worker and self._is_not_valid(body):
+            return
 
-            if self._is_not_valid(body):
+        if self._cluster and not forwarded and body['data_id'] != DATA_TYPE_LISTING:
+            owner = self._cluster.owner(body['data_id'])
+            if owner != self._cluster.instance_id:
+                asyncio.get_event_loop().create_task(self._cluster.forward(owner, message.body))
                 return
+        self._dispatch(body, message.body)
 
-            loop = asyncio.get_event_loop()
-            if body['action'] == Controller.ACTION_TYPE_STARTING:
-                if body['data_id'] == DATA_TYPE_LISTING:
-                    loop.create_task(self._send_listing_info())
-                else:
-                    loop.create_task(self._get_starting_data(body['data_id']))
-            elif body['action'] == Controller.ACTION_TYPE_SUB:
-                loop.create_task(self._subscribe(body['data_id']))
-            elif body['action'] == Controller.ACTION_TYPE_UNSUB:
-                self._unsubscribe(body['data_id'])
-
-        await queue.consume(callback)
-        print('Start consuming queue "{0}"...'.format(self._queue_for_consume))
+    def _dispatch(self, body, raw_body=None):
+        """Process valid request in this instance"""
+        loop = asyncio.get_event_loop()
+        if self._cluster and body['data_id'] != DATA_TYPE_LISTING:
+            self._cluster.track(body['data_id'], body['action'])
+        if self._workers and body['data_id'] != DATA_TYPE_LISTING:
+            loop.create_task(self._workers.route(body['data_id'], body['action'],
+                                                 raw_body or json_codec.dumps(body)))
+            return
+
+        if body['action'] == Controller.ACTION_TYPE_STARTING:
+            if body['data_id'] == DATA_TYPE_LISTING:
+                loop.create_task(self._send_listing_info())
+            else:
+                loop.create_task(self._get_starting_data(body['data_id']))
+        elif body['action'] == Controller.ACTION_TYPE_SUB:
+            loop.create_task(self._subscribe(body['data_id']))
+        elif body['action'] == Controller.ACTION_TYPE_UNSUB:
+            self._unsubscribe(body['data_id'])
+        elif body['action'] == Controller.ACTION_TYPE_HISTORY:
+            loop.create_task(self._get_history(body['data_id'], body.get('start'), body.get('end')))
 
     def _is_not_valid(self, message):
         """Validation message. If request not valid, then send error message and return True"""
         if 'action' not in message\
             or message['action'] not in (Controller.ACTION_TYPE_SUB, Controller.ACTION_TYPE_UNSUB,
-                                         Controller.ACTION_TYPE_STARTING):
+                                         Controller.ACTION_TYPE_STARTING, Controller.ACTION_TYPE_HISTORY):
             error_place = message.get('data_id')
             asyncio.get_event_loop().create_task(self._send_error_in_exchange(error_place, Controller.ERR_BAD_ACTION))
             return True
         elif 'data_id' not in message:
             asyncio.get_event_loop().create_task(self._send_error_in_exchange('unknown', Controller.ERR_BAD_DATA_TYPE))
             return True
+        elif not isinstance(message['data_id'], str):
+            asyncio.get_event_loop().create_task(self._send_error_in_exchange('unknown', Controller.ERR_BAD_DATA_TYPE))
+            return True
         else:
             # data_id validation
-            fragments_id = message['data_id'].split('.')
+            data_id = parse_data_id(message['data_id'])
 
-            if fragments_id[0] not in (DATA_TYPE_DEPTH, DATA_TYPE_TICKER, DATA_TYPE_LISTING, DATA_TYPE_CANDLES):
+            if data_id.data_type not in (DATA_TYPE_DEPTH, DATA_TYPE_TICKER, DATA_TYPE_LISTING, DATA_TYPE_CANDLES):
                 asyncio.get_event_loop().create_task(
                     self._send_error_in_exchange(message['data_id'], Controller.ERR_BAD_DATA_TYPE)
                 )
                 return True
 
-            if fragments_id[0] == DATA_TYPE_LISTING:
+            if data_id.data_type == DATA_TYPE_LISTING:
                 if message['action'] != Controller.ACTION_TYPE_STARTING:
                     asyncio.get_event_loop().create_task(
                         self._send_error_in_exchange(message['data_id'], Controller.ERR_BAD_LISTING_MESSAGE)
@@ -161,22 +277,35 @@ class Controller:
                     return True
                 return False
 
-            if fragments_id[0] == DATA_TYPE_CANDLES and len(fragments_id) < 4:
+            if message['action'] == Controller.ACTION_TYPE_HISTORY:
+                if data_id.data_type != DATA_TYPE_CANDLES:
+                    asyncio.get_event_loop().create_task(
+                        self._send_error_in_exchange(message['data_id'], Controller.ERR_BAD_HISTORY_MESSAGE)
+                    )
+                    return True
+                if any(not isinstance(message.get(key), (int, type(None))) for key in ('start', 'end')):
+                    asyncio.get_event_loop().create_task(
+                        self._send_error_in_exchange(message['data_id'], Controller.ERR_BAD_HISTORY_RANGE)
+                    )
+                    return True
+
+            if data_id.data_type == DATA_TYPE_CANDLES and data_id.time_frame is None:
                 asyncio.get_event_loop().create_task(
                     self._send_error_in_exchange(message['data_id'], Controller.ERR_BAD_TIME_FRAME)
                 )
                 return True
 
-            exchange, pair = fragments_id[1], fragments_id[2]
-            if exchange not in self._listing:
+            index = self._listing_index
+            if not index.has_exchange(data_id.exchange):
                 asyncio.get_event_loop().create_task(self._send_error_in_exchange(message['data_id'],
                                                                                   Controller.ERR_BAD_EXCHANGE))
                 return True
-            elif pair not in self._listing[exchange][1]:
+            elif not index.has_pair(data_id.exchange, data_id.pair):
                 asyncio.get_event_loop().create_task(self._send_error_in_exchange(message['data_id'],
                                                                                   Controller.ERR_BAD_PAIR))
                 return True
-            elif fragments_id[0] == DATA_TYPE_CANDLES and fragments_id[3] not in self._listing[exchange][0]:
+            elif data_id.data_type == DATA_TYPE_CANDLES and not index.has_time_frame(data_id.exchange,
+                                                                                     data_id.time_frame):
                 asyncio.get_event_loop()\
                     .create_task(self._send_error_in_exchange(message['data_id'], Controller.ERR_BAD_TIME_FRAME))
                 return True
@@ -210,57 +339,139 @@ class Controller:
 
         return listing
 
+    async def _refresh_listing(self):
+        """Update _listing, concurrent calls share one request of listing"""
+        if self._listing_refresh is None or self._listing_refresh.done():
+            self._listing_refresh = asyncio.ensure_future(self._load_listing())
+        await asyncio.shield(self._listing_refresh)
+
+    async def _load_listing(self):
+        listing = await self._get_listing_info()
+        if self._listing:
+            # exchange was not access, keep old pairs
+            for name, (_, pairs) in listing.items():
+                if not pairs and name in self._listing:
+                    listing[name] = self._listing[name]
+        self._listing = listing
+        self._listing_index = ListingIndex(listing)
+        self._listing_updated = asyncio.get_event_loop().time()
+
+    async def _refresh_listing_periodically(self):
+        while True:
+            await asyncio.sleep(self.listing_ttl)
+            try:
+                await self._refresh_listing()
+            except Exception as e:
+                print(f'Listing refresh error: {type(e).__name__}: {e}')
+
+    async def _print_metrics_periodically(self):
+        while True:
+            await asyncio.sleep(self.metrics_interval)
+            for name, usage in self._factory.rate_limits_usage().items():
+                if usage:
+                    print(f'Rate limits {name}: {usage}')
+
     async def _get_starting_data(self, data_id):
-        """Send starting market data"""
+        """Send starting market data
 
-        routing_key = f'starting.{data_id}'
-        fragments_id = data_id.split('.')
-        data_type, exchange, pair = fragments_id[0], fragments_id[1], fragments_id[2]
-        exchange = self._factory.create_exchange(exchange)
+        Starting data is published in topic exchanger, so one publish answer all clients, that wait it. Request,
+        that come while same request is in-flight, is dropped, request soon after it is answered from cache.
 
-        loop = asyncio.get_event_loop()
-        if data_type == DATA_TYPE_CANDLES:
-            time_frame = fragments_id[3]
-            loop.create_task(exchange.get_starting_candles(routing_key, pair, time_frame))
-        elif data_type == DATA_TYPE_DEPTH:
-            loop.create_task(exchange.get_starting_depth(routing_key, pair))
-        elif data_type == DATA_TYPE_TICKER:
-            loop.create_task(exchange.get_starting_ticker(routing_key, pair))
+        """
+        parsed_id = parse_data_id(data_id)
+        routing_key, pair = parsed_id.starting_key, parsed_id.pair
+
+        message = self._starting_cache.get(routing_key)
+        if message is not None:
+            await self._publisher.publish(message, routing_key=routing_key)
+            return
+        if data_id in self._starting_requests:
+            return
+
+        exchange = self._factory.create_exchange(parsed_id.exchange)
+        if parsed_id.data_type == DATA_TYPE_CANDLES:
+            coroutine = exchange.get_starting_candles(routing_key, pair, parsed_id.time_frame)
+        elif parsed_id.data_type == DATA_TYPE_DEPTH:
+            coroutine = exchange.get_starting_depth(routing_key, pair)
+        elif parsed_id.data_type == DATA_TYPE_TICKER:
+            coroutine = exchange.get_starting_ticker(routing_key, pair)
+        else:
+            return
+
+        task = asyncio.get_event_loop().create_task(coroutine)
+        self._starting_requests[data_id] = task
+        task.add_done_callback(lambda _: self._starting_requests.pop(data_id, None))
+
+    async def _get_history(self, data_id, start=None, end=None):
+        """Send candles from candles store"""
+        parsed_id = parse_data_id(data_id)
+        exchange = self._factory.create_exchange(parsed_id.exchange)
+        await exchange.get_history(parsed_id.history_key, parsed_id.pair, parsed_id.time_frame, start, end)
 
     async def _subscribe(self, data_id):
         """Method for permanent get update specific market data"""
 
-        routing_key = f'update.{data_id}'
-        fragments_id = data_id.split('.')
-        data_type, exchange, pair = fragments_id[0], fragments_id[1], fragments_id[2]
-        exchange = self._factory.create_exchange(exchange)
         if data_id in self._futures:
             return
+        parsed_id = parse_data_id(data_id)
+        routing_key, pair = parsed_id.update_key, parsed_id.pair
+        exchange = self._factory.create_exchange(parsed_id.exchange)
+
+        if parsed_id.data_type == DATA_TYPE_CANDLES:
+            subscribe = partial(exchange.subscribe_candles, routing_key, pair, parsed_id.time_frame)
+        elif parsed_id.data_type == DATA_TYPE_DEPTH:
+            subscribe = partial(exchange.subscribe_depth, routing_key, pair)
+        elif parsed_id.data_type == DATA_TYPE_TICKER:
+            subscribe = partial(exchange.subscribe_ticker, routing_key, pair)
+        else:
+            return
+        self._futures[data_id] = asyncio.get_event_loop().create_task(self._supervise(data_id, subscribe))
+
+    async def _supervise(self, data_id, subscribe):
+        """Run subscription and restart it, while it is not cancelled by unsubscribe
+
+        Subscription method send error and return, if connection is lost or exchange send bad data, it is restarted
+        after backoff delay. Subscription resubscribe its streams and candles buffer load gap by REST.
 
+        """
         loop = asyncio.get_event_loop()
-        if data_type == DATA_TYPE_CANDLES:
-            time_frame = fragments_id[3]
-            self._futures[data_id] = loop.create_task(exchange.subscribe_candles(routing_key, pair, time_frame))
-        elif data_type == DATA_TYPE_DEPTH:
-            self._futures[data_id] = loop.create_task(exchange.subscribe_depth(routing_key, pair))
-        elif data_type == DATA_TYPE_TICKER:
-            self._futures[data_id] = loop.create_task(exchange.subscribe_ticker(routing_key, pair))
+        backoff = Backoff(self.restart_base_delay, self.restart_max_delay)
+        bucket = self._restart_buckets.get(parse_data_id(data_id).exchange)
+        if bucket is None:
+            bucket = TokenBucket(self.restarts_burst, self.restarts_period)
+            self._restart_buckets[parse_data_id(data_id).exchange] = bucket
+
+        while True:
+            started = loop.time()
+            try:
+                await subscribe()
+            except Exception as e:
+                print(f'Subscription {data_id} failed: {type(e).__name__}: {e}')
+
+            # subscription worked long time, so it is new failure
+            if loop.time() - started > self.restart_max_delay:
+                backoff.reset()
+            delay = backoff.delay()
+            print(f'Subscription {data_id} is stopped, restart after {delay:.1f} seconds')
+            await asyncio.sleep(delay)
+            await bucket.acquire()
 
     def _unsubscribe(self, data_id):
         """Stop task for get update market data"""
         if data_id in self._futures:
             self._futures[data_id].cancel()
             del self._futures[data_id]
+            self._conflator.forget(parse_data_id(data_id).update_key)
 
     async def _send_listing_info(self):
-        """Update _listing and send new listing in exchange"""
-        self._listing = await self._get_listing_info()
+        """Send cached listing in exchange, expired listing is refreshed in background"""
+        if asyncio.get_event_loop().time() - self._listing_updated > self.listing_ttl:
+            asyncio.ensure_future(self._refresh_listing())
         await self._send_data_in_exchange(self._queue_for_listing, self._listing)
 
     async def _send_data_in_exchange(self, queue_name, data):
         """Send message to exchanger"""
-        data = json.dumps(data)
-        await self._exchanger.publish(aio_pika.Message(body=data.encode()), routing_key=queue_name)
+        await self._publisher.publish(aio_pika.Message(body=json_codec.dumps(data)), routing_key=queue_name)
 
     async def _send_error_in_exchange(self, error_place, message):
         """Send error to exchanger with error routing_key"""
@@ -1,9 +1,18 @@
-﻿from aiohttp.client_exceptions import ClientConnectorError
+﻿from .stream_multiplexer import StreamMultiplexer
+from aiohttp import ClientSession, ClientError, TCPConnector
+from .resampler import CandleFeed, Resampler
+from .candle_buffer import CandleBuffer
+from .candle_store import CandleStore
+from .rate_limiter import RateLimiter
+from .symbol_index import SymbolIndex
+from . import timeframes
 from abc import abstractmethod
+from collections import deque
 import traceback
+import json_codec
 import aio_pika
 import asyncio
-import json
+import time
 import os
 
 
@@ -18,8 +27,8 @@ def _catch_error_decorator_factory(empty_data=None):
         async def wrapper(*args, **kwargs):
             try:
                 return await target(*args, **kwargs)
-            except (asyncio.CancelledError, ValueError, KeyError, IndexError, TypeError, json.JSONDecodeError,
-                    ClientConnectorError) as e:
+            except (asyncio.CancelledError, ValueError, KeyError, IndexError, TypeError, json_codec.JSONDecodeError,
+                    ClientError, ConnectionError) as e:
                 if type(e).__name__ != asyncio.CancelledError.__name__:
                     trc = traceback.format_exc()
                     msg = f'Class: {args[0].__class__}, {type(e).__name__}, {trc}'
@@ -29,16 +38,93 @@ def _catch_error_decorator_factory(empty_data=None):
                     else:
                         await args[0]._send_error_message(error_place='get_access_symbols', exception=msg)
                         return []
+                else:
+                    # task is cancelled, caller (supervisor of subscription) should know it
+                    raise
         return wrapper
     return catch_error_decorator
 
 
 class BaseExchange:
 
+    # In process pool mode (module workers.py) pairs of exchange may be served by different worker processes, that
+    # share REST limits of exchange. Connector, that poll all pairs by one request, serve all pairs in one process
+    shard_by_pair = True
+
     def __init__(self, mq_exchanger):
         self.exchanger = mq_exchanger
         self.time_out = 2
         self.request_candles = 1000
+        self.depth_levels = 20
+
+        # HTTP connection pool, one session is shared by all REST and WebSocket requests of connector
+        self.connections_limit = 100
+        self.keepalive_timeout = 30
+        self.dns_cache_ttl = 300
+        self._session = None
+
+        # Limits of exchange REST API, connector replace it by limiter with its limits. Every REST request wait
+        # tokens of its endpoint class: await self._rate_limiter.acquire(endpoint_class, weight)
+        self._rate_limiter = RateLimiter()
+
+        # Map symbols of this MS to symbols of exchange API. Connectors, whose symbols differ, fill it
+        # in _get_access_symbols
+        self._symbol_index = SymbolIndex(ttl=3600)
+        self._symbol_index_task = None
+
+        # WebSocket streams of all subscriptions are multiplexed on few connections
+        self._root_url_ws = None
+        self.ws_streams_per_connection = 100
+        self.ws_messages_per_second = None
+        # max streams in one subscribe message, connector with batch > 1 implement _ws_subscribe_batch_message
+        self.ws_subscribe_batch_size = 1
+        self.ws_ping_interval = None
+        self._streams = StreamMultiplexer(self)
+
+        # Last request_candles candles of running candles subscriptions, answer get_starting_candles without REST
+        # (symbol, time_frame) -> CandleBuffer and queue_name -> CandleBuffer
+        self._candle_buffers = dict()
+        self._candle_buffers_by_queue = dict()
+
+        # Candles of all time frames of symbol are derived from one upstream M1 stream
+        self.resample_candles = True
+        # time zone of candles of exchange, seconds east of UTC
+        self.candles_utc_offset = 0
+        # symbol -> CandleFeed, internal queue name of feed -> CandleFeed
+        self._candle_feeds = dict()
+        self._candle_feeds_by_queue = dict()
+
+        # Candles history on disk, store is enabled by env variable CANDLE_STORE_DIR
+        store_dir = os.environ.get('CANDLE_STORE_DIR')
+        self._candle_store = CandleStore(os.path.join(store_dir, self.name)) if store_dir else None
+        # queue_name -> CandleSeries of running candles subscriptions
+        self._candle_series_by_queue = dict()
+        # max count of candles in answer on get_history
+        self.history_limit = 10000
+
+        # Paginated candles history: max candles in one page of REST API, max concurrent requests of pages
+        self.candles_page_size = 1000
+        self.history_concurrency = 4
+
+    def _get_session(self):
+        """Return shared ClientSession, session is created on first call"""
+        if self._session is None or self._session.closed:
+            connector = TCPConnector(limit=self.connections_limit, keepalive_timeout=self.keepalive_timeout,
+                                     ttl_dns_cache=self.dns_cache_ttl)
+            self._session = ClientSession(connector=connector)
+        return self._session
+
+    def rate_limits_usage(self):
+        """Return metrics of REST API limits: {endpoint_class: {usage, waiting, total_weight, total_wait_time}}"""
+        return self._rate_limiter.usage()
+
+    async def close(self):
+        """Close shared ClientSession and all opened connections"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        if self._candle_store is not None:
+            self._candle_store.close()
 
     @_catch_error_decorator_factory(empty_data=[])
     async def get_access_symbols(self):
@@ -54,6 +140,56 @@ class BaseExchange:
         """Implementation get_access_symbols"""
         pass
 
+    async def _symbol_translate(self, symbol):
+        """Translate symbol in format for API
+
+        Index is loaded on first call, expired index is refreshed in background
+
+        """
+        if self._symbol_index.is_empty():
+            await asyncio.shield(self._refresh_symbol_index())
+        elif self._symbol_index.is_expired():
+            self._refresh_symbol_index()
+        return self._symbol_index.to_native(symbol)
+
+    def _refresh_symbol_index(self):
+        """Start reload symbols index, concurrent calls share one request. Return task"""
+        if self._symbol_index_task is None or self._symbol_index_task.done():
+            self._symbol_index_task = asyncio.ensure_future(self._get_access_symbols())
+            # error will be raised for waiters, background refresh keep old index
+            self._symbol_index_task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return self._symbol_index_task
+
+    def _ws_decode(self, raw_data):
+        """Decode frame of multiplexed WebSocket connection"""
+        return json_codec.loads(raw_data)
+
+    def _ws_subscribe_message(self, key, request_id):
+        """Return JSON-message for subscribe on stream with key"""
+        raise NotImplementedError(f'{self.name} has not WebSocket streams')
+
+    def _ws_subscribe_batch_message(self, keys, request_id):
+        """Return one JSON-message for subscribe on streams with keys"""
+        raise NotImplementedError(f'{self.name} has not batched subscribe')
+
+    def _ws_unsubscribe_message(self, key, request_id):
+        """Return JSON-message for unsubscribe from stream with key"""
+        raise NotImplementedError(f'{self.name} has not WebSocket streams')
+
+    async def _ws_route(self, ws, data):
+        """Return list (key, payload) for stream messages in decoded frame
+
+        Service messages (ping, subscribe result) are processed here and return empty list,
+        error reply on request of one stream raise StreamError (key or request_id of stream), other errors raise
+        exception and stop all streams of connection
+
+        """
+        raise NotImplementedError(f'{self.name} has not WebSocket streams')
+
+    async def _ws_ping(self, ws):
+        """Send keep-alive message, is called every ws_ping_interval seconds"""
+        pass
+
     @_catch_error_decorator_factory(empty_data=[0, 0])
     async def get_starting_ticker(self, queue_name, symbol):
         """Send current ticker (bid and ask prices) to exchanger with routing_key == queue_name
@@ -79,11 +215,107 @@ class BaseExchange:
         """
         await self._get_starting_candles(queue_name, symbol, time_frame)
 
-    @abstractmethod
     async def _get_starting_candles(self, queue_name, symbol, time_frame):
-        """Implementation get_starting_candles"""
+        """Implementation get_starting_candles, candles of running subscription are taken from buffer"""
+        buffer = self._candle_buffers.get((symbol, time_frame))
+        if buffer is not None and buffer.is_seeded:
+            # series of running subscription is open
+            series = self._candle_store.get(symbol, time_frame) if self._candle_store is not None else None
+            candles = series.tail(self.request_candles) if series is not None else buffer.candles()
+        else:
+            # candles of pair without subscription are not stored, so store not open series for every request
+            candles = await self._request_candles(symbol, time_frame)
+        await self._send_data_in_exchange(queue_name, candles)
+
+    @abstractmethod
+    async def _request_candles(self, symbol, time_frame):
+        """Return list of last request_candles candles, sorted by time ASC"""
         pass
 
+    @_catch_error_decorator_factory(empty_data=[])
+    async def get_history(self, queue_name, symbol, time_frame, start=None, end=None):
+        """Send candles with start <= time < end from candles store to exchanger with routing_key == queue_name
+
+        Store is filled by candles subscriptions and backfill, exchange is not requested. Only last history_limit
+        candles of range are sent. Candle format is same as in get_starting_candles
+
+        """
+        if self._candle_store is None:
+            raise ValueError('Candles store is disabled, set CANDLE_STORE_DIR')
+        try:
+            candles = self._candle_store.acquire(symbol, time_frame).range(start, end, self.history_limit)
+        finally:
+            self._candle_store.release(symbol, time_frame)
+        await self._send_data_in_exchange(queue_name, candles)
+
+    async def fetch_candles(self, symbol, time_frame, start, end=None):
+        """Async generator of candles with start <= time < end (now by default), candles are yielded by pages
+
+        Pages are requested concurrently, not more than history_concurrency requests at once, and yielded in order
+        of time. Candle format is same as in get_starting_candles
+
+        Usage:
+            async for candles in exchange.fetch_candles('BTCUSDT', 'M1', start):
+                ...
+
+        """
+        end = end or int(time.time())
+        semaphore = asyncio.Semaphore(self.history_concurrency)
+
+        async def fetch_page(page_start, page_end):
+            async with semaphore:
+                return await self._fetch_candles_page(symbol, time_frame, page_start, page_end)
+
+        pages = iter(self._candles_pages(time_frame, start, end))
+        # requested pages, some pages ahead of consumer are requested in background
+        tasks = deque()
+        try:
+            while True:
+                while len(tasks) < 2 * self.history_concurrency:
+                    page = next(pages, None)
+                    if page is None:
+                        break
+                    tasks.append(asyncio.ensure_future(fetch_page(*page)))
+                if not tasks:
+                    return
+
+                candles = [candle for candle in await tasks.popleft() if start <= candle[5] < end]
+                if candles:
+                    yield candles
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def _candles_pages(self, time_frame, start, end):
+        """Return list of (page_start, page_end), page contain not more than candles_page_size candles"""
+        length = timeframes.LENGTHS.get(time_frame) or timeframes.MAX_CALENDAR_LENGTHS[time_frame]
+        window = length * self.candles_page_size
+        pages = []
+        page_start = start // window * window
+        while page_start < end:
+            pages.append((max(page_start, start), min(page_start + window, end)))
+            page_start += window
+        return pages
+
+    async def _fetch_candles_page(self, symbol, time_frame, start, end):
+        """Return list of candles with start <= time < end, sorted by time ASC
+
+        Connector implement it, if exchange API allow request candles by time
+
+        """
+        raise NotImplementedError(f'{self.name} has not candles history API')
+
+    async def backfill_candles(self, symbol, time_frame, start, end=None):
+        """Load candles history in candles store"""
+        if self._candle_store is None:
+            raise ValueError('Candles store is disabled, set CANDLE_STORE_DIR')
+        series = self._candle_store.acquire(symbol, time_frame)
+        try:
+            async for candles in self.fetch_candles(symbol, time_frame, start, end):
+                series.merge(candles)
+        finally:
+            self._candle_store.release(symbol, time_frame)
+
     @_catch_error_decorator_factory(empty_data=[[], []])
     async def get_starting_depth(self, queue_name, symbol):
         """Send current depth to exchanger with routing_key == queue_name
@@ -127,7 +359,81 @@ class BaseExchange:
              time: int (unix_time)]
 
         """
-        await self._subscribe_candles(queue_name, symbol, time_frame)
+        buffer = CandleBuffer(self.request_candles)
+        self._candle_buffers[(symbol, time_frame)] = buffer
+        self._candle_buffers_by_queue[queue_name] = buffer
+        if self._candle_store is not None:
+            self._candle_series_by_queue[queue_name] = self._candle_store.acquire(symbol, time_frame)
+        try:
+            if self._is_resampled(time_frame):
+                await self._subscribe_resampled_candles(queue_name, symbol, time_frame, buffer)
+            else:
+                seeder = asyncio.ensure_future(self._seed_candle_buffer(buffer, symbol, time_frame))
+                try:
+                    await self._subscribe_candles(queue_name, symbol, time_frame)
+                finally:
+                    seeder.cancel()
+        finally:
+            if self._candle_buffers.get((symbol, time_frame)) is buffer:
+                del self._candle_buffers[(symbol, time_frame)]
+            if self._candle_buffers_by_queue.get(queue_name) is buffer:
+                del self._candle_buffers_by_queue[queue_name]
+            if self._candle_series_by_queue.pop(queue_name, None) is not None:
+                self._candle_store.release(symbol, time_frame)
+
+    def _is_resampled(self, time_frame):
+        """True, if candles of time_frame are derived from M1 stream"""
+        return self.resample_candles and 'M1' in self.access_timeframes and timeframes.is_supported(time_frame)
+
+    async def _subscribe_resampled_candles(self, queue_name, symbol, time_frame, buffer):
+        """Send candles of time_frame, that are derived from shared M1 stream of symbol"""
+        await self._seed_candle_buffer(buffer, symbol, time_frame)
+        resampler = None
+        if time_frame != 'M1':
+            resampler = Resampler(time_frame, self.candles_utc_offset)
+            if len(buffer):
+                resampler.seed(buffer.candles(1)[0])
+
+        feed = self._candle_feeds.get(symbol)
+        if feed is None or feed.task.done():
+            feed = CandleFeed(f'internal.candles.{symbol}.M1')
+            feed.task = asyncio.ensure_future(self._subscribe_candles(feed.queue_name, symbol, 'M1'))
+            self._candle_feeds[symbol] = feed
+            self._candle_feeds_by_queue[feed.queue_name] = feed
+        feed.resamplers[queue_name] = resampler
+        try:
+            await asyncio.shield(feed.task)
+            raise ConnectionError(f'Candles stream of {symbol} is stopped')
+        finally:
+            del feed.resamplers[queue_name]
+            if not feed.resamplers:
+                feed.task.cancel()
+                if self._candle_feeds.get(symbol) is feed:
+                    del self._candle_feeds[symbol]
+                if self._candle_feeds_by_queue.get(feed.queue_name) is feed:
+                    del self._candle_feeds_by_queue[feed.queue_name]
+
+    async def _seed_candle_buffer(self, buffer, symbol, time_frame):
+        """Load history in buffer, buffer stay not seeded if request failed"""
+        try:
+            candles = await self._request_candles(symbol, time_frame)
+            buffer.reset(candles)
+            series = self._candle_store.get(symbol, time_frame) if self._candle_store is not None else None
+            if series is not None:
+                # subscription was restarted or service was stopped, candles between store and REST are missed
+                if candles and series.last_time is not None and series.last_time < candles[0][5]:
+                    asyncio.ensure_future(self._backfill_gap(symbol, time_frame, series.last_time, candles[0][5]))
+                series.merge(candles)
+        except (ValueError, KeyError, IndexError, TypeError, json_codec.JSONDecodeError, ClientError,
+                ConnectionError) as e:
+            print(f'{self.name}: candles buffer of {symbol} {time_frame} is not seeded, {type(e).__name__}: {e}')
+
+    async def _backfill_gap(self, symbol, time_frame, start, end):
+        try:
+            await self.backfill_candles(symbol, time_frame, start, end)
+        except (NotImplementedError, ValueError, KeyError, IndexError, TypeError, json_codec.JSONDecodeError,
+                ClientError, ConnectionError) as e:
+            print(f'{self.name}: gap of candles {symbol} {time_frame} is not filled, {type(e).__name__}: {e}')
 
     async def _subscribe_candles(self, queue_name, symbol, time_frame):
         """Implementation subscribe_candles"""
@@ -154,8 +460,21 @@ class BaseExchange:
 
     async def _send_data_in_exchange(self, queue_name, data):
         """Send message in queue"""
-        data = json.dumps(data)
-        await self.exchanger.publish(aio_pika.Message(body=data.encode()), routing_key=queue_name)
+        feed = self._candle_feeds_by_queue.get(queue_name)
+        if feed is not None:
+            for subscription_queue, resampler in list(feed.resamplers.items()):
+                candle = data if resampler is None else resampler.update(data)
+                if candle is not None:
+                    await self._send_data_in_exchange(subscription_queue, candle)
+            return
+
+        buffer = self._candle_buffers_by_queue.get(queue_name)
+        if buffer is not None and buffer.is_seeded and data:
+            buffer.update(data)
+        series = self._candle_series_by_queue.get(queue_name)
+        if series is not None and data:
+            series.append(data)
+        await self.exchanger.publish(aio_pika.Message(body=json_codec.dumps(data)), routing_key=queue_name)
 
     async def _send_error_message(self, error_place, exception=None):
         """Send error in queue"""
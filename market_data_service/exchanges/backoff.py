@@ -0,0 +1,24 @@
+import random
+
+
+class Backoff:
+    """Exponential backoff with full jitter
+
+    Delay of attempt n is random in [0, min(max_delay, base_delay * 2 ** n)], so tasks, that failed at once, are
+    restarted at different times.
+
+    """
+
+    def __init__(self, base_delay=1, max_delay=60):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.attempt = 0
+
+    def delay(self):
+        """Return delay before next attempt"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** self.attempt))
+        self.attempt += 1
+        return delay
+
+    def reset(self):
+        self.attempt = 0
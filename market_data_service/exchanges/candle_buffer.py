@@ -0,0 +1,109 @@
+from decimal import Decimal
+from array import array
+
+# width of number column value: exchange string in ASCII, padded by zero bytes
+NUMBER_SIZE = 32
+
+
+def format_number(value):
+    """Float or Decimal to shortest string, that round-trip, without exponent: 1.234e-05 -> '0.00001234'"""
+    if isinstance(value, float):
+        value = Decimal(repr(value))
+    text = format(value, 'f')
+    if '.' in text:
+        text = text.rstrip('0').rstrip('.')
+    return text
+
+
+def encode_number(value):
+    """Exchange number string to fixed-width bytes, string is kept as is"""
+    if not isinstance(value, str):
+        value = format_number(value)
+    data = value.encode('ascii')
+    if len(data) > NUMBER_SIZE:
+        raise ValueError(f'Number {value} is longer than {NUMBER_SIZE} chars')
+    return data.ljust(NUMBER_SIZE, b'\0')
+
+
+def decode_number(data):
+    """Fixed-width bytes to exchange number string"""
+    return bytes(data).rstrip(b'\0').decode('ascii')
+
+
+class CandleBuffer:
+    """Fixed-size ring buffer of last OHLCV candles of one stream
+
+    Candles are stored in columns: time in array of int64, open, high, low, close and volume in bytearrays of
+    fixed-width strings (NUMBER_SIZE), so buffer keep strings of exchange exactly and answer same candles as REST
+    request without Python object per candle.
+    Buffer is seeded by reset (candles of REST request), then kept current by update: candle with time of last candle
+    replace it in place, newer candle is appended and displace oldest.
+
+    Candle format: [open: str(float), high: str(float), low: str(float), close: str(float), volume: str(float),
+                    time: int (unix_time)]
+
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.is_seeded = False
+
+        self._time = array('q', bytes(8 * size))
+        self._numbers = [bytearray(NUMBER_SIZE * size) for _ in range(5)]
+
+        # index of oldest candle and count of candles
+        self._start = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def last_time(self):
+        """Time of last candle or None, if buffer is empty"""
+        if not self._count:
+            return None
+        return self._time[(self._start + self._count - 1) % self.size]
+
+    def reset(self, candles):
+        """Replace content of buffer by candles, sorted by time ASC"""
+        self._start = 0
+        self._count = 0
+        for candle in candles[-self.size:]:
+            self._append(candle)
+        self.is_seeded = True
+
+    def update(self, candle):
+        """Apply candle of stream, candles older than last are ignored"""
+        time = int(candle[5])
+        last_time = self.last_time
+        if last_time is None or time > last_time:
+            self._append(candle)
+        elif time == last_time:
+            self._write((self._start + self._count - 1) % self.size, candle)
+
+    def candles(self, count=None):
+        """Return last count (all by default) candles, sorted by time ASC"""
+        count = self._count if count is None else min(count, self._count)
+        first = self._start + self._count - count
+        return [self._read(i % self.size) for i in range(first, first + count)]
+
+    def _append(self, candle):
+        # candle is written before counters are moved, so rejected candle not take place
+        if self._count < self.size:
+            self._write((self._start + self._count) % self.size, candle)
+            self._count += 1
+        else:
+            self._write(self._start, candle)
+            self._start = (self._start + 1) % self.size
+
+    def _read(self, index):
+        offset = index * NUMBER_SIZE
+        return (*(decode_number(column[offset:offset + NUMBER_SIZE]) for column in self._numbers), self._time[index])
+
+    def _write(self, index, candle):
+        values = [encode_number(value) for value in candle[:5]]
+        offset = index * NUMBER_SIZE
+        for column, value in zip(self._numbers, values):
+            column[offset:offset + NUMBER_SIZE] = value
+        self._time[index] = int(candle[5])
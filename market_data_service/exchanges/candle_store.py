@@ -0,0 +1,224 @@
+from .candle_buffer import NUMBER_SIZE, decode_number, encode_number
+from array import array
+import bisect
+import mmap
+import os
+
+# column name, size of value in bytes and index of value in candle: time is int64, prices and volume are
+# fixed-width strings of exchange
+COLUMNS = (('time', 8, 5), ('open', NUMBER_SIZE, 0), ('high', NUMBER_SIZE, 1), ('low', NUMBER_SIZE, 2),
+           ('close', NUMBER_SIZE, 3), ('volume', NUMBER_SIZE, 4))
+
+
+class CandleSeries:
+    """Candles of one (pair, time frame) in columnar files
+
+    Each column is file of fixed-width values, candles are sorted by time ASC. Live candle is appended or overwrite
+    last record, older candles are merged by rewrite of files. Reads use memory-mapped files, so tail and range
+    slice columns without copy.
+
+    Writes are kept in memory and written by flush: one pwrite per column for all pending candles, when more than
+    flush_size candles are pending, before read or rewrite and on close. So updates of open candle only replace
+    pending candle. Candles, that are lost on crash, are merged again from REST request, when subscription starts.
+
+    """
+
+    def __init__(self, path, flush_size=16):
+        self.path = path
+        self.flush_size = flush_size
+        os.makedirs(path, exist_ok=True)
+
+        self._fds = dict()
+        for name, _, _ in COLUMNS:
+            self._fds[name] = os.open(os.path.join(path, f'{name}.bin'), os.O_RDWR | os.O_CREAT, 0o644)
+        sizes = [os.fstat(self._fds[name]).st_size // size for name, size, _ in COLUMNS]
+        # columns may differ after crash between writes
+        self._count = min(sizes)
+        self._last_time = None
+        if self._count:
+            data = os.pread(self._fds['time'], 8, (self._count - 1) * 8)
+            self._last_time = array('q', data)[0]
+
+        # index -> encoded candle, that is not written in files yet
+        self._pending = dict()
+        # count of candles in mapped files, column name -> mmap and memoryview of column
+        self._mapped = 0
+        self._maps = dict()
+        self._views = dict()
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def last_time(self):
+        """Time of last candle or None, if series is empty"""
+        return self._last_time
+
+    def append(self, candle):
+        """Write candle of stream, candle with time of last candle overwrite it, older candle is merged"""
+        time = int(candle[5])
+        last_time = self.last_time
+        if last_time is None or time > last_time:
+            self._write(self._count, candle)
+            self._count += 1
+            self._last_time = time
+        elif time == last_time:
+            self._write(self._count - 1, candle)
+        else:
+            self.merge([candle])
+
+    def merge(self, candles):
+        """Write candles sorted by time ASC, candles with same time are replaced"""
+        if not candles:
+            return
+        last_time = self.last_time
+        if last_time is None or int(candles[0][5]) > last_time:
+            for candle in candles:
+                self.append(candle)
+            return
+
+        # rewrite only tail of files, that overlap with candles
+        position = bisect.bisect_left(self._columns()['time'], int(candles[0][5]))
+        merged = {candle[5]: candle for candle in self._read(position, self._count)}
+        merged.update((int(candle[5]), candle) for candle in candles)
+        self._rewrite(position, [merged[time] for time in sorted(merged)])
+
+    def tail(self, count):
+        """Return last count candles"""
+        return self._read(max(self._count - count, 0), self._count)
+
+    def range(self, start=None, end=None, limit=None):
+        """Return candles with start <= time < end, if limit is set return only last limit candles of range"""
+        times = self._columns()['time']
+        first = 0 if start is None else bisect.bisect_left(times, start)
+        last = self._count if end is None else bisect.bisect_left(times, end)
+        if limit is not None:
+            first = max(first, last - limit)
+        return self._read(first, last)
+
+    def flush(self):
+        """Write pending candles in files, every run of consecutive candles by one pwrite per column"""
+        if not self._pending:
+            return
+        indexes = sorted(self._pending)
+        run_start = 0
+        for i in range(1, len(indexes) + 1):
+            if i < len(indexes) and indexes[i] == indexes[i - 1] + 1:
+                continue
+            self._write_rows(indexes[run_start], [self._pending[index] for index in indexes[run_start:i]])
+            run_start = i
+        self._pending.clear()
+
+    def close(self):
+        self.flush()
+        self._unmap()
+        for fd in self._fds.values():
+            os.close(fd)
+        self._fds.clear()
+
+    def _read(self, first, last):
+        if first >= last:
+            return []
+        columns = self._columns()
+        times = columns['time'][first:last]
+        numbers = [columns[name][first * size:last * size] for name, size, _ in COLUMNS[1:]]
+        return [(*(decode_number(column[i * NUMBER_SIZE:(i + 1) * NUMBER_SIZE]) for column in numbers), times[i])
+                for i in range(last - first)]
+
+    def _columns(self):
+        """Memory views of columns, pending candles are written and files are remapped after growth"""
+        self.flush()
+        if self._mapped != self._count:
+            self._unmap()
+            if self._count:
+                for name, size, _ in COLUMNS:
+                    self._maps[name] = mmap.mmap(self._fds[name], self._count * size, access=mmap.ACCESS_READ)
+                    self._views[name] = memoryview(self._maps[name])
+                self._views['time'] = self._views['time'].cast('q')
+            else:
+                self._views = {name: memoryview(b'') for name, _, _ in COLUMNS}
+                self._views['time'] = memoryview(array('q'))
+            self._mapped = self._count
+        return self._views
+
+    def _unmap(self):
+        for view in self._views.values():
+            view.release()
+        for mapped in self._maps.values():
+            mapped.close()
+        self._views = dict()
+        self._maps = dict()
+        self._mapped = -1
+
+    def _write(self, index, candle):
+        # candle is encoded at once, so invalid candle is rejected by append and not by later flush
+        self._pending[index] = self._encode(candle)
+        if len(self._pending) > self.flush_size:
+            self.flush()
+
+    @staticmethod
+    def _encode(candle):
+        """Candle to row of column values: int time and fixed-width number strings"""
+        return (int(candle[5]), *(encode_number(candle[candle_index]) for _, _, candle_index in COLUMNS[1:]))
+
+    def _write_rows(self, position, rows):
+        """Write encoded candles in columns from position"""
+        os.pwrite(self._fds['time'], array('q', (row[0] for row in rows)).tobytes(), position * 8)
+        for column, (name, size, _) in enumerate(COLUMNS[1:], 1):
+            os.pwrite(self._fds[name], b''.join(row[column] for row in rows), position * size)
+
+    def _rewrite(self, position, candles):
+        """Replace candles from position to end by candles"""
+        rows = [self._encode(candle) for candle in candles]
+        self.flush()
+        self._unmap()
+        for name, size, _ in COLUMNS:
+            os.ftruncate(self._fds[name], position * size)
+        self._write_rows(position, rows)
+        self._count = position + len(candles)
+        self._last_time = int(candles[-1][5])
+
+
+class CandleStore:
+    """Candle series of exchange in directory root: <root>/<pair>/<time_frame>/<column>.bin
+
+    Series is open (6 file descriptors and maps) while it is acquired: by running candles subscription or for time
+    of one history request. Series is closed by last release.
+
+    """
+
+    def __init__(self, root):
+        self.root = root
+        # (pair, time_frame) -> CandleSeries and count of acquires
+        self._series = dict()
+        self._refs = dict()
+
+    def acquire(self, symbol, time_frame):
+        """Return series, it is opened on first acquire"""
+        key = (symbol, time_frame)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = CandleSeries(os.path.join(self.root, symbol, time_frame))
+            self._refs[key] = 0
+        self._refs[key] += 1
+        return series
+
+    def release(self, symbol, time_frame):
+        """Close series, if it is not acquired more"""
+        key = (symbol, time_frame)
+        if key not in self._refs:
+            return
+        self._refs[key] -= 1
+        if not self._refs[key]:
+            del self._refs[key]
+            self._series.pop(key).close()
+
+    def get(self, symbol, time_frame):
+        """Return acquired series or None"""
+        return self._series.get((symbol, time_frame))
+
+    def close(self):
+        for series in self._series.values():
+            series.close()
+        self._series.clear()
+        self._refs.clear()
@@ -14,8 +14,10 @@ class ExchangeNotExistError(Exception):
 class ExchangeFactory:
     """Class for create exchanges."""
 
-    def __init__(self, mq_exchanger):
+    def __init__(self, mq_exchanger, rate_limit_share=1):
         self.exchanger = mq_exchanger
+        # share of REST limits of exchanges, that are sharded by pair between worker processes
+        self.rate_limit_share = rate_limit_share
         # Classes all exchanges
         self._exchanges = [Binance, Bittrex, HitBTC, HuobiGlobal, OkCoin, OkEx]
         # already created exchanges instance
@@ -25,6 +27,10 @@ class ExchangeFactory:
         """Return list with str names access exchanges"""
         return [item.name for item in self._exchanges]
 
+    def get_not_sharded_exchanges_names(self):
+        """Return names of exchanges, whose pairs are served by one worker process"""
+        return [item.name for item in self._exchanges if not item.shard_by_pair]
+
     def create_exchange(self, name):
         """Get exchange
 
@@ -36,6 +42,17 @@ class ExchangeFactory:
             exchange = list(filter(lambda item: item.name == name, self._exchanges))
             if exchange:
                 self._instances_exchanges[name] = exchange[0](mq_exchanger=self.exchanger)
+                if exchange[0].shard_by_pair and self.rate_limit_share != 1:
+                    self._instances_exchanges[name]._rate_limiter.scale(self.rate_limit_share)
             else:
                 raise ExchangeNotExistError(name)
         return self._instances_exchanges[name]
+
+    def rate_limits_usage(self):
+        """Return REST API limits usage of created exchanges: {exchange_name: {endpoint_class: metrics}}"""
+        return {name: exchange.rate_limits_usage() for name, exchange in self._instances_exchanges.items()}
+
+    async def close(self):
+        """Close connections of all created exchanges"""
+        for exchange in self._instances_exchanges.values():
+            await exchange.close()
@@ -1,7 +1,8 @@
 from exchanges.abstract_exchange import BaseExchange
-from aiohttp import ClientSession
-import asyncio
-import json
+from exchanges.order_book import OrderBook, OrderBookError
+from exchanges.rate_limiter import RateLimiter
+from exchanges.stream_multiplexer import StreamError
+import json_codec
 
 
 class Binance(BaseExchange):
@@ -12,232 +13,304 @@ class Binance(BaseExchange):
     def __init__(self, mq_exchanger):
         super().__init__(mq_exchanger)
 
-        self._root_url_ws = 'wss://stream.binance.com:9443/ws'
+        self._root_url_ws = 'wss://stream.binance.com:9443/stream'
         self._root_url_rest = 'https://api.binance.com'
 
+        # Limits of combined streams connection
+        self.ws_streams_per_connection = 1024
+        self.ws_messages_per_second = 5
+
+        # Requests weight limit of IP, heaviest request is depth snapshot of 1000 levels
+        self._rate_limiter = RateLimiter(dict(weight=(1200, 60, 10)))
+
         # Key this unification view for this MS, value dict this variable for request to API exchange
         self._timeframe_translate = dict([('M1', '1m'), ('M5', '5m'), ('M15', '15m'), ('M30', '30m'),
                                           ('H1', '1h'), ('H4', '4h'), ('D1', '1d'), ('1W', '1w')])
         self.access_timeframes = list(self._timeframe_translate.keys())
 
+    def _ws_subscribe_message(self, key, request_id):
+        return {"method": "SUBSCRIBE", "params": [key], "id": request_id}
+
+    def _ws_unsubscribe_message(self, key, request_id):
+        return {"method": "UNSUBSCRIBE", "params": [key], "id": request_id}
+
+    async def _ws_route(self, ws, data):
+        # Data format
+        """
+        Stream message:
+        {"stream": "<streamName>", "data": <rawPayload>}
+
+        Result of SUBSCRIBE/UNSUBSCRIBE:
+        {"result": null, "id": 1}
+        {"error": {"code": 2, "msg": "Invalid request"}, "id": 1}
+        """
+        if 'stream' in data:
+            return [(data['stream'], data['data'])]
+        if data.get('error'):
+            raise StreamError(f'Binance stream error: {data["error"]}', request_id=data.get('id'))
+        return []
+
     async def _get_access_symbols(self):
-        async with ClientSession() as session:
-            url = f'{self._root_url_rest}/api/v3/ticker/price'
-            async with session.get(url) as response:
-                response = await response.text()
+        session = self._get_session()
+        url = f'{self._root_url_rest}/api/v3/ticker/price'
+        await self._rate_limiter.acquire('weight', weight=2)
+        async with session.get(url) as response:
+            response = await response.read()
 
-                # Data format
-                """
-                [
-                  {
-                    "symbol": "LTCBTC",
-                    "price": "4.00000200"
-                  },
-                  {
-                    "symbol": "ETHBTC",
-                    "price": "0.07946600"
-                  }
-                ]
-                """
-                response = json.loads(response)
-                symbols = [item['symbol'] for item in response]
+            # Data format
+            """
+            [
+              {
+                "symbol": "LTCBTC",
+                "price": "4.00000200"
+              },
+              {
+                "symbol": "ETHBTC",
+                "price": "0.07946600"
+              }
+            ]
+            """
+            response = json_codec.loads(response)
+            symbols = [item['symbol'] for item in response]
 
-                return symbols
+            return symbols
 
     async def _get_starting_ticker(self, queue_name, symbol):
         url_rest = f'{self._root_url_rest}/api/v3/ticker/bookTicker?symbol={symbol}'
-        async with ClientSession() as session:
-            async with session.get(url_rest) as response:
-                response = await response.text()
+        session = self._get_session()
+        await self._rate_limiter.acquire('weight')
+        async with session.get(url_rest) as response:
+            response = await response.read()
 
-                # Data format:
-                """
-                {
-                    "symbol":"BTCUSDT",
-                    "bidPrice":"10724.80000000",
-                    "bidQty":"0.39682900",
-                    "askPrice":"10726.80000000",
-                    "askQty":"0.06294600"
-                }
-                """
-                ticker = json.loads(response)
-                await self._send_data_in_exchange(queue_name, (ticker['bidPrice'], ticker['askPrice']))
+            # Data format:
+            """
+            {
+                "symbol":"BTCUSDT",
+                "bidPrice":"10724.80000000",
+                "bidQty":"0.39682900",
+                "askPrice":"10726.80000000",
+                "askQty":"0.06294600"
+            }
+            """
+            ticker = json_codec.loads(response)
+            await self._send_data_in_exchange(queue_name, (ticker['bidPrice'], ticker['askPrice']))
 
-    async def _get_starting_candles(self, queue_name, symbol, time_frame):
-        async with ClientSession() as session:
-            url = f'{self._root_url_rest}/api/v1/klines?symbol={symbol}' \
-                f'&interval={self._timeframe_translate[time_frame]}&limit={self.request_candles}'
-            async with session.get(url) as response:
-                response = await response.text()
-                array_candles = json.loads(response)
+    async def _request_candles(self, symbol, time_frame):
+        session = self._get_session()
+        url = f'{self._root_url_rest}/api/v1/klines?symbol={symbol}' \
+            f'&interval={self._timeframe_translate[time_frame]}&limit={self.request_candles}'
+        await self._rate_limiter.acquire('weight')
+        async with session.get(url) as response:
+            response = await response.read()
+            array_candles = json_codec.loads(response)
 
-                # Data format:
-                """
-                [
-                  [
-                    1499040000000,      // Open time
-                    "0.01634790",       // Open
-                    "0.80000000",       // High
-                    "0.01575800",       // Low
-                    "0.01577100",       // Close
-                    "148976.11427815",  // Volume
-                    1499644799999,      // Close time
-                    "2434.19055334",    // Quote asset volume
-                    308,                // Number of trades
-                    "1756.87402397",    // Taker buy base asset volume
-                    "28.46694368",      // Taker buy quote asset volume
-                    "17928899.62484339" // Ignore.
-                  ],
-                  ...
-                ]
-                """
-                candles = []
-                for item in array_candles:
-                    time = int(item[0]) // 1000
-                    candles.append((item[1], item[2], item[3], item[4], item[5], time))
+            # Data format:
+            """
+            [
+              [
+                1499040000000,      // Open time
+                "0.01634790",       // Open
+                "0.80000000",       // High
+                "0.01575800",       // Low
+                "0.01577100",       // Close
+                "148976.11427815",  // Volume
+                1499644799999,      // Close time
+                "2434.19055334",    // Quote asset volume
+                308,                // Number of trades
+                "1756.87402397",    // Taker buy base asset volume
+                "28.46694368",      // Taker buy quote asset volume
+                "17928899.62484339" // Ignore.
+              ],
+              ...
+            ]
+            """
+            candles = []
+            for item in array_candles:
+                time = int(item[0]) // 1000
+                candles.append((item[1], item[2], item[3], item[4], item[5], time))
 
-                await self._send_data_in_exchange(queue_name, candles)
+            return candles
+
+    async def _fetch_candles_page(self, symbol, time_frame, start, end):
+        session = self._get_session()
+        url = f'{self._root_url_rest}/api/v3/klines?symbol={symbol}' \
+            f'&interval={self._timeframe_translate[time_frame]}&startTime={start * 1000}&endTime={end * 1000 - 1}' \
+            f'&limit={self.candles_page_size}'
+        await self._rate_limiter.acquire('weight')
+        async with session.get(url) as response:
+            response = await response.read()
+
+            # Data format same as in _request_candles
+            array_candles = json_codec.loads(response)
+            return [(item[1], item[2], item[3], item[4], item[5], int(item[0]) // 1000) for item in array_candles]
 
     async def _get_starting_depth(self, queue_name, symbol):
         url = f'{self._root_url_rest}/api/v1/depth?symbol={symbol}&limit=20'
-        async with ClientSession() as session:
-            async with session.get(url) as response:
-                response = await response.text()
+        session = self._get_session()
+        await self._rate_limiter.acquire('weight')
+        async with session.get(url) as response:
+            response = await response.read()
 
-                # Data format:
+            # Data format:
+            """
+            {
+              "lastUpdateId": 1027024,
+              "bids": [
+                [
+                  "4.00000000",     // PRICE
+                  "431.00000000"    // QTY
+                ]
+              ],
+              "asks": [
+                [
+                  "4.00000200",
+                  "12.00000000"
+                ]
+              ]
+            }
+            """
+            bid_ask = json_codec.loads(response)
+            asks = [(item[0], item[1]) for item in bid_ask['asks']]
+            bids = [(item[0], item[1]) for item in bid_ask['bids']]
+            asks.reverse()
+
+            await self._send_data_in_exchange(queue_name, (bids, asks))
+
+    async def _subscribe_ticker(self, queue_name, symbol):
+        async with self._streams.subscribe(f'{symbol.lower()}@ticker') as subscription:
+            while True:
+                data = await subscription.get()
+
+                # Data format
                 """
                 {
-                  "lastUpdateId": 1027024,
-                  "bids": [
-                    [
-                      "4.00000000",     // PRICE
-                      "431.00000000"    // QTY
-                    ]
-                  ],
-                  "asks": [
-                    [
-                      "4.00000200",
-                      "12.00000000"
-                    ]
-                  ]
+                  "e": "24hrTicker",  // Event type
+                  "E": 123456789,     // Event time
+                  "s": "BNBBTC",      // Symbol
+                  "p": "0.0015",      // Price change
+                  "P": "250.00",      // Price change percent
+                  "w": "0.0018",      // Weighted average price
+                  "x": "0.0009",      // First trade(F)-1 price (first trade before the 24hr rolling window)
+                  "c": "0.0025",      // Last price
+                  "Q": "10",          // Last quantity
+                  "b": "0.0024",      // Best bid price
+                  "B": "10",          // Best bid quantity
+                  "a": "0.0026",      // Best ask price
+                  "A": "100",         // Best ask quantity
+                  "o": "0.0010",      // Open price
+                  "h": "0.0025",      // High price
+                  "l": "0.0010",      // Low price
+                  "v": "10000",       // Total traded base asset volume
+                  "q": "18",          // Total traded quote asset volume
+                  "O": 0,             // Statistics open time
+                  "C": 86400000,      // Statistics close time
+                  "F": 0,             // First trade ID
+                  "L": 18150,         // Last trade Id
+                  "n": 18151          // Total number of trades
                 }
                 """
-                bid_ask = json.loads(response)
-                asks = [(item[0], item[1]) for item in bid_ask['asks']]
-                bids = [(item[0], item[1]) for item in bid_ask['bids']]
-                asks.reverse()
+                bid_ask = (data['b'], data['a'])
+                await self._send_data_in_exchange(queue_name, bid_ask)
 
-                await self._send_data_in_exchange(queue_name, (bids, asks))
+    async def _subscribe_candles(self, queue_name, symbol, time_frame):
+        key = f'{symbol.lower()}@kline_{self._timeframe_translate[time_frame]}'
+        async with self._streams.subscribe(key) as subscription:
+            while True:
+                data = await subscription.get()
 
-    async def _subscribe_ticker(self, queue_name, symbol):
-        async with ClientSession() as session:
-            url = f'{self._root_url_ws}/{symbol.lower()}@ticker'
-            async with session.ws_connect(url) as ws:
-                while True:
-                    response = await ws.receive()
-                    data = json.loads(response.data)
-
-                    # Data format
-                    """
-                    {
-                      "e": "24hrTicker",  // Event type
-                      "E": 123456789,     // Event time
-                      "s": "BNBBTC",      // Symbol
-                      "p": "0.0015",      // Price change
-                      "P": "250.00",      // Price change percent
-                      "w": "0.0018",      // Weighted average price
-                      "x": "0.0009",      // First trade(F)-1 price (first trade before the 24hr rolling window)
-                      "c": "0.0025",      // Last price
-                      "Q": "10",          // Last quantity
-                      "b": "0.0024",      // Best bid price
-                      "B": "10",          // Best bid quantity
-                      "a": "0.0026",      // Best ask price
-                      "A": "100",         // Best ask quantity
-                      "o": "0.0010",      // Open price
-                      "h": "0.0025",      // High price
-                      "l": "0.0010",      // Low price
-                      "v": "10000",       // Total traded base asset volume
-                      "q": "18",          // Total traded quote asset volume
-                      "O": 0,             // Statistics open time
-                      "C": 86400000,      // Statistics close time
-                      "F": 0,             // First trade ID
-                      "L": 18150,         // Last trade Id
-                      "n": 18151          // Total number of trades
-                    }
-                    """
-                    bid_ask = (data['b'], data['a'])
-                    await self._send_data_in_exchange(queue_name, bid_ask)
+                # Data format:
+                """
+                {
+                  "e": "kline",     // Event type
+                  "E": 123456789,   // Event time
+                  "s": "BNBBTC",    // Symbol
+                  "k": {
+                    "t": 123400000, // Kline start time
+                    "T": 123460000, // Kline close time
+                    "s": "BNBBTC",  // Symbol
+                    "i": "1m",      // Interval
+                    "f": 100,       // First trade ID
+                    "L": 200,       // Last trade ID
+                    "o": "0.0010",  // Open price
+                    "c": "0.0020",  // Close price
+                    "h": "0.0025",  // High price
+                    "l": "0.0015",  // Low price
+                    "v": "1000",    // Base asset volume
+                    "n": 100,       // Number of trades
+                    "x": false,     // Is this kline closed?
+                    "q": "1.0000",  // Quote asset volume
+                    "V": "500",     // Taker buy base asset volume
+                    "Q": "0.500",   // Taker buy quote asset volume
+                    "B": "123456"   // Ignore
+                  }
+                }
+                """
+                candle_data = data['k']
+                time = int(candle_data['t']) // 1000
+                candle = (candle_data['o'], candle_data['h'], candle_data['l'], candle_data['c'], candle_data['v'],
+                          time)
 
-    async def _subscribe_candles(self, queue_name, symbol, time_frame):
-        async with ClientSession() as session:
-            url = f'{self._root_url_ws}/{symbol.lower()}@kline_{self._timeframe_translate[time_frame]}'
-            async with session.ws_connect(url) as ws:
-                while True:
-                    response = await ws.receive()
-
-                    # Data format:
-                    """
-                    {
-                      "e": "kline",     // Event type
-                      "E": 123456789,   // Event time
-                      "s": "BNBBTC",    // Symbol
-                      "k": {
-                        "t": 123400000, // Kline start time
-                        "T": 123460000, // Kline close time
-                        "s": "BNBBTC",  // Symbol
-                        "i": "1m",      // Interval
-                        "f": 100,       // First trade ID
-                        "L": 200,       // Last trade ID
-                        "o": "0.0010",  // Open price
-                        "c": "0.0020",  // Close price
-                        "h": "0.0025",  // High price
-                        "l": "0.0015",  // Low price
-                        "v": "1000",    // Base asset volume
-                        "n": 100,       // Number of trades
-                        "x": false,     // Is this kline closed?
-                        "q": "1.0000",  // Quote asset volume
-                        "V": "500",     // Taker buy base asset volume
-                        "Q": "0.500",   // Taker buy quote asset volume
-                        "B": "123456"   // Ignore
-                      }
-                    }
-                    """
-                    candle_data = json.loads(response.data)['k']
-                    time = int(candle_data['t']) // 1000
-                    candle = (candle_data['o'], candle_data['h'], candle_data['l'], candle_data['c'], candle_data['v'],
-                              time)
-
-                    await self._send_data_in_exchange(queue_name, candle)
+                await self._send_data_in_exchange(queue_name, candle)
 
     async def _subscribe_depth(self, queue_name, symbol):
-        url_rest = f'{self._root_url_rest}/api/v1/depth?symbol={symbol}&limit=20'
-        async with ClientSession() as session:
+        book = OrderBook()
+        # events are buffered in subscription, while snapshot is loading
+        async with self._streams.subscribe(f'{symbol.lower()}@depth@100ms') as subscription:
             while True:
-                async with session.get(url_rest) as response:
-                    response = await response.text()
-
-                    # Data format:
-                    """
-                    {
-                      "lastUpdateId": 1027024,
-                      "bids": [
-                        [
-                          "4.00000000",     // PRICE
-                          "431.00000000"    // QTY
-                        ]
-                      ],
-                      "asks": [
-                        [
-                          "4.00000200",
-                          "12.00000000"
-                        ]
-                      ]
-                    }
-                    """
-                    bid_ask = json.loads(response)
-                    asks = [(item[0], item[1]) for item in bid_ask['asks']]
-                    bids = [(item[0], item[1]) for item in bid_ask['bids']]
-                    asks.reverse()
-
-                    await self._send_data_in_exchange(queue_name, (bids, asks))
-                    await asyncio.sleep(self.time_out)
+                book.reset(*(await self._request_depth_snapshot(symbol)))
+                try:
+                    while True:
+                        event = await subscription.get()
+
+                        # Data format:
+                        """
+                        {
+                          "e": "depthUpdate", // Event type
+                          "E": 123456789,     // Event time
+                          "s": "BNBBTC",      // Symbol
+                          "U": 157,           // First update ID in event
+                          "u": 160,           // Final update ID in event
+                          "b": [              // Bids to be updated
+                            [
+                              "0.0024",       // Price level to be updated
+                              "10"            // Quantity
+                            ]
+                          ],
+                          "a": [              // Asks to be updated
+                            [
+                              "0.0026",       // Price level to be updated
+                              "100"           // Quantity
+                            ]
+                          ]
+                        }
+                        """
+                        # event is older than snapshot
+                        if event['u'] <= book.sequence:
+                            continue
+                        if event['U'] > book.sequence + 1:
+                            raise OrderBookError(f'Gap in depth updates: {book.sequence} -> {event["U"]}')
+
+                        book.update(event['b'], event['a'], event['u'])
+                        if subscription.empty():
+                            await self._send_data_in_exchange(queue_name, book.top(self.depth_levels))
+                except OrderBookError:
+                    continue
+
+    async def _request_depth_snapshot(self, symbol):
+        """Return (bids, asks, last_update_id) of depth snapshot for synchronize local order book"""
+        url = f'{self._root_url_rest}/api/v3/depth?symbol={symbol}&limit=1000'
+        session = self._get_session()
+        await self._rate_limiter.acquire('weight', weight=10)
+        async with session.get(url) as response:
+            response = await response.read()
+
+            # Data format:
+            """
+            {
+              "lastUpdateId": 1027024,
+              "bids": [["4.00000000", "431.00000000"], ...],
+              "asks": [["4.00000200", "12.00000000"], ...]
+            }
+            """
+            snapshot = json_codec.loads(response)
+            return snapshot['bids'], snapshot['asks'], snapshot['lastUpdateId']
@@ -1,14 +1,19 @@
 from exchanges.abstract_exchange import BaseExchange
-from aiohttp import ClientSession
-import datetime
-import asyncio
-import json
+from exchanges.poll_scheduler import PollScheduler
+from exchanges.rate_limiter import RateLimiter
+from exchanges.timestamps import iso_to_unix_many
+from exchanges import timeframes
+from functools import partial
+import time as time_module
+import json_codec
 
 
 class Bittrex(BaseExchange):
     """Connector to Bittrex (Use api v3)"""
 
     name = 'Bittrex'
+    # tickers of all pairs are polled by one request, so one worker process poll them
+    shard_by_pair = False
 
     def __init__(self, mq_exchanger):
         super().__init__(mq_exchanger)
@@ -17,214 +22,199 @@ class Bittrex(BaseExchange):
         # Key this unification view for this MS, value dict this variable for API exchange
         self._timeframe_translate = dict([('M1', 'MINUTE_1'), ('M5', 'MINUTE_5'), ('H1', 'HOUR_1'), ('D1', 'DAY_1')])
         self.access_timeframes = list(self._timeframe_translate.keys())
+        # historical candles are grouped by day (minutes), month (hours) or year (days)
+        self._history_period = dict([('M1', 'D1'), ('M5', 'D1'), ('H1', '1M'), ('D1', '1Y')])
+
+        # Bittrex has not public WebSocket streams in this connector, all subscriptions are polled.
+        # API allow 60 requests per minute
+        self._poller = PollScheduler(self.time_out, max_requests_per_second=1)
+        self._rate_limiter = RateLimiter(dict(requests=(60, 60)))
 
     async def _get_access_symbols(self):
-        async with ClientSession() as session:
-            url = f'{self._root_url_rest}/v3/markets'
-            async with session.get(url) as response:
-                response = await response.text()
-
-                # Data format
-                """
-                [
-                  {
-                    "symbol": "string",
-                    "baseCurrencySymbol": "string",
-                    "quoteCurrencySymbol": "string",
-                    "minTradeSize": "number (double)",
-                    "precision": "integer (int32)",
-                    "status": "string",
-                    "createdAt": "string (date-time)",
-                    "notice": "string"
-                  }
-                ]
-                """
-                response = json.loads(response)
-                symbols = [item['symbol'].replace('-', '') for item in response]
-
-                return symbols
+        session = self._get_session()
+        url = f'{self._root_url_rest}/v3/markets'
+        await self._rate_limiter.acquire('requests')
+        async with session.get(url) as response:
+            response = await response.read()
+
+            # Data format
+            """
+            [
+              {
+                "symbol": "string",
+                "baseCurrencySymbol": "string",
+                "quoteCurrencySymbol": "string",
+                "minTradeSize": "number (double)",
+                "precision": "integer (int32)",
+                "status": "string",
+                "createdAt": "string (date-time)",
+                "notice": "string"
+              }
+            ]
+            """
+            response = json_codec.loads(response)
+            self._symbol_index.rebuild((item['symbol'].replace('-', ''), item['symbol']) for item in response)
+
+            return self._symbol_index.symbols()
 
     async def _get_starting_ticker(self, queue_name, symbol):
-        async with ClientSession() as session:
-            url = f'{self._root_url_rest}/v3/markets/{(await self._symbol_translate(symbol, session))}/ticker'
-            async with session.get(url) as response:
-                response = await response.text()
-                bid_ask = json.loads(response)
-
-                # Data format
-                """
-                {
-                  "symbol": "string",
-                  "lastTradeRate": "number (double)",
-                  "bidRate": "number (double)",
-                  "askRate": "number (double)"
-                }
-                """
-                bid_ask = (bid_ask['bidRate'], bid_ask['askRate'])
-                await self._send_data_in_exchange(queue_name, bid_ask)
+        session = self._get_session()
+        url = f'{self._root_url_rest}/v3/markets/{(await self._symbol_translate(symbol))}/ticker'
+        await self._rate_limiter.acquire('requests')
+        async with session.get(url) as response:
+            response = await response.read()
+            bid_ask = json_codec.loads(response)
 
-    async def _get_starting_candles(self, queue_name, symbol, time_frame):
-        async with ClientSession() as session:
-            url = f'{self._root_url_rest}/v3/markets/{(await self._symbol_translate(symbol, session))}' \
-                f'/candles?CandleInterval={self._timeframe_translate[time_frame]}'
-            async with session.get(url) as response:
-                response = await response.text()
-                candles_data = json.loads(response)
-
-                # Data format
-                """
-                [
-                  {
-                    "startsAt": "string (date-time)",
-                    "open": "number (double)",
-                    "high": "number (double)",
-                    "low": "number (double)",
-                    "close": "number (double)",
-                    "volume": "number (double)",
-                    "baseVolume": "number (double)"
-                  }
-                ]
-                """
-                candles = []
-                for item in candles_data:
-                    time = int(datetime.datetime.strptime(item['startsAt'], "%Y-%m-%dT%H:%M:%fZ").timestamp())
-                    candles.append((item['open'], item['high'], item['low'], item['close'], item['volume'],
-                                    time))
-
-                await self._send_data_in_exchange(queue_name, candles)
+            # Data format
+            """
+            {
+              "symbol": "string",
+              "lastTradeRate": "number (double)",
+              "bidRate": "number (double)",
+              "askRate": "number (double)"
+            }
+            """
+            bid_ask = (bid_ask['bidRate'], bid_ask['askRate'])
+            await self._send_data_in_exchange(queue_name, bid_ask)
 
     async def _get_starting_depth(self, queue_name, symbol):
-        async with ClientSession() as session:
-            url = f'{self._root_url_rest}/v3/markets/{(await self._symbol_translate(symbol, session))}/orderbook'
-            async with session.get(url) as response:
-                response = await response.text()
-                bid_ask = json.loads(response)
-
-                # Data format
-                """
-                {
-                  "bid": [
-                    {
-                      "quantity": "number (double)",
-                      "rate": "number (double)"
-                    }
-                  ],
-                  "ask": [
-                    {
-                      "quantity": "number (double)",
-                      "rate": "number (double)"
-                    }
-                  ]
-                }
-                """
-                asks = [(item['rate'], item['quantity']) for item in bid_ask['ask']][:20]
-                bids = [(item['rate'], item['quantity']) for item in bid_ask['bid']][:20]
-                asks.reverse()
-
-                await self._send_data_in_exchange(queue_name, (bids, asks))
+        depth = await self._request_depth(await self._symbol_translate(symbol))
+        await self._send_data_in_exchange(queue_name, depth)
 
     async def _subscribe_ticker(self, queue_name, symbol):
-        async with ClientSession() as session:
-            url = f'{self._root_url_rest}/v3/markets/{(await self._symbol_translate(symbol, session))}/ticker'
+        # tickers of all markets are requested by one request
+        native_symbol = await self._symbol_translate(symbol)
+        async with self._poller.subscribe('tickers', self._request_tickers, native_symbol) as subscription:
             while True:
-                async with session.get(url) as response:
-                    response = await response.text()
-                    bid_ask = json.loads(response)
-
-                    # Data format
-                    """
-                    {
-                      "symbol": "string",
-                      "lastTradeRate": "number (double)",
-                      "bidRate": "number (double)",
-                      "askRate": "number (double)"
-                    }
-                    """
-                    await self._send_data_in_exchange(queue_name, (bid_ask['bidRate'], bid_ask['askRate']))
-                    await asyncio.sleep(self.time_out)
+                bid_ask = await subscription.get()
+                await self._send_data_in_exchange(queue_name, bid_ask)
 
     async def _subscribe_candles(self, queue_name, symbol, time_frame):
-        async with ClientSession() as session:
-            url = f'{self._root_url_rest}/v3/markets/{(await self._symbol_translate(symbol, session))}' \
-                f'/candles?CandleInterval={self._timeframe_translate[time_frame]}'
+        native_symbol = await self._symbol_translate(symbol)
+        fetch = partial(self._request_candles, symbol, time_frame)
+        async with self._poller.subscribe(f'candles:{native_symbol}:{time_frame}', fetch) as subscription:
             while True:
-                async with session.get(url) as response:
-                    response = await response.text()
-
-                    # Data format
-                    """
-                    [
-                      {
-                        "startsAt": "string (date-time)",
-                        "open": "number (double)",
-                        "high": "number (double)",
-                        "low": "number (double)",
-                        "close": "number (double)",
-                        "volume": "number (double)",
-                        "baseVolume": "number (double)"
-                      }
-                    ]
-                    """
-                    candle = json.loads(response)[-1]
-                    time = int(datetime.datetime.strptime(candle['startsAt'], "%Y-%m-%dT%H:%M:%fZ").timestamp())
-                    candle = (candle['open'], candle['high'], candle['low'], candle['close'], candle['volume'], time)
-
-                    await self._send_data_in_exchange(queue_name, candle)
-                    await asyncio.sleep(self.time_out)
+                candles = await subscription.get()
+                await self._send_data_in_exchange(queue_name, candles[-1])
 
     async def _subscribe_depth(self, queue_name, symbol):
-        async with ClientSession() as session:
-            url = f'{self._root_url_rest}/v3/markets/{(await self._symbol_translate(symbol, session))}/orderbook'
+        native_symbol = await self._symbol_translate(symbol)
+        fetch = partial(self._request_depth, native_symbol)
+        async with self._poller.subscribe(f'orderbook:{native_symbol}', fetch) as subscription:
             while True:
-                async with session.get(url) as response:
-                    response = await response.text()
-                    bid_ask = json.loads(response)
-
-                    # Data format
-                    """
-                    {
-                      "bid": [
-                        {
-                          "quantity": "number (double)",
-                          "rate": "number (double)"
-                        }
-                      ],
-                      "ask": [
-                        {
-                          "quantity": "number (double)",
-                          "rate": "number (double)"
-                        }
-                      ]
-                    }
-                    """
-                    asks = [(item['rate'], item['quantity']) for item in bid_ask['ask']][:20]
-                    bids = [(item['rate'], item['quantity']) for item in bid_ask['bid']][:20]
-                    asks.reverse()
-
-                    await self._send_data_in_exchange(queue_name, (bids, asks))
-                    await asyncio.sleep(self.time_out)
-
-    async def _symbol_translate(self, symbol, session):
-        url = f'{self._root_url_rest}/v3/markets'
+                depth = await subscription.get()
+                await self._send_data_in_exchange(queue_name, depth)
+
+    async def _request_tickers(self):
+        """Return dict {market symbol: (bid, ask)} for all markets"""
+        session = self._get_session()
+        url = f'{self._root_url_rest}/v3/markets/tickers'
+        await self._rate_limiter.acquire('requests')
         async with session.get(url) as response:
-            response = await response.text()
-            response = json.loads(response)
+            response = await response.read()
+            tickers = json_codec.loads(response)
 
             # Data format
             """
             [
               {
                 "symbol": "string",
-                "baseCurrencySymbol": "string",
-                "quoteCurrencySymbol": "string",
-                "minTradeSize": "number (double)",
-                "precision": "integer (int32)",
-                "status": "string",
-                "createdAt": "string (date-time)",
-                "notice": "string"
+                "lastTradeRate": "number (double)",
+                "bidRate": "number (double)",
+                "askRate": "number (double)"
               }
             ]
             """
-            for item in response:
-                if item['symbol'].replace('-', '') == symbol:
-                    return item['symbol']
+            return {item['symbol']: (item['bidRate'], item['askRate']) for item in tickers}
+
+    async def _request_candles(self, symbol, time_frame):
+        native_symbol = await self._symbol_translate(symbol)
+        session = self._get_session()
+        url = f'{self._root_url_rest}/v3/markets/{native_symbol}' \
+            f'/candles?CandleInterval={self._timeframe_translate[time_frame]}'
+        await self._rate_limiter.acquire('requests')
+        async with session.get(url) as response:
+            response = await response.read()
+            candles_data = json_codec.loads(response)
+
+            # Data format
+            """
+            [
+              {
+                "startsAt": "string (date-time)",
+                "open": "number (double)",
+                "high": "number (double)",
+                "low": "number (double)",
+                "close": "number (double)",
+                "volume": "number (double)",
+                "baseVolume": "number (double)"
+              }
+            ]
+            """
+            times = iso_to_unix_many(item['startsAt'] for item in candles_data)
+            return [(item['open'], item['high'], item['low'], item['close'], item['volume'], time)
+                    for item, time in zip(candles_data, times)]
+
+    def _candles_pages(self, time_frame, start, end):
+        period = self._history_period[time_frame]
+        pages = []
+        page_start = timeframes.align(start, period)
+        while page_start < end:
+            page_end = timeframes.next_period(page_start, period)
+            pages.append((max(page_start, start), min(page_end, end)))
+            page_start = page_end
+        return pages
+
+    async def _fetch_candles_page(self, symbol, time_frame, start, end):
+        native_symbol = await self._symbol_translate(symbol)
+        date = time_module.gmtime(start)
+        period = self._history_period[time_frame]
+        if period == 'D1':
+            date_path = f'{date.tm_year}/{date.tm_mon}/{date.tm_mday}'
+        elif period == '1M':
+            date_path = f'{date.tm_year}/{date.tm_mon}'
+        else:
+            date_path = f'{date.tm_year}'
+        session = self._get_session()
+        url = f'{self._root_url_rest}/v3/markets/{native_symbol}' \
+            f'/candles/{self._timeframe_translate[time_frame]}/historical/{date_path}'
+        await self._rate_limiter.acquire('requests')
+        async with session.get(url) as response:
+            response = await response.read()
+
+            # Data format same as in _request_candles
+            candles_data = json_codec.loads(response)
+            times = iso_to_unix_many(item['startsAt'] for item in candles_data)
+            return [(item['open'], item['high'], item['low'], item['close'], item['volume'], time)
+                    for item, time in zip(candles_data, times)]
+
+    async def _request_depth(self, native_symbol):
+        """Return depth in format of this MS"""
+        session = self._get_session()
+        url = f'{self._root_url_rest}/v3/markets/{native_symbol}/orderbook'
+        await self._rate_limiter.acquire('requests')
+        async with session.get(url) as response:
+            response = await response.read()
+            bid_ask = json_codec.loads(response)
+
+            # Data format
+            """
+            {
+              "bid": [
+                {
+                  "quantity": "number (double)",
+                  "rate": "number (double)"
+                }
+              ],
+              "ask": [
+                {
+                  "quantity": "number (double)",
+                  "rate": "number (double)"
+                }
+              ]
+            }
+            """
+            asks = [(item['rate'], item['quantity']) for item in bid_ask['ask']][:self.depth_levels]
+            bids = [(item['rate'], item['quantity']) for item in bid_ask['bid']][:self.depth_levels]
+            asks.reverse()
+            return bids, asks
@@ -1,9 +1,9 @@
 from exchanges.abstract_exchange import BaseExchange
-from aiohttp import ClientSession
-from datetime import datetime
-import hashlib
-import asyncio
-import json
+from exchanges.order_book import OrderBook, OrderBookError
+from exchanges.rate_limiter import RateLimiter
+from exchanges.stream_multiplexer import StreamError
+from exchanges.timestamps import iso_to_unix, iso_to_unix_many, unix_to_iso
+import json_codec
 
 
 class HitBTC(BaseExchange):
@@ -20,324 +20,366 @@ class HitBTC(BaseExchange):
         # Key this unification view for this MS, value dict this variable for API exchange
         self.access_timeframes = ('M1', 'M3', 'M5', 'M15', 'M30', 'H1', 'H4', 'D1', 'D7', '1M')
 
+        # API allow 100 requests per second for IP
+        self._rate_limiter = RateLimiter(dict(requests=(100, 1)))
+
+    def _ws_subscribe_message(self, key, request_id):
+        method, params = self._ws_stream_params(key)
+        if method == 'Candles':
+            params['limit'] = 1
+        return {"method": f"subscribe{method}", "params": params, "id": request_id}
+
+    def _ws_unsubscribe_message(self, key, request_id):
+        method, params = self._ws_stream_params(key)
+        return {"method": f"unsubscribe{method}", "params": params, "id": request_id}
+
+    @staticmethod
+    def _ws_stream_params(key):
+        """Stream key format: ticker:<symbol> | orderbook:<symbol> | candles:<symbol>:<period>"""
+        channel, *params = key.split(':')
+        if channel == 'ticker':
+            return 'Ticker', dict(symbol=params[0])
+        elif channel == 'orderbook':
+            return 'Orderbook', dict(symbol=params[0])
+        elif channel == 'candles':
+            return 'Candles', dict(symbol=params[0], period=params[1])
+        raise ValueError(f'Unknown stream {key}')
+
+    async def _ws_route(self, ws, data):
+        # Data format
+        """
+        Notification:
+        {"jsonrpc": "2.0", "method": "ticker | snapshotOrderbook | ...", "params": {..., "symbol": "ETHBTC"}}
+
+        Result of subscribe/unsubscribe:
+        {"jsonrpc": "2.0", "result": true, "id": 123}
+        {"jsonrpc": "2.0", "error": {"code": 2001, "message": "Symbol not found"}, "id": 123}
+        """
+        method = data.get('method')
+        if method == 'ticker':
+            return [(f"ticker:{data['params']['symbol']}", data['params'])]
+        elif method in ('snapshotOrderbook', 'updateOrderbook'):
+            params = data['params']
+            params['method'] = method
+            return [(f"orderbook:{params['symbol']}", params)]
+        elif method in ('snapshotCandles', 'updateCandles'):
+            params = data['params']
+            return [(f"candles:{params['symbol']}:{params['period']}", params)]
+        elif 'error' in data:
+            raise StreamError(f'HitBTC stream error: {data["error"]}', request_id=data.get('id'))
+        return []
+
     async def _get_access_symbols(self):
-        async with ClientSession() as session:
-            url = f'{self._root_url_rest}/api/2/public/symbol'
-            async with session.get(url) as response:
-                response = await response.text()
+        session = self._get_session()
+        url = f'{self._root_url_rest}/api/2/public/symbol'
+        await self._rate_limiter.acquire('requests')
+        async with session.get(url) as response:
+            response = await response.read()
 
-                # Data format:
-                """
-                [      
-                  {
-                    "id": "ETHBTC",
-                    "baseCurrency": "ETH",
-                    "quoteCurrency": "BTC",
-                    "quantityIncrement": "0.001",
-                    "tickSize": "0.000001",
-                    "takeLiquidityRate": "0.001",
-                    "provideLiquidityRate": "-0.0001",
-                    "feeCurrency": "BTC"
-                  }
-                ],
-                ...
-                """
-                response = json.loads(response)
-                symbols = [item['id'] for item in response]
-                return symbols
+            # Data format:
+            """
+            [      
+              {
+                "id": "ETHBTC",
+                "baseCurrency": "ETH",
+                "quoteCurrency": "BTC",
+                "quantityIncrement": "0.001",
+                "tickSize": "0.000001",
+                "takeLiquidityRate": "0.001",
+                "provideLiquidityRate": "-0.0001",
+                "feeCurrency": "BTC"
+              }
+            ],
+            ...
+            """
+            response = json_codec.loads(response)
+            symbols = [item['id'] for item in response]
+            return symbols
 
     async def _get_raw_data_ticker(self, queue_name, symbol):
-        async with ClientSession() as session:
-            url = f'{self._root_url_rest}/api/2/public/ticker/{symbol}'
-            async with session.get(url) as response:
-                response = await response.text()
+        session = self._get_session()
+        url = f'{self._root_url_rest}/api/2/public/ticker/{symbol}'
+        await self._rate_limiter.acquire('requests')
+        async with session.get(url) as response:
+            response = await response.read()
 
-                # Data format
-                """
-                {
-                    "ask": "0.050043",
-                    "bid": "0.050042",
-                    "last": "0.050042",
-                    "open": "0.047800",
-                    "low": "0.047052",
-                    "high": "0.051679",
-                    "volume": "36456.720",
-                    "volumeQuote": "1782.625000",
-                    "timestamp": "2017-05-12T14:57:19.999Z",
-                    "symbol": "ETHBTC"
-                }
-                """
-                ticker = json.loads(response)
-                await self._send_data_in_exchange(queue_name, ticker)
+            # Data format
+            """
+            {
+                "ask": "0.050043",
+                "bid": "0.050042",
+                "last": "0.050042",
+                "open": "0.047800",
+                "low": "0.047052",
+                "high": "0.051679",
+                "volume": "36456.720",
+                "volumeQuote": "1782.625000",
+                "timestamp": "2017-05-12T14:57:19.999Z",
+                "symbol": "ETHBTC"
+            }
+            """
+            ticker = json_codec.loads(response)
+            await self._send_data_in_exchange(queue_name, ticker)
 
     async def _get_starting_ticker(self, queue_name, symbol):
         url = f'{self._root_url_rest}/api/2/public/ticker/{symbol}'
-        async with ClientSession() as session:
-            async with session.get(url) as response:
-                response = await response.text()
+        session = self._get_session()
+        await self._rate_limiter.acquire('requests')
+        async with session.get(url) as response:
+            response = await response.read()
 
-                # Data format
-                """
-                {
-                    "ask": "0.050043",
-                    "bid": "0.050042",
-                    "last": "0.050042",
-                    "open": "0.047800",
-                    "low": "0.047052",
-                    "high": "0.051679",
-                    "volume": "36456.720",
-                    "volumeQuote": "1782.625000",
-                    "timestamp": "2017-05-12T14:57:19.999Z",
-                    "symbol": "ETHBTC"
-                }
-                """
-                ticker = json.loads(response)
-                await self._send_data_in_exchange(queue_name, (ticker['bid'], ticker['ask']))
+            # Data format
+            """
+            {
+                "ask": "0.050043",
+                "bid": "0.050042",
+                "last": "0.050042",
+                "open": "0.047800",
+                "low": "0.047052",
+                "high": "0.051679",
+                "volume": "36456.720",
+                "volumeQuote": "1782.625000",
+                "timestamp": "2017-05-12T14:57:19.999Z",
+                "symbol": "ETHBTC"
+            }
+            """
+            ticker = json_codec.loads(response)
+            await self._send_data_in_exchange(queue_name, (ticker['bid'], ticker['ask']))
 
-    async def _get_starting_candles(self, queue_name, symbol, time_frame):
+    async def _request_candles(self, symbol, time_frame):
         url = f'{self._root_url_rest}/api/2/public/candles/{symbol}?period={time_frame}' \
               f'&limit={self.request_candles}&sort=DESC'
-        async with ClientSession() as session:
-            async with session.get(url) as response:
-                response = await response.text()
-                candles = json.loads(response)
+        session = self._get_session()
+        await self._rate_limiter.acquire('requests')
+        async with session.get(url) as response:
+            response = await response.read()
+            candles = json_codec.loads(response)
 
-                # Data format
-                """
-                [
-                  {
-                    "timestamp": "2017-10-20T20:00:00.000Z",
-                    "open": "0.050459",
-                    "close": "0.050087",
-                    "min": "0.050000",
-                    "max": "0.050511",
-                    "volume": "1326.628",
-                    "volumeQuote": "66.555987736"
-                  },
-                  {
-                    "timestamp": "2017-10-20T20:30:00.000Z",
-                    "open": "0.050108",
-                    "close": "0.050139",
-                    "min": "0.050068",
-                    "max": "0.050223",
-                    "volume": "87.515",
-                    "volumeQuote": "4.386062831"
-                  }
-                ]
-                """
-                formatted_candles = []
-                for candle in candles:
-                    time = int(datetime.strptime(candle['timestamp'], '%Y-%m-%dT%H:%M:%S.%fZ').timestamp())
-                    formatted_candles.append((candle['open'], candle['max'], candle['min'], candle['close'],
-                                              candle['volume'], time))
-                formatted_candles.reverse()
+            # Data format
+            """
+            [
+              {
+                "timestamp": "2017-10-20T20:00:00.000Z",
+                "open": "0.050459",
+                "close": "0.050087",
+                "min": "0.050000",
+                "max": "0.050511",
+                "volume": "1326.628",
+                "volumeQuote": "66.555987736"
+              },
+              {
+                "timestamp": "2017-10-20T20:30:00.000Z",
+                "open": "0.050108",
+                "close": "0.050139",
+                "min": "0.050068",
+                "max": "0.050223",
+                "volume": "87.515",
+                "volumeQuote": "4.386062831"
+              }
+            ]
+            """
+            times = iso_to_unix_many(candle['timestamp'] for candle in candles)
+            formatted_candles = [(candle['open'], candle['max'], candle['min'], candle['close'], candle['volume'], time)
+                                 for candle, time in zip(candles, times)]
+            formatted_candles.reverse()
+
+            return formatted_candles
+
+    async def _fetch_candles_page(self, symbol, time_frame, start, end):
+        url = f'{self._root_url_rest}/api/2/public/candles/{symbol}?period={time_frame}' \
+              f'&from={unix_to_iso(start)}&till={unix_to_iso(end - 1)}&limit={self.candles_page_size}&sort=ASC'
+        session = self._get_session()
+        await self._rate_limiter.acquire('requests')
+        async with session.get(url) as response:
+            response = await response.read()
 
-                await self._send_data_in_exchange(queue_name, formatted_candles)
+            # Data format same as in _request_candles
+            candles = json_codec.loads(response)
+            times = iso_to_unix_many(candle['timestamp'] for candle in candles)
+            return [(candle['open'], candle['max'], candle['min'], candle['close'], candle['volume'], time)
+                    for candle, time in zip(candles, times)]
 
     async def _get_starting_depth(self, queue_name, symbol):
         url = f'{self._root_url_rest}/api/2/public/orderbook/{symbol}?limit=20'
-        async with ClientSession() as session:
-            async with session.get(url) as response:
-                response = await response.text()
+        session = self._get_session()
+        await self._rate_limiter.acquire('requests')
+        async with session.get(url) as response:
+            response = await response.read()
 
-                # Data format
-                """
+            # Data format
+            """
+            {
+              "ask": [
                 {
-                  "ask": [
-                    {
-                      "price": "0.046002",
-                      "size": "0.088"
-                    },
-                    {
-                      "price": "0.046800",
-                      "size": "0.200"
-                    }
-                  ],
-                  "bid": [
-                    {
-                      "price": "0.046001",
-                      "size": "0.005"
-                    },
-                    {
-                      "price": "0.046000",
-                      "size": "0.200"
-                    }
-                  ],
-                  "timestamp": "2018-11-19T05:00:28.193Z"
+                  "price": "0.046002",
+                  "size": "0.088"
+                },
+                {
+                  "price": "0.046800",
+                  "size": "0.200"
                 }
-                """
-                bid_ask = json.loads(response)
-                asks = [(item['price'], item['size']) for item in bid_ask['ask']]
-                bids = [(item['price'], item['size']) for item in bid_ask['bid']]
-                asks.reverse()
-                await self._send_data_in_exchange(queue_name, (bids, asks))
+              ],
+              "bid": [
+                {
+                  "price": "0.046001",
+                  "size": "0.005"
+                },
+                {
+                  "price": "0.046000",
+                  "size": "0.200"
+                }
+              ],
+              "timestamp": "2018-11-19T05:00:28.193Z"
+            }
+            """
+            bid_ask = json_codec.loads(response)
+            asks = [(item['price'], item['size']) for item in bid_ask['ask']]
+            bids = [(item['price'], item['size']) for item in bid_ask['bid']]
+            asks.reverse()
+            await self._send_data_in_exchange(queue_name, (bids, asks))
 
     async def _subscribe_ticker(self, queue_name, symbol):
-        async with ClientSession() as session:
-            async with session.ws_connect(self._root_url_ws) as ws:
-                id_ = hashlib.md5("hitbtc_ticker".encode('utf-8')).hexdigest()
-                json_params = {
-                    "method": "subscribeTicker",
-                    "params": {
-                        "symbol": symbol
-                    },
-                    "id": id_
+        async with self._streams.subscribe(f'ticker:{symbol}') as subscription:
+            while True:
+                # subscription return 'params' of message
+                data = await subscription.get()
+
+                # Data format
+                """
+                {
+                  "jsonrpc": "2.0",
+                  "method": "ticker",
+                  "params": {
+                    "ask": "0.054464",
+                    "bid": "0.054463",
+                    "last": "0.054463",
+                    "open": "0.057133",
+                    "low": "0.053615",
+                    "high": "0.057559",
+                    "volume": "33068.346",
+                    "volumeQuote": "1832.687530809",
+                    "timestamp": "2017-10-19T15:45:44.941Z",
+                    "symbol": "ETHBTC"
+                  }
                 }
-                await ws.send_json(json_params)
-                response = await ws.receive()
-                # первое сообщение это результат соединения
-                if not json.loads(response.data)['result']:
-                    await self._send_error_message(queue_name, response)
-                    return
-
-                while True:
-                    response = await ws.receive()
-
-                    # Data format
-                    """
-                    {
-                      "jsonrpc": "2.0",
-                      "method": "ticker",
-                      "params": {
-                        "ask": "0.054464",
-                        "bid": "0.054463",
-                        "last": "0.054463",
-                        "open": "0.057133",
-                        "low": "0.053615",
-                        "high": "0.057559",
-                        "volume": "33068.346",
-                        "volumeQuote": "1832.687530809",
-                        "timestamp": "2017-10-19T15:45:44.941Z",
-                        "symbol": "ETHBTC"
-                      }
-                    }
-                    """
-                    data = json.loads(response.data)['params']
-                    bid_ask = (data['bid'], data['ask'])
-                    await self._send_data_in_exchange(queue_name, bid_ask)
+                """
+                bid_ask = (data['bid'], data['ask'])
+                await self._send_data_in_exchange(queue_name, bid_ask)
 
     async def _subscribe_candles(self, queue_name, symbol, time_frame):
-        async with ClientSession() as session:
-            async with session.ws_connect(self._root_url_ws) as ws:
-
-                id_ = hashlib.md5("hitbtc_candles".encode('utf-8')).hexdigest()
-                json_params = {
-                    "method": "subscribeCandles",
-                    "params": {
-                        "symbol": symbol,
-                        "period": time_frame,
-                        "limit": 1
-                    },
-                    "id": id_
+        async with self._streams.subscribe(f'candles:{symbol}:{time_frame}') as subscription:
+            while True:
+                # subscription return 'params' of message
+                data = await subscription.get()
+
+                # Data format first message:
+                """
+                {
+                  "jsonrpc": "2.0",
+                  "method": "snapshotCandles",
+                  "params": {
+                    "data": [
+                      {
+                        "timestamp": "2017-10-19T15:00:00.000Z",
+                        "open": "0.054801",
+                        "close": "0.054625",
+                        "min": "0.054601",
+                        "max": "0.054894",
+                        "volume": "380.750",
+                        "volumeQuote": "20.844237223"
+                      },
+                      {
+                        "timestamp": "2017-10-19T15:30:00.000Z",
+                        "open": "0.054616",
+                        "close": "0.054618",
+                        "min": "0.054420",
+                        "max": "0.054724",
+                        "volume": "348.527",
+                        "volumeQuote": "19.011854364"
+                      },
+                      ...
+                    ],
+                    "symbol": "ETHBTC",
+                    "period": "M30"
+                  }
                 }
-                await ws.send_json(json_params)
-                response = await ws.receive()
-                if not json.loads(response.data)['result']:
-                    await self._send_error_message(queue_name, response)
-                    return
-
-                while True:
-                    response = await ws.receive()
-
-                    # Data format first message:
-                    """
-                    {
-                      "jsonrpc": "2.0",
-                      "method": "snapshotCandles",
-                      "params": {
-                        "data": [
-                          {
-                            "timestamp": "2017-10-19T15:00:00.000Z",
-                            "open": "0.054801",
-                            "close": "0.054625",
-                            "min": "0.054601",
-                            "max": "0.054894",
-                            "volume": "380.750",
-                            "volumeQuote": "20.844237223"
-                          },
-                          {
-                            "timestamp": "2017-10-19T15:30:00.000Z",
-                            "open": "0.054616",
-                            "close": "0.054618",
-                            "min": "0.054420",
-                            "max": "0.054724",
-                            "volume": "348.527",
-                            "volumeQuote": "19.011854364"
-                          },
-                          ...
-                        ],
-                        "symbol": "ETHBTC",
-                        "period": "M30"
-                      }
-                    }
-                    """
-                    # Data format notification
-                    """
-                    {
-                      "jsonrpc": "2.0",
-                      "method": "updateCandles",
-                      "params": {
-                        "data": [
-                          {
-                            "timestamp": "2017-10-19T16:30:00.000Z",
-                            "open": "0.054614",
-                            "close": "0.054465",
-                            "min": "0.054339",
-                            "max": "0.054724",
-                            "volume": "141.268",
-                            "volumeQuote": "7.709353873"
-                          }
-                        ],
-                        "symbol": "ETHBTC",
-                        "period": "M30"
+                """
+                # Data format notification
+                """
+                {
+                  "jsonrpc": "2.0",
+                  "method": "updateCandles",
+                  "params": {
+                    "data": [
+                      {
+                        "timestamp": "2017-10-19T16:30:00.000Z",
+                        "open": "0.054614",
+                        "close": "0.054465",
+                        "min": "0.054339",
+                        "max": "0.054724",
+                        "volume": "141.268",
+                        "volumeQuote": "7.709353873"
                       }
-                    }
-                    """
-                    data = json.loads(response.data)
-                    candle = data['params']['data'][0]
-                    time = int(datetime.strptime(candle['timestamp'], '%Y-%m-%dT%H:%M:%S.%fZ').timestamp())
-                    candle = (candle['open'], candle['max'], candle['min'], candle['close'], candle['volume'], time)
+                    ],
+                    "symbol": "ETHBTC",
+                    "period": "M30"
+                  }
+                }
+                """
+                candle = data['data'][0]
+                time = iso_to_unix(candle['timestamp'])
+                candle = (candle['open'], candle['max'], candle['min'], candle['close'], candle['volume'], time)
 
-                    await self._send_data_in_exchange(queue_name, candle)
+                await self._send_data_in_exchange(queue_name, candle)
 
     async def _subscribe_depth(self, queue_name, symbol):
-        url = f'{self._root_url_rest}/api/2/public/orderbook/{symbol}?limit=20'
-        async with ClientSession() as session:
-            while True:
-                async with session.get(url) as response:
-                    response = await response.text()
+        book = OrderBook()
+        while True:
+            # on resubscribe exchange send new snapshot
+            async with self._streams.subscribe(f'orderbook:{symbol}') as subscription:
+                try:
+                    while True:
+                        # subscription return 'params' of message with 'method' key
+                        data = await subscription.get()
 
-                    # Data format
-                    """
-                    {
-                      "ask": [
-                        {
-                          "price": "0.046002",
-                          "size": "0.088"
-                        },
-                        {
-                          "price": "0.046800",
-                          "size": "0.200"
-                        }
-                      ],
-                      "bid": [
-                        {
-                          "price": "0.046001",
-                          "size": "0.005"
-                        },
+                        # Data format
+                        """
                         {
-                          "price": "0.046000",
-                          "size": "0.200"
+                          "jsonrpc": "2.0",
+                          "method": "snapshotOrderbook | updateOrderbook",
+                          "params": {
+                            "ask": [
+                              {
+                                "price": "0.054588",
+                                "size": "0.245"
+                              },
+                              ...
+                            ],
+                            "bid": [
+                              {
+                                "price": "0.054558",
+                                "size": "0.000"      // size == 0 - level is removed
+                              },
+                              ...
+                            ],
+                            "symbol": "ETHBTC",
+                            "sequence": 8073827,
+                            "timestamp": "2018-11-19T05:00:28.193Z"
+                          }
                         }
-                      ],
-                      "timestamp": "2018-11-19T05:00:28.193Z"
-                    }
-                    """
-
-                    bid_ask = json.loads(response)
-                    asks = [(item['price'], item['size']) for item in bid_ask['ask']]
-                    bids = [(item['price'], item['size']) for item in bid_ask['bid']]
-                    asks.reverse()
-
-                    await self._send_data_in_exchange(queue_name, (bids, asks))
-                    await asyncio.sleep(self.time_out)
+                        """
+                        bids = [(item['price'], item['size']) for item in data['bid']]
+                        asks = [(item['price'], item['size']) for item in data['ask']]
+                        if data['method'] == 'snapshotOrderbook':
+                            book.reset(bids, asks, data['sequence'])
+                        elif not book.is_synced:
+                            continue
+                        elif data['sequence'] != book.sequence + 1:
+                            raise OrderBookError(f'Gap in depth updates: {book.sequence} -> {data["sequence"]}')
+                        else:
+                            book.update(bids, asks, data['sequence'])
+
+                        if subscription.empty():
+                            await self._send_data_in_exchange(queue_name, book.top(self.depth_levels))
+                except OrderBookError:
+                    book.clear()
@@ -1,9 +1,8 @@
 from exchanges.abstract_exchange import BaseExchange
-from aiohttp import ClientSession
-import datetime
-import hashlib
+from exchanges.rate_limiter import RateLimiter
+from exchanges.stream_multiplexer import StreamError
+import json_codec
 import gzip
-import json
 
 
 class HuobiGlobal(BaseExchange):
@@ -22,246 +21,247 @@ class HuobiGlobal(BaseExchange):
                                           ('H1', '60min'), ('D1', '1day'), ('1W', '1week'), ('1M', '1mon'),
                                           ('1Y', '1year')])
         self.access_timeframes = list(self._timeframe_translate.keys())
+        # kline API has not time parameters, only last 2000 candles are accessible
+        self.candles_page_size = 2000
+
+        # API allow 100 requests per 10 seconds for IP
+        self._rate_limiter = RateLimiter(dict(requests=(100, 10)))
+        # days, weeks, months of candles start at midnight UTC+8
+        self.candles_utc_offset = 8 * 60 * 60
+
+    def _ws_decode(self, raw_data):
+        return json_codec.loads(gzip.decompress(raw_data))
+
+    def _ws_subscribe_message(self, key, request_id):
+        return {"sub": key, "id": str(request_id)}
+
+    def _ws_unsubscribe_message(self, key, request_id):
+        return {"unsub": key, "id": str(request_id)}
+
+    async def _ws_route(self, ws, data):
+        # Data format
+        """
+        Stream message:
+        {"ch": "market.btcusdt.kline.1min", "ts": 1565437380662, "tick": {...}}
+
+        Heartbeat, server wait {"pong": <same value>}:
+        {"ping": 1492420473027}
+
+        Result of sub/unsub:
+        {"id": "1", "status": "ok", "subbed": "market.btcusdt.kline.1min", "ts": 1489474081631}
+        {"id": "1", "status": "error", "err-code": "bad-request", "err-msg": "invalid topic market...", "ts": ...}
+        """
+        if 'ch' in data:
+            return [(data['ch'], data['tick'])]
+        elif 'ping' in data:
+            await ws.send_json(dict(pong=data['ping']))
+        elif data.get('status') != 'ok':
+            raise StreamError(f'Not "ok" status. Response == {data}', request_id=data.get('id'))
+        return []
 
     async def _get_access_symbols(self):
-        async with ClientSession() as session:
-            url = f'{self._root_url_rest}/v1/common/symbols'
-            async with session.get(url) as response:
-                response = await response.text()
+        session = self._get_session()
+        url = f'{self._root_url_rest}/v1/common/symbols'
+        await self._rate_limiter.acquire('requests')
+        async with session.get(url) as response:
+            response = await response.read()
 
-                # Data format
-                """
-                {
-                  "status":"ok",
-                  "data":
-                  [
-                   {
-                     "base-currency":"eko",
-                     "quote-currency":"btc",
-                     "price-precision":10,
-                     "amount-precision":2,
-                     "symbol-partition":"innovation",
-                     "symbol":"ekobtc","state":"online",
-                     "value-precision":8,"min-order-amt":1,
-                     "max-order-amt":10000000,
-                     "min-order-value":0.0001
-                   },
-                   {...}, ...
-                  ]
-                """
-                response = json.loads(response)['data']
-                symbols = [item['base-currency'].upper() + item['quote-currency'].upper() for item in response]
+            # Data format
+            """
+            {
+              "status":"ok",
+              "data":
+              [
+               {
+                 "base-currency":"eko",
+                 "quote-currency":"btc",
+                 "price-precision":10,
+                 "amount-precision":2,
+                 "symbol-partition":"innovation",
+                 "symbol":"ekobtc","state":"online",
+                 "value-precision":8,"min-order-amt":1,
+                 "max-order-amt":10000000,
+                 "min-order-value":0.0001
+               },
+               {...}, ...
+              ]
+            """
+            response = json_codec.loads(response)['data']
+            symbols = [item['base-currency'].upper() + item['quote-currency'].upper() for item in response]
 
-                return symbols
+            return symbols
 
     async def _get_starting_ticker(self, queue_name, symbol):
-        async with ClientSession() as session:
-            url = f'{self._root_url_rest}/market/detail/merged?symbol={symbol.lower()}'
-            async with session.get(url) as response:
-                response = await response.text()
+        session = self._get_session()
+        url = f'{self._root_url_rest}/market/detail/merged?symbol={symbol.lower()}'
+        await self._rate_limiter.acquire('requests')
+        async with session.get(url) as response:
+            response = await response.read()
 
-                # Data format
-                """
-                "tick": {
-                    "id":  
-                    "amount":  
-                    "count":  
-                    "open":  
-                    "close": Closing price.If this is a latest kline,this shows the current price
-                    "low":  
-                    "high":  
-                    "vol":  volume
-                    "bid": [bid1 price, volume],
-                    "ask": [ask1 price, volume]
-                  }
-                """
-                response = json.loads(response)['tick']
-                ticker = str(response['bid'][0]), str(response['ask'][0])
+            # Data format
+            """
+            "tick": {
+                "id":  
+                "amount":  
+                "count":  
+                "open":  
+                "close": Closing price.If this is a latest kline,this shows the current price
+                "low":  
+                "high":  
+                "vol":  volume
+                "bid": [bid1 price, volume],
+                "ask": [ask1 price, volume]
+              }
+            """
+            response = json_codec.loads(response)['tick']
+            ticker = str(response['bid'][0]), str(response['ask'][0])
 
-                await self._send_data_in_exchange(queue_name, ticker)
+            await self._send_data_in_exchange(queue_name, ticker)
 
-    async def _get_starting_candles(self, queue_name, symbol, time_frame):
-        async with ClientSession() as session:
-            url = f'{self._root_url_rest}/market/history/kline?symbol={symbol.lower()}' \
-                f'&period={self._timeframe_translate[time_frame]}&size={self.request_candles}'
-            async with session.get(url) as response:
-                response = await response.text()
-                response = json.loads(response)
+    async def _request_candles(self, symbol, time_frame):
+        session = self._get_session()
+        url = f'{self._root_url_rest}/market/history/kline?symbol={symbol.lower()}' \
+            f'&period={self._timeframe_translate[time_frame]}&size={self.request_candles}'
+        await self._rate_limiter.acquire('requests')
+        async with session.get(url) as response:
+            response = await response.read()
+            response = json_codec.loads(response)
 
-                # Data format
-                """
-                "data": [
-                {
-                    "id": kline id,
-                    "amount": trading amount,
-                    "count": 
-                    "open": Open price,
-                    "close": Closing price.If this is a latest kline,this shows the current price
-                    "low":  
-                    "high": 
-                    "vol": volume
-                  }
-                ]
-                """
-                candles = []
-                for item in response['data']:
-                    time = int(item['id'])
-                    candles.append((str(item['open']), str(item['high']), str(item['low']),
-                                    str(item['close']), str(item['vol']), time))
-                candles.reverse()
-                await self._send_data_in_exchange(queue_name, candles)
+            # Data format
+            """
+            "data": [
+            {
+                "id": kline id,
+                "amount": trading amount,
+                "count": 
+                "open": Open price,
+                "close": Closing price.If this is a latest kline,this shows the current price
+                "low":  
+                "high": 
+                "vol": volume
+              }
+            ]
+            """
+            candles = []
+            for item in response['data']:
+                time = int(item['id'])
+                candles.append((str(item['open']), str(item['high']), str(item['low']),
+                                str(item['close']), str(item['vol']), time))
+            candles.reverse()
+            return candles
+
+    def _candles_pages(self, time_frame, start, end):
+        # one request return all accessible history
+        return [(start, end)]
+
+    async def _fetch_candles_page(self, symbol, time_frame, start, end):
+        session = self._get_session()
+        url = f'{self._root_url_rest}/market/history/kline?symbol={symbol.lower()}' \
+            f'&period={self._timeframe_translate[time_frame]}&size={self.candles_page_size}'
+        await self._rate_limiter.acquire('requests')
+        async with session.get(url) as response:
+            response = await response.read()
+
+            # Data format same as in _request_candles, sort by time DESC
+            response = json_codec.loads(response)
+            candles = [(str(item['open']), str(item['high']), str(item['low']), str(item['close']),
+                        str(item['vol']), int(item['id']))
+                       for item in response['data'] if start <= int(item['id']) < end]
+            candles.reverse()
+            return candles
 
     async def _get_starting_depth(self, queue_name, symbol):
-        async with ClientSession() as session:
-            url = f'{self._root_url_rest}/market/depth?symbol={symbol.lower()}&type=step1'
-            async with session.get(url) as response:
-                response = await response.text()
+        session = self._get_session()
+        url = f'{self._root_url_rest}/market/depth?symbol={symbol.lower()}&type=step1'
+        await self._rate_limiter.acquire('requests')
+        async with session.get(url) as response:
+            response = await response.read()
 
-                # Data format
-                """
-                "tick": {
-                    "id": 
-                    "ts": millisecond,
-                    "bids":  [price , amount ] 
-                    "asks":  [price , amount ] 
-                  }
-                """
-                response = json.loads(response)['tick']
-                bids = [(str(item[0]), str(item[1])) for item in response['bids']][:20]
-                asks = [(str(item[0]), str(item[1])) for item in response['asks']][:20]
-                asks.reverse()
+            # Data format
+            """
+            "tick": {
+                "id": 
+                "ts": millisecond,
+                "bids":  [price , amount ] 
+                "asks":  [price , amount ] 
+              }
+            """
+            response = json_codec.loads(response)['tick']
+            bids = [(str(item[0]), str(item[1])) for item in response['bids']][:20]
+            asks = [(str(item[0]), str(item[1])) for item in response['asks']][:20]
+            asks.reverse()
 
-                await self._send_data_in_exchange(queue_name, (bids, asks))
+            await self._send_data_in_exchange(queue_name, (bids, asks))
 
     async def _subscribe_ticker(self, queue_name, symbol):
-        async with ClientSession() as session:
-            async with session.ws_connect(self._root_url_ws) as ws:
+        async with self._streams.subscribe(f'market.{symbol.lower()}.depth.step0') as subscription:
+            while True:
+                # subscription return 'tick' of message
+                tick = await subscription.get()
 
-                id_ = hashlib.md5("huobi_ticker".encode('utf-8')).hexdigest()
-                json_params = {
-                    "sub": f'market.{symbol.lower()}.depth.step0',
-                    "id": id_
-                }
-                await ws.send_json(json_params)
-
-                while True:
-                    response = await ws.receive()
-                    response = json.loads(gzip.decompress(response.data).decode("utf-8"))
-
-                    if 'ping' in response.keys():
-                        json_params = dict(pong=str(datetime.datetime.utcnow().timestamp()))
-                        await ws.send_json(json_params)
-                        continue
-                    elif 'status' in response.keys():
-                        if response['status'] != 'ok':
-                            raise Exception('Not "ok" status')
-                        else:
-                            continue
-                    else:
-                        # Data format
-                        """
-                        {
-                          'ch': 'market.btcusdt.depth.step0', 'ts': 1565436814043,
-                          'tick':
-                            {
-                              'bids':
-                              [[11460.01, 0.056187], [11460.0, 42.330615], [11459.93, 0.050624], [11457.22, 0.05], ...],
-                              'asks':
-                              [[...], [...], ...]
-                            }
-                        """
-                        tick = response['tick']
-                        bid_ask = (str(tick['bids'][0][0]), str(tick['asks'][0][0]))
-
-                    await self._send_data_in_exchange(queue_name, bid_ask)
+                # Data format
+                """
+                {
+                  'ch': 'market.btcusdt.depth.step0', 'ts': 1565436814043,
+                  'tick':
+                    {
+                      'bids':
+                      [[11460.01, 0.056187], [11460.0, 42.330615], [11459.93, 0.050624], [11457.22, 0.05], ...],
+                      'asks':
+                      [[...], [...], ...]
+                    }
+                """
+                bid_ask = (str(tick['bids'][0][0]), str(tick['asks'][0][0]))
+                await self._send_data_in_exchange(queue_name, bid_ask)
 
     async def _subscribe_candles(self, queue_name, symbol, time_frame):
-        async with ClientSession() as session:
-            async with session.ws_connect(self._root_url_ws) as ws:
-                id_ = hashlib.md5("huobi_candle".encode('utf-8')).hexdigest()
-                json_params = {
-                    "sub": f"market.{symbol.lower()}.kline.{self._timeframe_translate[time_frame]}",
-                    "id": id_
-                }
-                await ws.send_json(json_params)
-
-                while True:
-                    response = await ws.receive()
-                    response = json.loads(gzip.decompress(response.data).decode("utf-8"))
-
-                    if 'ping' in response.keys():
-                        json_params = dict(pong=str(datetime.datetime.utcnow().timestamp()))
-                        await ws.send_json(json_params)
-                        continue
-                    elif 'status' in response.keys():
-                        if response['status'] != 'ok':
-                            raise Exception('Not "ok" status')
-                        else:
-                            continue
-                    else:
-                        # Data format
-                        """
-                        {'ch': 'market.btcusdt.kline.1min', 'ts': 1565437380662,
-                            'tick':
-                                {
-                                    'id': 1565437380,
-                                    'open': 11404.66,
-                                    'close': 11403.44,
-                                    'low': 11403.44,
-                                    'high': 11404.7,
-                                    'amount': 1.530531,
-                                    'vol': 17454.0186904,
-                                    'count': 7
-                                }
-                        }
-                        """
-                        response = response['tick']
-                        time = response['id']
-                        candle = (str(response['open']), str(response['high']), str(response['low']),
-                                  str(response['close']), str(response['vol']), time)
+        key = f"market.{symbol.lower()}.kline.{self._timeframe_translate[time_frame]}"
+        async with self._streams.subscribe(key) as subscription:
+            while True:
+                # subscription return 'tick' of message
+                tick = await subscription.get()
 
-                    await self._send_data_in_exchange(queue_name, candle)
+                # Data format
+                """
+                {'ch': 'market.btcusdt.kline.1min', 'ts': 1565437380662,
+                    'tick':
+                        {
+                            'id': 1565437380,
+                            'open': 11404.66,
+                            'close': 11403.44,
+                            'low': 11403.44,
+                            'high': 11404.7,
+                            'amount': 1.530531,
+                            'vol': 17454.0186904,
+                            'count': 7
+                        }
+                }
+                """
+                time = tick['id']
+                candle = (str(tick['open']), str(tick['high']), str(tick['low']),
+                          str(tick['close']), str(tick['vol']), time)
+                await self._send_data_in_exchange(queue_name, candle)
 
     async def _subscribe_depth(self, queue_name, symbol):
-        async with ClientSession() as session:
-            async with session.ws_connect(self._root_url_ws) as ws:
+        async with self._streams.subscribe(f'market.{symbol.lower()}.depth.step1') as subscription:
+            while True:
+                # subscription return 'tick' of message
+                tick = await subscription.get()
 
-                id_ = hashlib.md5("huobi_depth".encode('utf-8')).hexdigest()
-                json_params = {
-                    "sub": f'market.{symbol.lower()}.depth.step1',
-                    "id": id_
-                }
-                await ws.send_json(json_params)
-
-                while True:
-                    response = await ws.receive()
-                    data = json.loads(gzip.decompress(response.data).decode("utf-8"))
-
-                    if 'ping' in data.keys():
-                        json_params = dict(pong=str(datetime.datetime.utcnow().timestamp()))
-                        await ws.send_json(json_params)
-                        continue
-                    elif 'status' in data.keys():
-                        if data['status'] != 'ok':
-                            raise Exception('Not "ok" status')
-                        else:
-                            continue
-                    else:
-                        # Data format
-                        """
-                        {
-                          'ch': 'market.btcusdt.depth.step0', 'ts': 1565436814043,
-                          'tick':
-                            {
-                              'bids':
-                              [[11460.01, 0.056187], [11460.0, 42.330615], [11459.93, 0.050624], 
-                              [11457.22, 0.05], ...],
-                              'asks':
-                              [[...], [...], ...]
-                            }
-                        """
-                        bid_ask = data['tick']
-                        bids = [(str(item[0]), str(item[1])) for item in bid_ask['bids']][:20]
-                        asks = [(str(item[0]), str(item[1])) for item in bid_ask['asks']][:20]
-                    asks.reverse()
-                    await self._send_data_in_exchange(queue_name, (bids, asks))
+                # Data format
+                """
+                {
+                  'ch': 'market.btcusdt.depth.step1', 'ts': 1565436814043,
+                  'tick':
+                    {
+                      'bids':
+                      [[11460.01, 0.056187], [11460.0, 42.330615], [11459.93, 0.050624],
+                      [11457.22, 0.05], ...],
+                      'asks':
+                      [[...], [...], ...]
+                    }
+                """
+                bids = [(str(item[0]), str(item[1])) for item in tick['bids']][:20]
+                asks = [(str(item[0]), str(item[1])) for item in tick['asks']][:20]
+                asks.reverse()
+                await self._send_data_in_exchange(queue_name, (bids, asks))
@@ -1,9 +1,14 @@
 from exchanges.abstract_exchange import BaseExchange
-from aiohttp import ClientSession
-import datetime
-import asyncio
-import json
+from exchanges.order_book import OrderBook, OrderBookError
+from exchanges.rate_limiter import RateLimiter
+from exchanges.stream_multiplexer import StreamError
+from exchanges.timestamps import iso_to_unix, iso_to_unix_many, unix_to_iso
+import json_codec
 import zlib
+import re
+
+# channel in error message: spot/ticker:BTC-USDT
+_ERROR_CHANNEL = re.compile(r'[\w-]+/\w+:[\w-]+')
 
 
 class BaseOkExchange(BaseExchange):
@@ -25,388 +30,348 @@ class BaseOkExchange(BaseExchange):
                                           ('M30', '1800'), ('H1', '3600'), ('H2', '7200'), ('H4', '14400'),
                                           ('H12', '43200'), ('D1', '86400'), ('1W', '604800')])
         self.access_timeframes = list(self._timeframe_translate.keys())
+        # days, weeks, months of candles start at midnight UTC+8
+        self.candles_utc_offset = 8 * 60 * 60
+        # API return max 200 candles on one request
+        self.candles_page_size = 200
+        # API limit requests of each endpoint: 20 requests per 2 seconds
+        self._rate_limiter = RateLimiter(dict(tickers=(20, 2), ticker=(20, 2), candles=(20, 2), depth=(20, 2)))
+
+        # server close connection, if it not get messages 30 seconds
+        self.ws_ping_interval = 20
+        # subscribe message take list of channels, its length must be less 4096 bytes
+        self.ws_subscribe_batch_size = 50
+
+    def _ws_decode(self, raw_data):
+        data = self._inflate(raw_data)
+        if data == b'pong':
+            return 'pong'
+        return json_codec.loads(data)
+
+    def _ws_subscribe_message(self, key, request_id):
+        return {"op": "subscribe", "args": [key]}
+
+    def _ws_subscribe_batch_message(self, keys, request_id):
+        return {"op": "subscribe", "args": keys}
+
+    def _ws_unsubscribe_message(self, key, request_id):
+        return {"op": "unsubscribe", "args": [key]}
+
+    async def _ws_route(self, ws, data):
+        # Data format
+        """
+        Stream message:
+        {"table": "spot/ticker", "data": [{"instrument_id": "ETH-USDT", ...}, ...]}
+
+        Result of subscribe/unsubscribe:
+        {"event": "subscribe", "channel": "spot/ticker:ETH-USDT"}
+        {"event": "error", "message": "Channel spot/ticker:BTC-XXX doesn't exist", "errorCode": 30040}
+        """
+        if data == 'pong':
+            return []
+        elif 'table' in data:
+            if 'action' in data:
+                for item in data['data']:
+                    item['action'] = data['action']
+            return [(f"{data['table']}:{item['instrument_id']}", item) for item in data['data']]
+        elif data.get('event') == 'error':
+            # error reply has not request id, channel is found in message
+            channel = _ERROR_CHANNEL.search(data.get('message', ''))
+            raise StreamError(f'event == error. response == {data}', key=channel and channel.group(0))
+        return []
+
+    async def _ws_ping(self, ws):
+        await ws.send_str('ping')
 
     async def _get_access_symbols(self):
-        async with ClientSession() as session:
-            url = f'{self._root_url_rest}/instruments/ticker'
-            async with session.get(url) as response:
-                response = await response.text()
-                response = json.loads(response)
+        session = self._get_session()
+        url = f'{self._root_url_rest}/instruments/ticker'
+        await self._rate_limiter.acquire('tickers')
+        async with session.get(url) as response:
+            response = await response.read()
+            response = json_codec.loads(response)
 
-                # Data format
-                """
-                [
-                    {
-                        "base_currency":"BTC",
-                        "instrument_id":"BTC-USDT",
-                        "min_size":"0.001",
-                        "quote_currency":"USDT",
-                        "size_increment":"0.00000001",
-                        "tick_size":"0.1"
-                    },
-                    {
-                        "base_currency":"OKB",
-                        "instrument_id":"OKB-USDT",
-                        "min_size":"1",
-                        "quote_currency":"USDT",
-                        "size_increment":"0.0001",
-                        "tick_size":"0.0001"
-                    }
-                ]
-                """
-                symbols = [item['product_id'].replace('-', '') for item in response]
-                return symbols
+            # Data format
+            """
+            [
+                {
+                    "base_currency":"BTC",
+                    "instrument_id":"BTC-USDT",
+                    "min_size":"0.001",
+                    "quote_currency":"USDT",
+                    "size_increment":"0.00000001",
+                    "tick_size":"0.1"
+                },
+                {
+                    "base_currency":"OKB",
+                    "instrument_id":"OKB-USDT",
+                    "min_size":"1",
+                    "quote_currency":"USDT",
+                    "size_increment":"0.0001",
+                    "tick_size":"0.0001"
+                }
+            ]
+            """
+            self._symbol_index.rebuild((item['product_id'].replace('-', ''), item['product_id']) for item in response)
+            return self._symbol_index.symbols()
 
     async def _get_starting_ticker(self, queue_name, symbol):
-        async with ClientSession() as session:
-            url = f'{self._root_url_rest}/instruments/{(await self._symbol_translate(symbol, session))}/ticker'
-            async with session.get(url) as response:
-                response = await response.text()
+        session = self._get_session()
+        url = f'{self._root_url_rest}/instruments/{(await self._symbol_translate(symbol))}/ticker'
+        await self._rate_limiter.acquire('ticker')
+        async with session.get(url) as response:
+            response = await response.read()
 
-                # Data format
-                """
+            # Data format
+            """
+            [
+                {
+                    "best_ask":"3995.4",
+                    "best_bid":"3995.3",
+                    "instrument_id":"BTC-USDT",
+                    "product_id":"BTC-USDT",
+                    "last":"3995.3",
+                    "ask":"3995.4",
+                    "bid":"3995.3",
+                    "open_24h":"3989.7",
+                    "high_24h":"4031.9",
+                    "low_24h":"3968.9",
+                    "base_volume_24h":"31254.359231295",
+                    "timestamp":"2019-03-20T04:07:07.912Z",
+                    "quote_volume_24h":"124925963.3459723295"
+                },
+                {
+                    "best_ask":"1.3205",
+                    "best_bid":"1.3204",
+                    "instrument_id":"OKB-USDT",
+                    "product_id":"OKB-USDT",
+                    "last":"1.3205",
+                    "ask":"1.3205",
+                    "bid":"1.3204",
+                    "open_24h":"1.0764",
+                    "high_24h":"1.44",
+                    "low_24h":"1.0601",
+                    "base_volume_24h":"183010468.2062",
+                    "timestamp":"2019-03-20T04:07:05.878Z",
+                    "quote_volume_24h":"233516598.011530085"
+                }
+            ]
+            """
+            data = json_codec.loads(response)
+            await self._send_data_in_exchange(queue_name, (data['best_bid'], data['best_ask']))
+
+    async def _request_candles(self, symbol, time_frame):
+        session = self._get_session()
+        url = f'{self._root_url_rest}/instruments/{(await self._symbol_translate(symbol))}' \
+            f'/candles?granularity={self._timeframe_translate[time_frame]}'
+        await self._rate_limiter.acquire('candles')
+        async with session.get(url) as response:
+            response = await response.read()
+            data = json_codec.loads(response)
+
+            # Data format
+            """
+            [
+                [
+                    "2019-03-19T16:00:00.000Z",
+                    "3997.3",
+                    "4031.9",
+                    "3982.5",
+                    "3998.7",
+                    "26175.21141385"
+                ],
                 [
-                    {
-                        "best_ask":"3995.4",
-                        "best_bid":"3995.3",
-                        "instrument_id":"BTC-USDT",
-                        "product_id":"BTC-USDT",
-                        "last":"3995.3",
-                        "ask":"3995.4",
-                        "bid":"3995.3",
-                        "open_24h":"3989.7",
-                        "high_24h":"4031.9",
-                        "low_24h":"3968.9",
-                        "base_volume_24h":"31254.359231295",
-                        "timestamp":"2019-03-20T04:07:07.912Z",
-                        "quote_volume_24h":"124925963.3459723295"
-                    },
-                    {
-                        "best_ask":"1.3205",
-                        "best_bid":"1.3204",
-                        "instrument_id":"OKB-USDT",
-                        "product_id":"OKB-USDT",
-                        "last":"1.3205",
-                        "ask":"1.3205",
-                        "bid":"1.3204",
-                        "open_24h":"1.0764",
-                        "high_24h":"1.44",
-                        "low_24h":"1.0601",
-                        "base_volume_24h":"183010468.2062",
-                        "timestamp":"2019-03-20T04:07:05.878Z",
-                        "quote_volume_24h":"233516598.011530085"
-                    }
+                    "2019-03-18T16:00:00.000Z",
+                    "3980.6",
+                    "4014.6",
+                    "3968.9",
+                    "3997.3",
+                    "33053.48725643"
                 ]
-                """
-                data = json.loads(response)
-                await self._send_data_in_exchange(queue_name, (data['best_bid'], data['best_ask']))
+            ]
+            """
+            times = iso_to_unix_many(item[0] for item in data)
+            candles = [(item[1], item[2], item[3], item[4], item[5], time) for item, time in zip(data, times)]
+            candles.reverse()
+
+            return candles
+
+    async def _fetch_candles_page(self, symbol, time_frame, start, end):
+        session = self._get_session()
+        url = f'{self._root_url_rest}/instruments/{(await self._symbol_translate(symbol))}' \
+            f'/candles?granularity={self._timeframe_translate[time_frame]}' \
+            f'&start={unix_to_iso(start)}&end={unix_to_iso(end)}'
+        await self._rate_limiter.acquire('candles')
+        async with session.get(url) as response:
+            response = await response.read()
+
+            # Data format same as in _request_candles, sort by time DESC
+            data = json_codec.loads(response)
+            times = iso_to_unix_many(item[0] for item in data)
+            candles = [(item[1], item[2], item[3], item[4], item[5], time) for item, time in zip(data, times)]
+            candles.reverse()
+            return candles
 
-    async def _get_starting_candles(self, queue_name, symbol, time_frame):
-        async with ClientSession() as session:
-            url = f'{self._root_url_rest}/instruments/{(await self._symbol_translate(symbol, session))}' \
-                f'/candles?granularity={self._timeframe_translate[time_frame]}'
-            async with session.get(url) as response:
-                response = await response.text()
-                data = json.loads(response)
+    async def _get_starting_depth(self, queue_name, symbol):
+        session = self._get_session()
+        url = f'{self._root_url_rest}/instruments/{(await self._symbol_translate(symbol))}' \
+            f'/book?size=20&'
+        await self._rate_limiter.acquire('depth')
+        async with session.get(url) as response:
+            response = await response.read()
+            bid_ask = json_codec.loads(response)
 
-                # Data format
-                """
-                [
+            # Data format
+            """
+            {
+                "asks":[
                     [
-                        "2019-03-19T16:00:00.000Z",
-                        "3997.3",
-                        "4031.9",
-                        "3982.5",
-                        "3998.7",
-                        "26175.21141385"
+                        "3993.2",
+                        "0.41600068",
+                        "1"
                     ],
                     [
-                        "2019-03-18T16:00:00.000Z",
-                        "3980.6",
-                        "4014.6",
-                        "3968.9",
-                        "3997.3",
-                        "33053.48725643"
+                        "3993.4",
+                        "1.24807818",
+                        "3"
+                    ],
+                    [
+                        "3993.6",
+                        "0.03",
+                        "1"
+                    ],
+                    [
+                        "3993.8",
+                        "0.03",
+                        "1"
                     ]
-                ]
-                """
-                candles = []
-                for item in data:
-                    time = int(datetime.datetime.strptime(item[0], "%Y-%m-%dT%H:%M:%S.%fZ").timestamp())
-                    candles.append((item[1], item[2], item[3], item[4], item[5], time))
-                candles.reverse()
-
-                await self._send_data_in_exchange(queue_name, candles)
-
-    async def _get_starting_depth(self, queue_name, symbol):
-        async with ClientSession() as session:
-            url = f'{self._root_url_rest}/instruments/{(await self._symbol_translate(symbol, session))}' \
-                f'/book?size=20&'
-            async with session.get(url) as response:
-                response = await response.text()
-                bid_ask = json.loads(response)
-
-                # Data format
-                """
-                {
-                    "asks":[
-                        [
-                            "3993.2",
-                            "0.41600068",
-                            "1"
-                        ],
-                        [
-                            "3993.4",
-                            "1.24807818",
-                            "3"
-                        ],
-                        [
-                            "3993.6",
-                            "0.03",
-                            "1"
-                        ],
-                        [
-                            "3993.8",
-                            "0.03",
-                            "1"
-                        ]
+                ],
+                "bids":[
+                    [
+                        "3993",
+                        "0.15149658",
+                        "2"
+                    ],
+                    [
+                        "3992.8",
+                        "1.19046818",
+                        "1"
                     ],
-                    "bids":[
-                        [
-                            "3993",
-                            "0.15149658",
-                            "2"
-                        ],
-                        [
-                            "3992.8",
-                            "1.19046818",
-                            "1"
-                        ],
-                        [
-                            "3992.6",
-                            "0.20831389",
-                            "1"
-                        ],
-                        [
-                            "3992.4",
-                            "0.01669446",
-                            "2"
-                        ]
+                    [
+                        "3992.6",
+                        "0.20831389",
+                        "1"
                     ],
-                    "timestamp":"2019-03-20T03:55:37.888Z"
-                }
-                """
+                    [
+                        "3992.4",
+                        "0.01669446",
+                        "2"
+                    ]
+                ],
+                "timestamp":"2019-03-20T03:55:37.888Z"
+            }
+            """
 
-                asks = [(item[0], item[1]) for item in bid_ask['asks']]
-                bids = [(item[0], item[1]) for item in bid_ask['bids']]
-                asks.reverse()
-                await self._send_data_in_exchange(queue_name, (bids, asks))
+            asks = [(item[0], item[1]) for item in bid_ask['asks']]
+            bids = [(item[0], item[1]) for item in bid_ask['bids']]
+            asks.reverse()
+            await self._send_data_in_exchange(queue_name, (bids, asks))
 
     async def _subscribe_ticker(self, queue_name, symbol):
-        ping_task = None
-        try:
-            async with ClientSession() as session:
-                async with session.ws_connect(self._root_url_ws) as ws:
-                    json_params = {"op": "subscribe",
-                                   "args": [f"spot/ticker:{await self._symbol_translate(symbol, session)}"]}
-                    await ws.send_json(json_params)
-
-                    response = await ws.receive()
-                    data = self._inflate(response.data).decode('utf-8')
-                    data = dict(json.loads(data))
-                    if data.get('event') != 'subscribe':
-                        raise Exception(f'event != subscribe. response == {data}')
-
-                    ping_task = asyncio.create_task(self._ping_timer(ws))
+        async with self._streams.subscribe(f"spot/ticker:{await self._symbol_translate(symbol)}") as subscription:
+            while True:
+                # subscription return item of 'data' array
+                data = await subscription.get()
 
-                    while True:
-                        response = await ws.receive()
-                        data = self._inflate(response.data).decode('utf-8')
+                # Data format:
+                """
+                 {
+                     "table":"spot/ticker",
+                     "data":
+                        [{
+                        "instrument_id":"ETH-USDT",
+                        "last":"8.8",
+                        "best_bid":"3",
+                        "best_ask":"8.1",
+                        "open_24h":"5.1",
+                        "high_24h":"8.8",
+                        "low_24h":"3",
+                        "base_volume_24h":"13.77340909",
+                        "quote_volume_24h":"78.49886361",
+                        "timestamp":"2018-12-20T03:13:41.664Z"
+                        }]
+                 }
+                """
+                await self._send_data_in_exchange(queue_name, (data['best_bid'], data['best_ask']))
 
-                        if data == 'pong':
-                            continue
+    async def _subscribe_candles(self, queue_name, symbol, time_frame):
+        key = f"spot/candle{self._timeframe_translate[time_frame]}s:{await self._symbol_translate(symbol)}"
+        async with self._streams.subscribe(key) as subscription:
+            while True:
+                # subscription return item of 'data' array
+                data = await subscription.get()
 
-                        # Data format:
-                        """
-                         {
-                             "table":"spot/ticker",
-                             "data":
-                                [{
-                                "instrument_id":"ETH-USDT",
-                                "last":"8.8",
-                                "best_bid":"3",
-                                "best_ask":"8.1",
-                                "open_24h":"5.1",
-                                "high_24h":"8.8",
-                                "low_24h":"3",
-                                "base_volume_24h":"13.77340909",
-                                "quote_volume_24h":"78.49886361",
-                                "timestamp":"2018-12-20T03:13:41.664Z"
-                                }]
-                         }
-                        """
-                        data = json.loads(data)['data'][0]
-                        await self._send_data_in_exchange(queue_name, (data['best_bid'], data['best_ask']))
-        except Exception as e:
-            if ping_task:
-                ping_task.cancel()
-            raise e
+                # Data format
+                """
+                {
+                  "table":"spot/candle60s",
+                  "data":[{
+                            "candle":
+                              [
+                              "2018-12-20T06:18:00.000Z",
+                              "8.8", o
+                              "8.8", h
+                              "8.8", l
+                              "8.8", c
+                              "0" v
+                              ]
+                            ,"instrument_id":"ETH-USDT"
+                    }]}
+                """
+                data = data['candle']
+                candle = (data[1], data[2], data[3], data[4], data[5], iso_to_unix(data[0]))
 
-    async def _subscribe_candles(self, queue_name, symbol, time_frame):
-        ping_task = None
-        try:
-            async with ClientSession() as session:
-                async with session.ws_connect(self._root_url_ws) as ws:
-                    json_params = {
-                        "op": "subscribe",
-                        "args": [
-                            f"spot/candle{self._timeframe_translate[time_frame]}s:"
-                            f"{(await self._symbol_translate(symbol, session))}"
-                        ]
-                    }
-                    await ws.send_json(json_params)
-
-                    response = await ws.receive()
-                    data = self._inflate(response.data).decode('utf-8')
-                    data = json.loads(data)
-                    if data.get('event') != 'subscribe':
-                        raise Exception(f'event != subscribe. response == {data}')
-
-                    ping_task = asyncio.create_task(self._ping_timer(ws))
+                await self._send_data_in_exchange(queue_name, candle)
 
+    async def _subscribe_depth(self, queue_name, symbol):
+        key = f"spot/depth:{await self._symbol_translate(symbol)}"
+        book = OrderBook()
+        while True:
+            # on resubscribe exchange send new snapshot ('partial' message)
+            async with self._streams.subscribe(key) as subscription:
+                try:
                     while True:
-                        response = await ws.receive()
-                        data = self._inflate(response.data).decode('utf-8')
-
-                        if data == 'pong':
-                            continue
+                        # subscription return item of 'data' array with 'action' key
+                        data = await subscription.get()
 
                         # Data format
                         """
                         {
-                          "table":"spot/candle60s",
-                          "data":[{
-                                    "candle":
-                                      [
-                                      "2018-12-20T06:18:00.000Z",
-                                      "8.8", o
-                                      "8.8", h
-                                      "8.8", l
-                                      "8.8", c
-                                      "0" v
-                                      ]
-                                    ,"instrument_id":"ETH-USDT"
-                            }]}
+                          "table": "spot/depth",
+                          "action": "partial | update",
+                          "data": [{
+                            "instrument_id": "BTC-USDT",
+                            "asks": [["8.8", "96.99999966", 1], ...],    // size == 0 - level is removed
+                            "bids": [["5", "7", 2], ...],
+                            "timestamp": "2018-12-04T09:38:36.300Z",
+                            "checksum": -1200119424
+                          }]
+                        }
                         """
-                        data = json.loads(data)['data'][0]['candle']
-                        time = int(datetime.datetime.strptime(data[0], "%Y-%m-%dT%H:%M:%S.%fZ").timestamp())
-                        candle = (data[1], data[2], data[3], data[4], data[5], time)
+                        if data['action'] == 'partial':
+                            book.reset(data['bids'], data['asks'])
+                        elif not book.is_synced:
+                            continue
+                        else:
+                            book.update(data['bids'], data['asks'])
 
-                        await self._send_data_in_exchange(queue_name, candle)
-        except Exception as e:
-            if ping_task:
-                ping_task.cancel()
-            raise e
+                        if book.checksum() != data['checksum']:
+                            raise OrderBookError(f'Bad depth checksum for {key}')
 
-    async def _subscribe_depth(self, queue_name, symbol):
-        async with ClientSession() as session:
-            url_rest = f'{self._root_url_rest}/instruments/{(await self._symbol_translate(symbol, session))}' \
-                f'/book?size=20&'
-            while True:
-                async with session.get(url_rest) as response:
-                    response = await response.text()
-                    bid_ask = json.loads(response)
-
-                    # Data format
-                    """
-                    {
-                        "asks":[
-                            [
-                                "3993.2",
-                                "0.41600068",
-                                "1"
-                            ],
-                            [
-                                "3993.4",
-                                "1.24807818",
-                                "3"
-                            ],
-                            [
-                                "3993.6",
-                                "0.03",
-                                "1"
-                            ],
-                            [
-                                "3993.8",
-                                "0.03",
-                                "1"
-                            ]
-                        ],
-                        "bids":[
-                            [
-                                "3993",
-                                "0.15149658",
-                                "2"
-                            ],
-                            [
-                                "3992.8",
-                                "1.19046818",
-                                "1"
-                            ],
-                            [
-                                "3992.6",
-                                "0.20831389",
-                                "1"
-                            ],
-                            [
-                                "3992.4",
-                                "0.01669446",
-                                "2"
-                            ]
-                        ],
-                        "timestamp":"2019-03-20T03:55:37.888Z"
-                    }
-                    """
-                    asks = [(item[0], item[1]) for item in bid_ask['asks']]
-                    bids = [(item[0], item[1]) for item in bid_ask['bids']]
-                    asks.reverse()
-                    await self._send_data_in_exchange(queue_name, (bids, asks))
-                    await asyncio.sleep(self.time_out)
-
-    async def _symbol_translate(self, symbol, session):
-        """Translate symbol in format for API"""
-        url_rest = f'{self._root_url_rest}/instruments/ticker'
-        async with session.get(url_rest) as response:
-            response = await response.text()
-            response = json.loads(response)
-
-            # Data format
-            """
-            [
-                {
-                    ...
-                    "base_currency":"BTC",
-                    "instrument_id":"BTC-USDT",
-                    "product_id":"BTC-USDT",
-                    "min_size":"0.001",
-                    "quote_currency":"USDT",
-                    "size_increment":"0.00000001",
-                    "tick_size":"0.1"
-                    ...
-                },
-                {
-                    "base_currency":"OKB",
-                    "instrument_id":"OKB-USDT",
-                    "min_size":"1",
-                    "quote_currency":"USDT",
-                    "size_increment":"0.0001",
-                    "tick_size":"0.0001"
-                }
-            ]
-            """
-            for item in response:
-                if item['product_id'].replace('-', '') == symbol:
-                    return item['product_id']
+                        if subscription.empty():
+                            await self._send_data_in_exchange(queue_name, book.top(self.depth_levels))
+                except OrderBookError:
+                    book.clear()
 
     @staticmethod
     def _inflate(data):
@@ -414,12 +379,3 @@ class BaseOkExchange(BaseExchange):
         inflated = decompress.decompress(data)
         inflated += decompress.flush()
         return inflated
-
-    @staticmethod
-    async def _ping_timer(ws, ping_time_out=20):
-        try:
-            while True:
-                await asyncio.sleep(ping_time_out)
-                await ws.send_str('ping')
-        except asyncio.CancelledError:
-            pass
@@ -0,0 +1,75 @@
+import heapq
+import zlib
+
+
+class OrderBookError(Exception):
+    """Local order book lost consistency with exchange (sequence gap, bad checksum), resync needed"""
+
+
+class OrderBook:
+    """Local order book, that is built from snapshot and maintained by diff updates
+
+    Levels are stored in dicts {float(price): (price: str, size: str)}, so output contain original strings of
+    exchange. Level with zero size is removed.
+
+    """
+
+    def __init__(self):
+        self.bids = dict()
+        self.asks = dict()
+        # last applied sequence number (update id), None if book is not synchronized
+        self.sequence = None
+
+    @property
+    def is_synced(self):
+        return self.sequence is not None
+
+    def reset(self, bids, asks, sequence=0):
+        """Replace content by snapshot"""
+        self.bids.clear()
+        self.asks.clear()
+        self.update(bids, asks, sequence)
+
+    def clear(self):
+        self.bids.clear()
+        self.asks.clear()
+        self.sequence = None
+
+    def update(self, bids, asks, sequence=None):
+        """Apply levels [[price: str, size: str, ...], ...]"""
+        for book, levels in ((self.bids, bids), (self.asks, asks)):
+            for level in levels:
+                price, size = level[0], level[1]
+                if float(size) == 0:
+                    book.pop(float(price), None)
+                else:
+                    book[float(price)] = (price, size)
+        if sequence is not None:
+            self.sequence = sequence
+
+    def top(self, levels=20):
+        """Return best levels in format of this MS: (bids, asks), both sorted by price DESC"""
+        bids = [self.bids[price] for price in heapq.nlargest(levels, self.bids)]
+        asks = [self.asks[price] for price in heapq.nsmallest(levels, self.asks)]
+        asks.reverse()
+        return bids, asks
+
+    def checksum(self, levels=25):
+        """CRC32 of best levels as signed int32, as OKEx calculate it
+
+        String for CRC32 is 'bid_price:bid_size:ask_price:ask_size:...' of first levels, pairs alternate
+        while both sides have levels
+
+        """
+        bids = [self.bids[price] for price in heapq.nlargest(levels, self.bids)]
+        asks = [self.asks[price] for price in heapq.nsmallest(levels, self.asks)]
+
+        parts = []
+        for i in range(max(len(bids), len(asks))):
+            if i < len(bids):
+                parts.extend(bids[i])
+            if i < len(asks):
+                parts.extend(asks[i])
+
+        value = zlib.crc32(':'.join(parts).encode('utf-8'))
+        return value - (1 << 32) if value >= (1 << 31) else value
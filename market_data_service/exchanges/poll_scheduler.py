@@ -0,0 +1,107 @@
+from .stream_multiplexer import Subscription
+from contextlib import asynccontextmanager
+import asyncio
+
+
+class _Poll:
+    """One REST request of scheduler and subscriptions on its result"""
+
+    def __init__(self, fetch):
+        self.fetch = fetch
+        # list (key, Subscription), key is None if subscription get all result
+        self.subscribers = []
+        self.running = False
+
+
+class PollScheduler:
+    """One loop for all REST polls of exchange
+
+    Subscriptions with same poll_key share one request per cycle, so bulk endpoint (all tickers etc...) is requested
+    once for any count of subscriptions. Requests of cycle are spread evenly on interval. If requests count exceed
+    budget max_requests_per_second, cycle is stretched.
+
+    Usage:
+        async with scheduler.subscribe(poll_key, fetch, key) as subscription:
+            while True:
+                data = await subscription.get()
+
+    fetch - coroutine function without arguments. If key is not None, fetch should return dict and subscription get
+    only result[key]. If request failed, get of all subscriptions on this poll raise exception
+
+    """
+
+    def __init__(self, interval, max_requests_per_second=None):
+        self.interval = interval
+        self.max_requests_per_second = max_requests_per_second
+
+        # poll_key -> _Poll
+        self._polls = dict()
+        self._task = None
+
+    @property
+    def cycle_time(self):
+        """Time between two requests of one poll"""
+        if not self.max_requests_per_second:
+            return self.interval
+        return max(self.interval, len(self._polls) / self.max_requests_per_second)
+
+    @asynccontextmanager
+    async def subscribe(self, poll_key, fetch, key=None):
+        """Subscribe on result of poll, unsubscribe on exit"""
+        subscription = Subscription(poll_key if key is None else f'{poll_key}:{key}')
+        poll = self._polls.get(poll_key)
+        if poll is None:
+            poll = self._polls[poll_key] = _Poll(fetch)
+        poll.subscribers.append((key, subscription))
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+        try:
+            yield subscription
+        finally:
+            poll.subscribers.remove((key, subscription))
+            if not poll.subscribers and self._polls.get(poll_key) is poll:
+                del self._polls[poll_key]
+            if not self._polls and self._task:
+                self._task.cancel()
+                self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        while self._polls:
+            polls = list(self._polls.values())
+            cycle = self.cycle_time
+            step = cycle / len(polls)
+
+            start = loop.time()
+            for i, poll in enumerate(polls):
+                delay = start + i * step - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                # skip removed polls and requests, that not finished from previous cycle
+                if poll.subscribers and not poll.running:
+                    asyncio.ensure_future(self._execute(poll))
+
+            delay = start + cycle - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    @staticmethod
+    async def _execute(poll):
+        poll.running = True
+        try:
+            data = await poll.fetch()
+        except Exception as e:
+            for _, subscription in poll.subscribers:
+                subscription.close(e)
+            return
+        finally:
+            poll.running = False
+
+        for key, subscription in poll.subscribers:
+            if key is None:
+                subscription.put(data)
+            elif key in data:
+                subscription.put(data[key])
+            else:
+                subscription.close(KeyError(key))
@@ -0,0 +1,104 @@
+import asyncio
+
+
+class TokenBucket:
+    """Weighted token bucket: capacity tokens, that are refilled evenly during period seconds
+
+    Callers wait in FIFO order, while bucket has not enough tokens for request at head of queue.
+    max_weight - weight of heaviest request, scaled bucket still hold it.
+
+    """
+
+    def __init__(self, capacity, period, max_weight=1):
+        self.capacity = capacity
+        self.period = period
+        self.max_weight = max_weight
+
+        self._tokens = capacity
+        self._updated = None
+        self._lock = None
+
+        # metrics
+        self.waiting = 0
+        self.total_weight = 0
+        self.total_wait_time = 0.0
+
+    def scale(self, share):
+        """Use share of capacity, limit is shared by several processes
+
+        If share of capacity is less than max_weight, capacity is max_weight and period is longer, so bucket keep
+        share of rate.
+
+        """
+        capacity = self.capacity * share
+        if capacity < self.max_weight:
+            self.period *= self.max_weight / capacity
+            capacity = self.max_weight
+        self.capacity = capacity
+        self._tokens = min(self._tokens, self.capacity)
+
+    @property
+    def usage(self):
+        """Part of capacity, that is used now (0..1)"""
+        self._refill()
+        return 1 - self._tokens / self.capacity
+
+    async def acquire(self, weight=1):
+        """Take weight tokens, wait for them if bucket is empty"""
+        if weight > self.capacity:
+            raise ValueError(f'Request weight {weight} exceed bucket capacity {self.capacity}')
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        self.waiting += 1
+        try:
+            # asyncio.Lock wake waiters in FIFO order
+            async with self._lock:
+                self._refill()
+                while self._tokens < weight:
+                    await asyncio.sleep((weight - self._tokens) * self.period / self.capacity)
+                    self._refill()
+                self._tokens -= weight
+        finally:
+            self.waiting -= 1
+        self.total_weight += weight
+        self.total_wait_time += loop.time() - start
+
+    def _refill(self):
+        now = asyncio.get_event_loop().time()
+        if self._updated is not None:
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.capacity / self.period)
+        self._updated = now
+
+
+class RateLimiter:
+    """Token buckets of endpoint classes of one exchange
+
+    limits: {endpoint_class: (capacity, period[, max_weight])}, requests of endpoint class without limit are not
+    delayed.
+    Exchange, that limit all requests together, use one class for all endpoints.
+
+    """
+
+    def __init__(self, limits=None):
+        self._buckets = {name: TokenBucket(*limit) for name, limit in (limits or {}).items()}
+
+    def scale(self, share):
+        """Use share of limits, they are shared by several processes"""
+        for bucket in self._buckets.values():
+            bucket.scale(share)
+
+    async def acquire(self, endpoint_class, weight=1):
+        bucket = self._buckets.get(endpoint_class)
+        if bucket is not None:
+            await bucket.acquire(weight)
+
+    def usage(self):
+        """Metrics of buckets: {endpoint_class: {usage, waiting, total_weight, total_wait_time}}"""
+        return {
+            name: dict(usage=round(bucket.usage, 3), waiting=bucket.waiting, total_weight=bucket.total_weight,
+                       total_wait_time=round(bucket.total_wait_time, 3))
+            for name, bucket in self._buckets.items()
+        }
@@ -0,0 +1,104 @@
+from .candle_buffer import format_number
+from decimal import Decimal
+from . import timeframes
+
+
+class Resampler:
+    """Build candles of time frame from stream of M1 candles
+
+    M1 stream repeat open minute candle on each change, so resampler keep volume of closed minutes of period and
+    volume of open minute separately.
+
+    Open candle of time frame can be seeded by candle of REST request, volume of current minute is subtracted from
+    it on first update.
+
+    Candle format: [open: str(float), high: str(float), low: str(float), close: str(float), volume: str(float),
+                    time: int (unix_time)]
+
+    """
+
+    def __init__(self, time_frame, utc_offset=0):
+        self.time_frame = time_frame
+        self.utc_offset = utc_offset
+
+        self._seed = None
+        self._time = None
+        self._open = None
+        # (float, str) for compare prices without losing of exchange format
+        self._high = None
+        self._low = None
+        self._close = None
+        # volumes are Decimal, so sum of exchange strings is exact
+        self._closed_volume = Decimal(0)
+        self._minute_time = None
+        self._minute_volume = Decimal(0)
+
+    def seed(self, candle):
+        """Set open candle of time frame, that was got from REST"""
+        self._seed = candle
+
+    def update(self, minute_candle):
+        """Apply M1 candle, return current candle of time frame or None, if M1 candle is late"""
+        open_, high, low, close, volume, minute_time = minute_candle
+        minute_time = int(minute_time)
+        volume = Decimal(volume)
+        period = timeframes.align(minute_time, self.time_frame, self.utc_offset)
+
+        if self._seed is not None:
+            seed, self._seed = self._seed, None
+            if int(seed[5]) == period:
+                self._start(period, seed[0], seed[1], seed[2], minute_time)
+                self._closed_volume = max(Decimal(seed[4]) - volume, Decimal(0))
+                self._update_minute(high, low, close, volume, minute_time)
+                return self.candle()
+
+        if period != self._time:
+            if self._time is not None and period < self._time:
+                # candle of previous period came late
+                return None
+            self._start(period, open_, high, low, minute_time)
+        self._update_minute(high, low, close, volume, minute_time)
+        return self.candle()
+
+    def candle(self):
+        """Return current candle or None, if nothing was applied"""
+        if self._time is None:
+            return None
+        return (self._open, self._high[1], self._low[1], self._close,
+                format_number(self._closed_volume + self._minute_volume), self._time)
+
+    def _start(self, period, open_, high, low, minute_time):
+        self._time = period
+        self._open = open_
+        self._high = (float(high), high)
+        self._low = (float(low), low)
+        self._closed_volume = Decimal(0)
+        self._minute_time = minute_time
+        self._minute_volume = Decimal(0)
+
+    def _update_minute(self, high, low, close, volume, minute_time):
+        if minute_time > self._minute_time:
+            self._closed_volume += self._minute_volume
+            self._minute_time = minute_time
+        elif minute_time < self._minute_time:
+            # update of closed minute came late
+            return
+        self._minute_volume = volume
+        self._close = close
+
+        high_value, low_value = float(high), float(low)
+        if high_value > self._high[0]:
+            self._high = (high_value, high)
+        if low_value < self._low[0]:
+            self._low = (low_value, low)
+
+
+class CandleFeed:
+    """Upstream M1 stream of one symbol and resamplers of subscriptions, that read it"""
+
+    def __init__(self, queue_name):
+        # internal queue name, connector send M1 candles of stream to it
+        self.queue_name = queue_name
+        self.task = None
+        # queue_name of subscription -> Resampler, None for M1 subscription
+        self.resamplers = dict()
@@ -0,0 +1,320 @@
+from contextlib import asynccontextmanager
+from aiohttp import WSMsgType
+import itertools
+import asyncio
+
+
+class StreamError(ConnectionError):
+    """Exchange reject request of one stream, connection and other streams on it stay alive
+
+    Error reply is matched to stream by key or by request_id of subscribe message (all streams of batched message),
+    error, that is not matched, is only printed. Subscription raise it as ConnectionError, so error reach error queue.
+
+    """
+
+    def __init__(self, message, key=None, request_id=None):
+        super().__init__(message)
+        self.key = key
+        self.request_id = request_id
+
+
+class Subscription:
+    """Messages of one stream from multiplexed WebSocket connection"""
+
+    def __init__(self, key):
+        self.key = key
+        self._queue = asyncio.Queue()
+
+    def put(self, data):
+        self._queue.put_nowait(data)
+
+    def close(self, exception):
+        """Stop subscription, exception will be raised by get"""
+        self._queue.put_nowait(exception)
+
+    def empty(self):
+        """True, if all received messages are read"""
+        return self._queue.empty()
+
+    async def get(self):
+        """Wait next message of stream"""
+        data = await self._queue.get()
+        if isinstance(data, Exception):
+            raise data
+        return data
+
+
+class _Connection:
+    """One WebSocket connection and streams, that it carry"""
+
+    def __init__(self, ws, messages_per_second=None):
+        self.ws = ws
+        self.keys = set()
+        self.reader = None
+        self.pinger = None
+
+        # stream key -> request_id of its subscribe message, for match of error replies
+        self.request_ids = dict()
+        # keys, that wait batched subscribe message, and task, that send it
+        self.pending = []
+        self.flusher = None
+
+        # some exchanges disconnect client, if it send messages too often
+        self._send_interval = 1 / messages_per_second if messages_per_second else 0
+        self._last_send = 0
+
+    async def send(self, message):
+        if self._send_interval:
+            loop = asyncio.get_event_loop()
+            delay = self._last_send + self._send_interval - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._last_send = loop.time()
+        await self.ws.send_json(message)
+
+
+class StreamMultiplexer:
+    """Share few WebSocket connections of exchange between many streams
+
+    Each connection carry up to exchange.ws_streams_per_connection streams, when all connections are full new
+    connection will be opened. Streams are added and removed on live connection, empty connection is closed.
+
+    Protocol of exchange is described by hooks of connector (see BaseExchange):
+        _ws_decode - decode frame
+        _ws_subscribe_message, _ws_unsubscribe_message - build JSON-message for (un)subscribe stream by key
+        _ws_subscribe_batch_message - build one JSON-message for subscribe several streams, is used, if
+            exchange.ws_subscribe_batch_size > 1: subscribes, that come together, are sent in one message
+        _ws_route - return pairs (key, payload) for stream messages and reply on service messages (ping etc...),
+            raise StreamError on error reply for one stream
+        _ws_ping - keep-alive message, is sent every exchange.ws_ping_interval seconds
+
+    Usage:
+        async with multiplexer.subscribe(key) as subscription:
+            while True:
+                payload = await subscription.get()
+
+    If connection is lost, get of all subscriptions on this connection raise exception. If exchange reject one
+    stream (StreamError), only subscriptions of this stream raise it.
+
+    """
+
+    def __init__(self, exchange):
+        self._exchange = exchange
+
+        # stream key -> list Subscription, one stream can be read by several subscriptions
+        self._subscriptions = dict()
+        # stream key -> _Connection
+        self._connections_by_key = dict()
+        self._connections = []
+
+        self._lock = None
+        self._request_ids = itertools.count(1)
+
+    @property
+    def connections_count(self):
+        return len(self._connections)
+
+    @asynccontextmanager
+    async def subscribe(self, key):
+        """Subscribe on stream with key, unsubscribe on exit"""
+        subscription = Subscription(key)
+        await self._add(subscription)
+        try:
+            yield subscription
+        finally:
+            await self._remove(subscription)
+
+    def _get_lock(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def _add(self, subscription):
+        key = subscription.key
+        if key in self._subscriptions:
+            self._subscriptions[key].append(subscription)
+            return
+
+        self._subscriptions[key] = [subscription]
+        try:
+            async with self._get_lock():
+                connection = self._get_free_connection() or await self._open_connection()
+                connection.keys.add(key)
+                self._connections_by_key[key] = connection
+                if self._exchange.ws_subscribe_batch_size > 1:
+                    connection.pending.append(key)
+                    if connection.flusher is None or connection.flusher.done():
+                        connection.flusher = asyncio.ensure_future(self._flush(connection))
+                else:
+                    await self._send_subscribe(connection, [key])
+        except BaseException as e:
+            connection = self._connections_by_key.pop(key, None)
+            if connection:
+                connection.keys.discard(key)
+                connection.request_ids.pop(key, None)
+            for other in self._subscriptions.pop(key, ()):
+                if other is not subscription:
+                    other.close(e if isinstance(e, Exception) else ConnectionError(f'Subscribe {key} failed'))
+            raise
+
+    async def _remove(self, subscription):
+        key = subscription.key
+        subscriptions = self._subscriptions.get(key)
+        # subscription already removed, if connection was lost
+        if not subscriptions or subscription not in subscriptions:
+            return
+
+        subscriptions.remove(subscription)
+        if subscriptions:
+            return
+        del self._subscriptions[key]
+
+        async with self._get_lock():
+            connection = self._connections_by_key.pop(key, None)
+            if connection is None:
+                return
+
+            connection.keys.discard(key)
+            connection.request_ids.pop(key, None)
+            if not connection.keys:
+                await self._close_connection(connection)
+            elif key in connection.pending:
+                # subscribe message was not sent yet
+                connection.pending.remove(key)
+            else:
+                try:
+                    await connection.send(self._exchange._ws_unsubscribe_message(key, next(self._request_ids)))
+                except (ConnectionError, RuntimeError):
+                    # connection is closing, reader will drop it
+                    pass
+
+    async def _send_subscribe(self, connection, keys):
+        request_id = next(self._request_ids)
+        for key in keys:
+            connection.request_ids[key] = request_id
+        if len(keys) == 1:
+            message = self._exchange._ws_subscribe_message(keys[0], request_id)
+        else:
+            message = self._exchange._ws_subscribe_batch_message(keys, request_id)
+        await connection.send(message)
+
+    async def _flush(self, connection):
+        """Send pending subscribes of connection in batches"""
+        batch_size = self._exchange.ws_subscribe_batch_size
+        while connection.pending:
+            # subscribes, that wait lock, join batch
+            await asyncio.sleep(0)
+            async with self._get_lock():
+                keys = connection.pending[:batch_size]
+                del connection.pending[:batch_size]
+                if not keys:
+                    return
+                try:
+                    await self._send_subscribe(connection, keys)
+                except (ConnectionError, RuntimeError) as e:
+                    # not cancel itself in drop
+                    connection.flusher = None
+                    await self._drop_connection(connection, e)
+                    return
+
+    def _fail_stream(self, connection, error):
+        """Stop subscriptions of streams, that exchange rejected"""
+        if error.key is not None:
+            keys = [error.key]
+        elif error.request_id is not None:
+            keys = [key for key, request_id in connection.request_ids.items()
+                    if str(request_id) == str(error.request_id)]
+        else:
+            keys = []
+        keys = [key for key in keys if key in connection.keys]
+        if not keys:
+            print(f'{self._exchange.name} stream error: {error}')
+            return
+
+        # traceback of error refer frame of reader, subscriptions raise error without it
+        error = error.with_traceback(None)
+        for key in keys:
+            connection.keys.discard(key)
+            connection.request_ids.pop(key, None)
+            self._connections_by_key.pop(key, None)
+            for subscription in self._subscriptions.pop(key, ()):
+                subscription.close(error)
+        if not connection.keys:
+            asyncio.ensure_future(self._close_if_empty(connection))
+
+    async def _close_if_empty(self, connection):
+        async with self._get_lock():
+            if not connection.keys and connection in self._connections:
+                await self._close_connection(connection)
+
+    def _get_free_connection(self):
+        for connection in self._connections:
+            if len(connection.keys) < self._exchange.ws_streams_per_connection and not connection.ws.closed:
+                return connection
+        return None
+
+    async def _open_connection(self):
+        ws = await self._exchange._get_session().ws_connect(self._exchange._root_url_ws)
+        connection = _Connection(ws, self._exchange.ws_messages_per_second)
+        connection.reader = asyncio.ensure_future(self._read(connection))
+        if self._exchange.ws_ping_interval:
+            connection.pinger = asyncio.ensure_future(self._ping(connection))
+        self._connections.append(connection)
+        return connection
+
+    async def _close_connection(self, connection):
+        if connection in self._connections:
+            self._connections.remove(connection)
+        for task in (connection.reader, connection.pinger, connection.flusher):
+            if task:
+                task.cancel()
+        await connection.ws.close()
+
+    async def _drop_connection(self, connection, exception):
+        """Forget lost connection and stop all subscriptions on it"""
+        if connection in self._connections:
+            self._connections.remove(connection)
+        for task in (connection.pinger, connection.flusher):
+            if task:
+                task.cancel()
+
+        for key in connection.keys:
+            self._connections_by_key.pop(key, None)
+            for subscription in self._subscriptions.pop(key, ()):
+                subscription.close(exception)
+        connection.keys.clear()
+        connection.request_ids.clear()
+        connection.pending.clear()
+
+        if not connection.ws.closed:
+            await connection.ws.close()
+
+    async def _read(self, connection):
+        """Read connection and dispatch messages between subscriptions"""
+        try:
+            async for message in connection.ws:
+                if message.type == WSMsgType.ERROR:
+                    raise connection.ws.exception()
+
+                data = self._exchange._ws_decode(message.data)
+                try:
+                    routed = await self._exchange._ws_route(connection.ws, data)
+                except StreamError as e:
+                    self._fail_stream(connection, e)
+                    continue
+                for key, payload in routed:
+                    for subscription in self._subscriptions.get(key, ()):
+                        subscription.put(payload)
+            raise ConnectionError(f'WebSocket connection closed, code: {connection.ws.close_code}')
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await self._drop_connection(connection, e)
+
+    async def _ping(self, connection):
+        try:
+            while True:
+                await asyncio.sleep(self._exchange.ws_ping_interval)
+                await self._exchange._ws_ping(connection.ws)
+        except (asyncio.CancelledError, ConnectionError, RuntimeError):
+            pass
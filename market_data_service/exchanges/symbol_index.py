@@ -0,0 +1,40 @@
+import time
+
+
+class SymbolIndex:
+    """Two-way map between symbols of this MS (BTCUSDT) and symbols of exchange API (BTC-USDT)
+
+    Index is rebuilt from full symbols list of exchange and become expired after ttl seconds
+
+    """
+
+    def __init__(self, ttl=3600):
+        self.ttl = ttl
+        self._to_native = dict()
+        self._to_unified = dict()
+        self._updated_at = None
+
+    def rebuild(self, pairs):
+        """Replace index content. pairs - iterable with tuples (unified_symbol, native_symbol)"""
+        to_native = dict(pairs)
+        self._to_native = to_native
+        self._to_unified = {native: unified for unified, native in to_native.items()}
+        self._updated_at = time.monotonic()
+
+    def is_empty(self):
+        return not self._to_native
+
+    def is_expired(self):
+        return self._updated_at is None or time.monotonic() - self._updated_at > self.ttl
+
+    def symbols(self):
+        """Return list unified symbols"""
+        return list(self._to_native.keys())
+
+    def to_native(self, symbol):
+        """Translate unified symbol in format for API. Raise KeyError, if symbol not exist"""
+        return self._to_native[symbol]
+
+    def to_unified(self, native_symbol):
+        """Translate API symbol in unified format. Raise KeyError, if symbol not exist"""
+        return self._to_unified[native_symbol]
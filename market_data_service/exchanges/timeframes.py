@@ -0,0 +1,44 @@
+"""Time frames of this MS and alignment of candles time
+
+Candle of time frame start at time multiple of its length in time zone of exchange (utc_offset, seconds east of
+UTC), weeks start on Monday, months and years are calendar.
+
+"""
+import time as time_module
+import calendar
+
+_WEEK = 7 * 24 * 60 * 60
+# 1970-01-01 is Thursday, Monday before it is 3 days earlier
+_MONDAY_SHIFT = 3 * 24 * 60 * 60
+
+LENGTHS = {
+    'M1': 60, 'M3': 3 * 60, 'M5': 5 * 60, 'M15': 15 * 60, 'M30': 30 * 60,
+    'H1': 60 * 60, 'H2': 2 * 60 * 60, 'H4': 4 * 60 * 60, 'H12': 12 * 60 * 60,
+    'D1': 24 * 60 * 60, 'D7': _WEEK, '1W': _WEEK,
+}
+CALENDAR = ('1M', '1Y')
+MAX_CALENDAR_LENGTHS = {'1M': 31 * 24 * 60 * 60, '1Y': 366 * 24 * 60 * 60}
+
+
+def is_supported(time_frame):
+    return time_frame in LENGTHS or time_frame in CALENDAR
+
+
+def align(time, time_frame, utc_offset=0):
+    """Return start time of candle of time_frame, that contain time"""
+    local = time + utc_offset
+    if time_frame in LENGTHS:
+        length = LENGTHS[time_frame]
+        if length == _WEEK:
+            return (local + _MONDAY_SHIFT) // length * length - _MONDAY_SHIFT - utc_offset
+        return local // length * length - utc_offset
+
+    date = time_module.gmtime(local)
+    month = date.tm_mon if time_frame == '1M' else 1
+    return calendar.timegm((date.tm_year, month, 1, 0, 0, 0)) - utc_offset
+
+
+def next_period(period_start, time_frame, utc_offset=0):
+    """Return start time of candle, that follow candle started at period_start"""
+    length = LENGTHS.get(time_frame) or MAX_CALENDAR_LENGTHS[time_frame]
+    return align(period_start + length, time_frame, utc_offset)
@@ -0,0 +1,53 @@
+"""Fast conversion ISO-8601 UTC timestamps of exchanges API to unix time
+
+Supported format: YYYY-MM-DDTHH:MM[:SS[.fff]]Z, fraction of second is dropped.
+Unix time of minute is cached by prefix 'YYYY-MM-DDTHH:MM', so candles and ticks of one minute
+are converted without date arithmetic.
+
+"""
+import time as time_module
+import calendar
+
+_CACHE_SIZE = 100000
+_minutes_cache = dict()
+
+
+def _minute_to_unix(prefix):
+    minute = calendar.timegm((int(prefix[0:4]), int(prefix[5:7]), int(prefix[8:10]),
+                              int(prefix[11:13]), int(prefix[14:16]), 0))
+    if len(_minutes_cache) >= _CACHE_SIZE:
+        _minutes_cache.clear()
+    _minutes_cache[prefix] = minute
+    return minute
+
+
+def iso_to_unix(value):
+    """'2019-03-19T16:00:05.000Z' -> 1553011205"""
+    prefix = value[:16]
+    minute = _minutes_cache.get(prefix)
+    if minute is None:
+        minute = _minute_to_unix(prefix)
+    if len(value) > 18 and value[16] == ':':
+        return minute + int(value[17:19])
+    return minute
+
+
+def iso_to_unix_many(values):
+    """Convert iterable of timestamps to list unix times"""
+    cache_get = _minutes_cache.get
+    result = []
+    append = result.append
+    for value in values:
+        prefix = value[:16]
+        minute = cache_get(prefix)
+        if minute is None:
+            minute = _minute_to_unix(prefix)
+        if len(value) > 18 and value[16] == ':':
+            minute += int(value[17:19])
+        append(minute)
+    return result
+
+
+def unix_to_iso(value):
+    """1553011205 -> '2019-03-19T16:00:05.000Z'"""
+    return time_module.strftime('%Y-%m-%dT%H:%M:%S.000Z', time_module.gmtime(value))
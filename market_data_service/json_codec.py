@@ -0,0 +1,38 @@
+"""JSON codec for hot paths of service
+
+Use orjson, if it is installed, else stdlib json. dumps return bytes ready for message body,
+loads accept bytes or str. Decode error is JSONDecodeError for both implementations.
+
+"""
+from json import JSONDecodeError
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+__all__ = ['dumps', 'loads', 'JSONDecodeError', 'CODEC_NAME']
+
+
+def stdlib_loads(data):
+    """Decode JSON from bytes or str"""
+    return json.loads(data)
+
+
+def stdlib_dumps(data):
+    """Encode data to JSON bytes"""
+    return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+
+if orjson is not None:
+    CODEC_NAME = 'orjson'
+
+    # orjson.JSONDecodeError is subclass of json.JSONDecodeError
+    loads = orjson.loads
+    dumps = orjson.dumps
+else:
+    CODEC_NAME = 'json'
+
+    loads = stdlib_loads
+    dumps = stdlib_dumps
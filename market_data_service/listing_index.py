@@ -0,0 +1,41 @@
+"""Listing compiled for fast validation of requests
+
+data_id of requests is parsed once and cached, so repeated requests with same data_id not split string and not
+allocate objects.
+
+"""
+from collections import namedtuple
+from functools import lru_cache
+
+# time_frame is None for depth and ticker, missing fragments are None
+DataId = namedtuple('DataId', ['data_type', 'exchange', 'pair', 'time_frame', 'update_key', 'starting_key',
+                               'history_key'])
+
+
+@lru_cache(maxsize=10000)
+def parse_data_id(data_id):
+    """'candles.Binance.BTCUSDT.M1' -> DataId('candles', 'Binance', 'BTCUSDT', 'M1', 'update.candles...', ...)"""
+    fragments = data_id.split('.', 3)
+    fragments += [None] * (4 - len(fragments))
+    return DataId(*fragments, f'update.{data_id}', f'starting.{data_id}', f'history.{data_id}')
+
+
+class ListingIndex:
+    """Sets of pairs and time frames of each exchange
+
+    listing format: {exchange: [[time_frames], [pairs]], ...}
+
+    """
+
+    def __init__(self, listing):
+        self._time_frames = {name: frozenset(time_frames) for name, (time_frames, _) in listing.items()}
+        self._pairs = {name: frozenset(pairs) for name, (_, pairs) in listing.items()}
+
+    def has_exchange(self, exchange):
+        return exchange in self._pairs
+
+    def has_pair(self, exchange, pair):
+        return pair in self._pairs[exchange]
+
+    def has_time_frame(self, exchange, time_frame):
+        return time_frame in self._time_frames[exchange]
@@ -1,9 +1,26 @@
 if __name__ == '__main__':
+    from exchanges.exchange_factory import ExchangeFactory
     from controller import Controller
+    from workers import WorkerPool
     import asyncio
+    import signal
+    import os
 
-    controller = Controller()
+    # WORKERS: 'exchange' - worker process per exchange, <n> - n worker processes, empty or 0 - one process
+    workers_mode = os.environ.get('WORKERS') or '0'
+    workers = None
+    if workers_mode != '0':
+        factory = ExchangeFactory(None)
+        workers = WorkerPool(os.environ.get('QUEUE_THIS_SERVICE'), workers_mode, factory.get_all_exchanges_names(),
+                             factory.get_not_sharded_exchanges_names())
+    controller = Controller(workers=workers)
 
     loop = asyncio.get_event_loop()
+    loop.add_signal_handler(signal.SIGTERM, loop.stop)
     loop.create_task(controller.run())
-    loop.run_forever()
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(controller.close())
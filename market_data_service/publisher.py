@@ -0,0 +1,69 @@
+import asyncio
+
+
+class Publisher:
+    """Asynchronous batched publisher to RabbitMQ exchanger
+
+    publish put message in bounded queue and return at once (wait only if queue is full), writer task drain queue
+    in batches and publish them concurrently, so reader of exchange stream not wait broker.
+
+    Conflation mode: messages with routing key, that start with one of conflate_prefixes, are 'latest value wins'.
+    If previous message with same routing key still wait in queue, it is replaced by new message.
+
+    Publisher has interface of aio_pika exchange: publish(message, routing_key)
+
+    """
+
+    def __init__(self, exchanger, max_size=10000, batch_size=100, conflate_prefixes=()):
+        self._exchanger = exchanger
+        self._max_size = max_size
+        self._batch_size = batch_size
+        self._conflate_prefixes = tuple(conflate_prefixes)
+
+        self._queue = None
+        self._writer = None
+        # routing_key -> message, for conflated messages, that wait in queue
+        self._latest = dict()
+
+    def start(self):
+        """Start writer task"""
+        self._queue = asyncio.Queue(self._max_size)
+        self._writer = asyncio.ensure_future(self._write())
+
+    async def close(self):
+        """Publish messages from queue and stop writer task"""
+        if self._writer is None:
+            return
+        await self._queue.join()
+        self._writer.cancel()
+        self._writer = None
+
+    async def publish(self, message, routing_key):
+        """Put message in queue"""
+        if self._conflate_prefixes and routing_key.startswith(self._conflate_prefixes):
+            is_waiting = routing_key in self._latest
+            self._latest[routing_key] = message
+            if is_waiting:
+                return
+            await self._queue.put((routing_key, None))
+        else:
+            await self._queue.put((routing_key, message))
+
+    async def _write(self):
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self._batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            publishes = []
+            for routing_key, message in batch:
+                if message is None:
+                    message = self._latest.pop(routing_key)
+                publishes.append(self._exchanger.publish(message, routing_key=routing_key))
+
+            results = await asyncio.gather(*publishes, return_exceptions=True)
+            for result in results:
+                if isinstance(result, Exception):
+                    print(f'Publish error: {type(result).__name__}: {result}')
+            for _ in batch:
+                self._queue.task_done()
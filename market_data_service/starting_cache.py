@@ -0,0 +1,47 @@
+import json_codec
+import asyncio
+
+# bodies, that connectors send instead of starting data, if request failed
+EMPTY_BODIES = frozenset(json_codec.dumps(data) for data in ([], [0, 0], [[], []]))
+
+
+class StartingCache:
+    """Short-lived cache of starting data
+
+    Stage between connectors and next publisher: messages with routing key 'starting.<data_id>' are remembered for
+    ttl seconds, so repeated get_starting can be answered without request to exchange. Empty data of failed
+    requests are not cached.
+
+    StartingCache has interface of aio_pika exchange: publish(message, routing_key)
+
+    """
+
+    def __init__(self, publisher, ttl=2, max_size=10000):
+        self._publisher = publisher
+        self.ttl = ttl
+        self.max_size = max_size
+        # routing_key -> (loop time of publish, message)
+        self._messages = dict()
+
+    async def publish(self, message, routing_key):
+        if self.ttl and routing_key.startswith('starting.') and message.body not in EMPTY_BODIES:
+            now = asyncio.get_event_loop().time()
+            if len(self._messages) >= self.max_size:
+                self._drop_expired(now)
+            self._messages[routing_key] = (now, message)
+        await self._publisher.publish(message, routing_key=routing_key)
+
+    def get(self, routing_key):
+        """Return cached message or None, if it is missing or expired"""
+        item = self._messages.get(routing_key)
+        if item is None:
+            return None
+        if asyncio.get_event_loop().time() - item[0] > self.ttl:
+            del self._messages[routing_key]
+            return None
+        return item[1]
+
+    def _drop_expired(self, now):
+        for routing_key, (published, _) in list(self._messages.items()):
+            if now - published > self.ttl:
+                del self._messages[routing_key]
@@ -0,0 +1,56 @@
+"""Compare stdlib json and orjson on payloads of this MS
+
+Run from market_data_service directory: python3 -m tests.benchmark_json_codec
+
+"""
+from json_codec import stdlib_dumps, stdlib_loads, orjson
+import random
+import timeit
+
+
+def make_candles(count=1000):
+    """Answer on get_starting candles"""
+    candles = []
+    price = 9000.0
+    for i in range(count):
+        open_, close = price, price + random.uniform(-50, 50)
+        high, low = max(open_, close) + random.uniform(0, 20), min(open_, close) - random.uniform(0, 20)
+        candles.append((f'{open_:.8f}', f'{high:.8f}', f'{low:.8f}', f'{close:.8f}',
+                        f'{random.uniform(0, 500):.8f}', 1565437380 + i * 60))
+        price = close
+    return candles
+
+
+def make_depth(levels=20):
+    """Update of depth"""
+    bids = [(f'{9000 - i * 0.5:.2f}', f'{random.uniform(0, 10):.8f}') for i in range(levels)]
+    asks = [(f'{9000.5 + i * 0.5:.2f}', f'{random.uniform(0, 10):.8f}') for i in range(levels)]
+    asks.reverse()
+    return bids, asks
+
+
+def make_listing(exchanges=6, pairs=1500):
+    """Answer on get_starting listing_info"""
+    time_frames = ['M1', 'M3', 'M5', 'M15', 'M30', 'H1', 'H2', 'H4', 'H12', 'D1', '1W']
+    return {f'Exchange{i}': [time_frames, [f'COIN{j}USDT' for j in range(pairs)]] for i in range(exchanges)}
+
+
+def bench(name, dumps, loads, payloads, number):
+    for payload_name, payload in payloads.items():
+        encoded = dumps(payload)
+        dumps_time = timeit.timeit(lambda: dumps(payload), number=number) / number
+        loads_time = timeit.timeit(lambda: loads(encoded), number=number) / number
+        print(f'{name:8}{payload_name:10}{len(encoded):>10}{dumps_time * 1e6:>14.1f}{loads_time * 1e6:>14.1f}')
+
+
+if __name__ == '__main__':
+    random.seed(0)
+    test_payloads = dict(candles=make_candles(), depth=make_depth(), listing=make_listing())
+    number_runs = 200
+
+    print(f'{"codec":8}{"payload":10}{"bytes":>10}{"dumps, us":>14}{"loads, us":>14}')
+    bench('json', stdlib_dumps, stdlib_loads, test_payloads, number_runs)
+    if orjson is not None:
+        bench('orjson', orjson.dumps, orjson.loads, test_payloads, number_runs)
+    else:
+        print('orjson is not installed')
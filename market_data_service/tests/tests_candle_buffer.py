@@ -0,0 +1,59 @@
+from exchanges.candle_buffer import CandleBuffer, NUMBER_SIZE, format_number
+from decimal import Decimal
+from unittest import TestCase
+
+
+def candle(time, close='1.5'):
+    return '1', '2', '0.5', close, '10', time
+
+
+class CandleBufferTests(TestCase):
+
+    def test_reset_keep_last_candles(self):
+        buffer = CandleBuffer(3)
+        self.assertFalse(buffer.is_seeded)
+        buffer.reset([candle(t) for t in (60, 120, 180, 240)])
+        self.assertTrue(buffer.is_seeded)
+        self.assertEqual([c[5] for c in buffer.candles()], [120, 180, 240])
+        self.assertEqual(buffer.candles()[0], ('1', '2', '0.5', '1.5', '10', 120))
+
+    def test_update_open_candle_in_place(self):
+        buffer = CandleBuffer(3)
+        buffer.reset([candle(60), candle(120)])
+        buffer.update(candle(120, close='1.7'))
+        buffer.update(candle(60, close='9'))
+        self.assertEqual(len(buffer), 2)
+        self.assertEqual(buffer.candles()[-1][3], '1.7')
+        self.assertEqual(buffer.candles()[0][3], '1.5')
+
+    def test_ring_displace_oldest(self):
+        buffer = CandleBuffer(3)
+        buffer.reset([candle(60), candle(120), candle(180)])
+        buffer.update(candle(240))
+        buffer.update(candle(300, close='0.00001234'))
+        self.assertEqual([c[5] for c in buffer.candles()], [180, 240, 300])
+        self.assertEqual([c[5] for c in buffer.candles(2)], [240, 300])
+        self.assertEqual(buffer.candles()[-1][3], '0.00001234')
+        self.assertEqual(buffer.last_time, 300)
+
+    def test_keep_exchange_strings(self):
+        buffer = CandleBuffer(3)
+        buffer.reset([('17928899.62484339', '123456789.12345678', '0.00000000012', '1e-11', '10.00000000', 60)])
+        self.assertEqual(buffer.candles()[0],
+                         ('17928899.62484339', '123456789.12345678', '0.00000000012', '1e-11', '10.00000000', 60))
+
+    def test_reject_number_longer_than_column(self):
+        buffer = CandleBuffer(3)
+        buffer.reset([candle(60)])
+        with self.assertRaises(ValueError):
+            buffer.update(candle(120, close='1' * (NUMBER_SIZE + 1)))
+        self.assertEqual(buffer.candles(), [('1', '2', '0.5', '1.5', '10', 60)])
+
+    def test_format_number_round_trip(self):
+        self.assertEqual(format_number(17928899.62484339), '17928899.62484339')
+        self.assertEqual(format_number(123456789.12345678), '123456789.12345678')
+        self.assertEqual(format_number(1.2e-10), '0.00000000012')
+        self.assertEqual(format_number(1e-11), '0.00000000001')
+        self.assertEqual(format_number(10.0), '10')
+        self.assertEqual(format_number(1e20), '100000000000000000000')
+        self.assertEqual(format_number(Decimal('0.30')), '0.3')
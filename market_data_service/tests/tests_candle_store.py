@@ -0,0 +1,88 @@
+from exchanges.candle_buffer import NUMBER_SIZE
+from exchanges.candle_store import CandleStore
+from unittest import TestCase
+import tempfile
+import shutil
+import os
+
+
+def candle(time, close='1.5'):
+    return '1', '2', '0.5', close, '10', time
+
+
+class CandleStoreTests(TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.store = CandleStore(self.root)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.root)
+
+    def test_append_and_overwrite_last(self):
+        series = self.store.acquire('BTCUSDT', 'M1')
+        for time in (60, 120, 180):
+            series.append(candle(time))
+        series.append(candle(180, close='1.7'))
+        self.assertEqual(len(series), 3)
+        self.assertEqual(series.tail(2), [candle(120), candle(180, close='1.7')])
+        self.assertEqual(series.tail(10)[0], candle(60))
+
+    def test_merge_backfill(self):
+        series = self.store.acquire('BTCUSDT', 'M1')
+        for time in (180, 240):
+            series.append(candle(time))
+        series.merge([candle(60), candle(120), candle(180, close='1.7')])
+        self.assertEqual([c[5] for c in series.range()], [60, 120, 180, 240])
+        self.assertEqual(series.range(120, 240), [candle(120), candle(180, close='1.7')])
+        self.assertEqual(series.range(limit=1), [candle(240)])
+        self.assertEqual(series.last_time, 240)
+
+    def test_reopen(self):
+        series = self.store.acquire('BTCUSDT', 'M1')
+        series.merge([candle(60), candle(120)])
+        self.store.close()
+
+        self.store = CandleStore(self.root)
+        series = self.store.acquire('BTCUSDT', 'M1')
+        self.assertEqual(series.last_time, 120)
+        self.assertEqual(series.tail(5), [candle(60), candle(120)])
+
+    def test_prices_round_trip(self):
+        series = self.store.acquire('BTCUSDT', 'M1')
+        exchange_candle = ('17928899.62484339', '123456789.123456789012', '0.01634790', '1e-11', '10.00', 60)
+        series.append(exchange_candle)
+        self.assertEqual(series.tail(1), [exchange_candle])
+        self.store.close()
+
+        self.store = CandleStore(self.root)
+        self.assertEqual(self.store.acquire('BTCUSDT', 'M1').tail(1), [exchange_candle])
+
+    def test_batch_writes(self):
+        series = self.store.acquire('BTCUSDT', 'M1')
+        series.flush_size = 2
+        path = os.path.join(self.root, 'BTCUSDT', 'M1', 'close.bin')
+        series.append(candle(60))
+        for close in ('1.6', '1.7', '1.8'):
+            series.append(candle(120, close=close))
+        # updates of open candle replace pending candle
+        self.assertEqual(os.path.getsize(path), 0)
+        series.append(candle(180))
+        self.assertEqual(os.path.getsize(path), 3 * NUMBER_SIZE)
+        series.append(candle(240))
+        series.append(candle(300))
+        self.assertEqual(os.path.getsize(path), 3 * NUMBER_SIZE)
+        # read writes pending candles
+        self.assertEqual(series.tail(3), [candle(180), candle(240), candle(300)])
+        self.assertEqual(series.tail(5)[1], candle(120, close='1.8'))
+        self.assertEqual(os.path.getsize(path), 5 * NUMBER_SIZE)
+
+    def test_close_series_on_last_release(self):
+        series = self.store.acquire('BTCUSDT', 'M1')
+        self.assertIs(self.store.acquire('BTCUSDT', 'M1'), series)
+        self.store.release('BTCUSDT', 'M1')
+        self.assertIs(self.store.get('BTCUSDT', 'M1'), series)
+        self.store.release('BTCUSDT', 'M1')
+        self.assertIsNone(self.store.get('BTCUSDT', 'M1'))
+        self.assertFalse(series._fds)
@@ -0,0 +1,80 @@
+from cluster import Cluster, HashRing
+from unittest import TestCase
+import json_codec
+import asyncio
+
+
+class FakeMessage:
+
+    def __init__(self, body):
+        self.body = json_codec.dumps(body)
+
+
+class FakeExchange:
+
+    def __init__(self):
+        self.published = []
+
+    async def publish(self, message, routing_key):
+        self.published.append((json_codec.loads(message.body), routing_key))
+
+
+class FakeChannel:
+
+    def __init__(self):
+        self.default_exchange = FakeExchange()
+
+
+class HashRingTests(TestCase):
+
+    def test_owner_stable_after_join(self):
+        keys = [f'Binance.PAIR{i}' for i in range(300)]
+        ring = HashRing(['a', 'b'])
+        owners = {key: ring.owner(key) for key in keys}
+        self.assertEqual(set(owners.values()), {'a', 'b'})
+
+        ring = HashRing(['a', 'b', 'c'])
+        for key in keys:
+            # only keys, that are moved to new node, change owner
+            self.assertIn(ring.owner(key), (owners[key], 'c'))
+
+    def test_empty_ring(self):
+        self.assertIsNone(HashRing([]).owner('Binance.BTCUSDT'))
+
+
+class ClusterTests(TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.taken = []
+        self.released = []
+        self.cluster = Cluster('queue', 'a', on_take=self.taken.append, on_release=self.released.append)
+        self.cluster._channel = FakeChannel()
+        self.data_ids = [f'ticker.Binance.PAIR{i}' for i in range(100)]
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_move_subscriptions_to_joined_member(self):
+        async def scenario():
+            for data_id in self.data_ids:
+                self.cluster.track(data_id, 'sub')
+            self.cluster._on_heartbeat(FakeMessage(dict(instance='b', subscriptions=[], leave=False)))
+            await asyncio.sleep(0)
+
+        self.loop.run_until_complete(scenario())
+        moved = [data_id for data_id in self.data_ids if self.cluster.owner(data_id) == 'b']
+        self.assertTrue(moved)
+        self.assertEqual(sorted(self.released), sorted(moved))
+        self.assertEqual(self.cluster.subscriptions, set(self.data_ids) - set(moved))
+        published = self.cluster._channel.default_exchange.published
+        self.assertEqual(sorted(body['data_id'] for body, _ in published), sorted(moved))
+        self.assertEqual({routing_key for _, routing_key in published}, {'queue.node.b'})
+
+    def test_take_over_subscriptions_of_left_member(self):
+        self.cluster._on_heartbeat(FakeMessage(dict(instance='b', subscriptions=[], leave=False)))
+        foreign = [data_id for data_id in self.data_ids if self.cluster.owner(data_id) == 'b']
+        self.cluster._on_heartbeat(FakeMessage(dict(instance='b', subscriptions=foreign, leave=True)))
+        self.assertEqual(sorted(self.taken), sorted(foreign))
+        self.assertTrue(all(self.cluster.is_local(data_id) for data_id in self.data_ids))
@@ -0,0 +1,74 @@
+from collections import namedtuple
+from conflator import Conflator
+from unittest import TestCase
+import asyncio
+
+Message = namedtuple('Message', ['body'])
+
+
+class FakePublisher:
+
+    def __init__(self):
+        self.published = []
+
+    async def publish(self, message, routing_key):
+        self.published.append((routing_key, message.body))
+
+
+class ConflatorTests(TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.publisher = FakePublisher()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_drop_duplicates(self):
+        conflator = Conflator(self.publisher)
+
+        async def scenario():
+            for body in (b'1', b'1', b'2', b'2', b'1'):
+                await conflator.publish(Message(body), 'update.ticker.Binance.BTCUSDT')
+            await conflator.publish(Message(b'1'), 'update.ticker.Binance.ETHUSDT')
+            await conflator.publish(Message(b'err'), 'errors')
+            await conflator.publish(Message(b'err'), 'errors')
+
+        self.loop.run_until_complete(scenario())
+        self.assertEqual(self.publisher.published, [
+            ('update.ticker.Binance.BTCUSDT', b'1'),
+            ('update.ticker.Binance.BTCUSDT', b'2'),
+            ('update.ticker.Binance.BTCUSDT', b'1'),
+            ('update.ticker.Binance.ETHUSDT', b'1'),
+            ('errors', b'err'),
+            ('errors', b'err'),
+        ])
+
+    def test_min_interval_publish_latest(self):
+        conflator = Conflator(self.publisher, min_interval=0.05)
+        key = 'update.depth.Binance.BTCUSDT'
+
+        async def scenario():
+            for body in (b'1', b'2', b'3', b'4'):
+                await conflator.publish(Message(body), key)
+            self.assertEqual(self.publisher.published, [(key, b'1')])
+
+            await asyncio.sleep(0.1)
+            self.assertEqual(self.publisher.published, [(key, b'1'), (key, b'4')])
+
+        self.loop.run_until_complete(scenario())
+
+    def test_forget(self):
+        conflator = Conflator(self.publisher, min_interval=10)
+        key = 'update.depth.Binance.BTCUSDT'
+
+        async def scenario():
+            await conflator.publish(Message(b'1'), key)
+            await conflator.publish(Message(b'2'), key)
+            conflator.forget(key)
+
+            await conflator.publish(Message(b'1'), key)
+
+        self.loop.run_until_complete(scenario())
+        self.assertEqual(self.publisher.published, [(key, b'1'), (key, b'1')])
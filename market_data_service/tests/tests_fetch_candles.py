@@ -0,0 +1,54 @@
+from exchanges.abstract_exchange import BaseExchange
+from unittest import TestCase
+import asyncio
+
+
+class FakeExchange(BaseExchange):
+    """Exchange with history of M1 candles [0, 600)"""
+
+    name = 'Fake'
+
+    def __init__(self):
+        super().__init__(None)
+        self.candles_page_size = 2
+        self.history_concurrency = 2
+        self.requests = []
+        self.running = 0
+        self.max_running = 0
+
+    async def _fetch_candles_page(self, symbol, time_frame, start, end):
+        self.requests.append((start, end))
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        # later pages are answered faster
+        await asyncio.sleep(0.01 * (600 - start) / 120)
+        self.running -= 1
+        return [('1', '1', '1', '1', '1', time) for time in range(start - start % 60, end, 60) if time < 600]
+
+
+class FetchCandlesTests(TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_pages_in_order(self):
+        exchange = FakeExchange()
+
+        async def scenario():
+            pages = []
+            async for candles in exchange.fetch_candles('BTCUSDT', 'M1', 90, 1000):
+                pages.append([candle[5] for candle in candles])
+            return pages
+
+        pages = self.loop.run_until_complete(scenario())
+        self.assertEqual(pages, [[120, 180], [240, 300], [360, 420], [480, 540]])
+        self.assertEqual(exchange.requests[0], (90, 120))
+        self.assertEqual(exchange.max_running, 2)
+
+    def test_pages_of_time_frame(self):
+        exchange = FakeExchange()
+        self.assertEqual(exchange._candles_pages('H1', 0, 4 * 3600), [(0, 7200), (7200, 14400)])
@@ -0,0 +1,29 @@
+from listing_index import ListingIndex, parse_data_id
+from unittest import TestCase
+
+
+class ListingIndexTests(TestCase):
+
+    def test_parse_data_id(self):
+        data_id = parse_data_id('candles.Binance.BTCUSDT.M1')
+        self.assertEqual(data_id.data_type, 'candles')
+        self.assertEqual(data_id.exchange, 'Binance')
+        self.assertEqual(data_id.pair, 'BTCUSDT')
+        self.assertEqual(data_id.time_frame, 'M1')
+        self.assertEqual(data_id.update_key, 'update.candles.Binance.BTCUSDT.M1')
+        self.assertEqual(data_id.starting_key, 'starting.candles.Binance.BTCUSDT.M1')
+        self.assertIs(parse_data_id('candles.Binance.BTCUSDT.M1'), data_id)
+
+    def test_parse_short_data_id(self):
+        data_id = parse_data_id('ticker.Binance')
+        self.assertEqual(data_id.pair, None)
+        self.assertEqual(data_id.time_frame, None)
+
+    def test_index(self):
+        index = ListingIndex({'Binance': [['M1', 'H1'], ['BTCUSDT', 'ETHUSDT']]})
+        self.assertTrue(index.has_exchange('Binance'))
+        self.assertFalse(index.has_exchange('Huobi'))
+        self.assertTrue(index.has_pair('Binance', 'ETHUSDT'))
+        self.assertFalse(index.has_pair('Binance', 'ETHBTC'))
+        self.assertTrue(index.has_time_frame('Binance', 'H1'))
+        self.assertFalse(index.has_time_frame('Binance', 'M5'))
@@ -0,0 +1,38 @@
+from exchanges.order_book import OrderBook
+from unittest import TestCase
+import zlib
+
+
+class OrderBookTests(TestCase):
+
+    def setUp(self):
+        self.book = OrderBook()
+        self.book.reset(bids=[['10.0', '1'], ['9.5', '2'], ['9.0', '3']],
+                        asks=[['10.5', '1'], ['11', '2']], sequence=100)
+
+    def test_top(self):
+        bids, asks = self.book.top(2)
+        self.assertEqual(bids, [('10.0', '1'), ('9.5', '2')])
+        # asks sorted DESC as in all depth messages of this MS
+        self.assertEqual(asks, [('11', '2'), ('10.5', '1')])
+
+    def test_update(self):
+        self.book.update(bids=[['10.0', '0.000'], ['9.9', '5']], asks=[['10.5', '3']], sequence=101)
+
+        bids, asks = self.book.top(20)
+        self.assertEqual(bids, [('9.9', '5'), ('9.5', '2'), ('9.0', '3')])
+        self.assertEqual(asks, [('11', '2'), ('10.5', '3')])
+        self.assertEqual(self.book.sequence, 101)
+
+    def test_clear(self):
+        self.assertTrue(self.book.is_synced)
+        self.book.clear()
+        self.assertFalse(self.book.is_synced)
+        self.assertEqual(self.book.top(), ([], []))
+
+    def test_checksum(self):
+        expected = zlib.crc32(b'10.0:1:10.5:1:9.5:2:11:2:9.0:3')
+        expected = expected - (1 << 32) if expected >= (1 << 31) else expected
+
+        self.assertEqual(self.book.checksum(), expected)
+        self.assertTrue(-(1 << 31) <= self.book.checksum() < (1 << 31))
@@ -0,0 +1,67 @@
+from exchanges.poll_scheduler import PollScheduler
+from unittest import TestCase
+import asyncio
+
+
+class PollSchedulerTests(TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.requests_count = 0
+
+    def tearDown(self):
+        self.loop.close()
+
+    async def _fetch_tickers(self):
+        self.requests_count += 1
+        return dict(BTC=(1, 2), ETH=(3, 4))
+
+    def test_bulk_poll_is_shared(self):
+        scheduler = PollScheduler(interval=0.05)
+
+        async def scenario():
+            async with scheduler.subscribe('tickers', self._fetch_tickers, 'BTC') as btc, \
+                    scheduler.subscribe('tickers', self._fetch_tickers, 'ETH') as eth:
+                self.assertEqual(await btc.get(), (1, 2))
+                self.assertEqual(await eth.get(), (3, 4))
+                self.assertEqual(self.requests_count, 1)
+
+                await btc.get()
+                self.assertEqual(self.requests_count, 2)
+
+        self.loop.run_until_complete(scenario())
+        self.assertEqual(scheduler._polls, {})
+
+    def test_budget_stretch_cycle(self):
+        scheduler = PollScheduler(interval=2, max_requests_per_second=0.5)
+
+        async def scenario():
+            async with scheduler.subscribe('a', self._fetch_tickers), scheduler.subscribe('b', self._fetch_tickers), \
+                    scheduler.subscribe('c', self._fetch_tickers):
+                self.assertEqual(scheduler.cycle_time, 6)
+
+        self.loop.run_until_complete(scenario())
+
+    def test_error_stop_subscriptions(self):
+        scheduler = PollScheduler(interval=0.05)
+
+        async def fetch():
+            raise ValueError('bad response')
+
+        async def scenario():
+            async with scheduler.subscribe('tickers', fetch, 'BTC') as btc:
+                with self.assertRaises(ValueError):
+                    await btc.get()
+
+        self.loop.run_until_complete(scenario())
+
+    def test_missing_key(self):
+        scheduler = PollScheduler(interval=0.05)
+
+        async def scenario():
+            async with scheduler.subscribe('tickers', self._fetch_tickers, 'LTC') as ltc:
+                with self.assertRaises(KeyError):
+                    await ltc.get()
+
+        self.loop.run_until_complete(scenario())
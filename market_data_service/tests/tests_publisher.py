@@ -0,0 +1,81 @@
+from unittest import TestCase
+from publisher import Publisher
+import asyncio
+
+
+class SlowExchanger:
+    """Exchanger, that publish message only after release"""
+
+    def __init__(self):
+        self.published = []
+        self.released = None
+
+    async def publish(self, message, routing_key):
+        await self.released.wait()
+        self.published.append((routing_key, message))
+
+
+class PublisherTests(TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.exchanger = SlowExchanger()
+        self.exchanger.released = asyncio.Event()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_publish_not_wait_broker(self):
+        publisher = Publisher(self.exchanger)
+
+        async def scenario():
+            publisher.start()
+            for i in range(5):
+                await asyncio.wait_for(publisher.publish(i, 'update.depth.binance.BTCUSDT'), 0.1)
+            self.assertEqual(self.exchanger.published, [])
+
+            self.exchanger.released.set()
+            await publisher.close()
+
+        self.loop.run_until_complete(scenario())
+        self.assertEqual([message for _, message in self.exchanger.published], [0, 1, 2, 3, 4])
+
+    def test_conflation_latest_value_wins(self):
+        publisher = Publisher(self.exchanger, conflate_prefixes=('update.ticker.', ))
+
+        async def scenario():
+            publisher.start()
+            # writer take first message and wait broker
+            await publisher.publish(0, 'update.ticker.binance.BTCUSDT')
+            await asyncio.sleep(0)
+            for i in range(1, 5):
+                await publisher.publish(i, 'update.ticker.binance.BTCUSDT')
+                await publisher.publish(i, 'update.depth.binance.BTCUSDT')
+
+            self.exchanger.released.set()
+            await publisher.close()
+
+        self.loop.run_until_complete(scenario())
+        ticker = [message for key, message in self.exchanger.published if key.startswith('update.ticker.')]
+        depth = [message for key, message in self.exchanger.published if key.startswith('update.depth.')]
+        self.assertEqual(ticker, [0, 4])
+        self.assertEqual(depth, [1, 2, 3, 4])
+
+    def test_bounded_queue(self):
+        publisher = Publisher(self.exchanger, max_size=2, batch_size=1)
+
+        async def scenario():
+            publisher.start()
+            await publisher.publish(0, 'update.depth.binance.BTCUSDT')
+            await asyncio.sleep(0)
+            await publisher.publish(1, 'update.depth.binance.BTCUSDT')
+            await publisher.publish(2, 'update.depth.binance.BTCUSDT')
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(publisher.publish(3, 'update.depth.binance.BTCUSDT'), 0.05)
+
+            self.exchanger.released.set()
+            await publisher.close()
+
+        self.loop.run_until_complete(scenario())
+        self.assertEqual([message for _, message in self.exchanger.published], [0, 1, 2])
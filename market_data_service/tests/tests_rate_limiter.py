@@ -0,0 +1,77 @@
+from exchanges.rate_limiter import RateLimiter, TokenBucket
+from unittest import TestCase
+import asyncio
+
+
+class RateLimiterTests(TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_wait_tokens(self):
+        bucket = TokenBucket(capacity=10, period=0.1)
+
+        async def scenario():
+            loop = asyncio.get_event_loop()
+            start = loop.time()
+            await bucket.acquire(10)
+            self.assertLess(loop.time() - start, 0.01)
+            await bucket.acquire(5)
+            return loop.time() - start
+
+        elapsed = self.loop.run_until_complete(scenario())
+        self.assertGreaterEqual(elapsed, 0.045)
+        self.assertEqual(bucket.total_weight, 15)
+
+    def test_fifo_order(self):
+        bucket = TokenBucket(capacity=4, period=0.04)
+        order = []
+
+        async def request(name, weight):
+            await bucket.acquire(weight)
+            order.append(name)
+
+        async def scenario():
+            await bucket.acquire(4)
+            await asyncio.gather(request('heavy', 4), request('light', 1))
+
+        self.loop.run_until_complete(scenario())
+        self.assertEqual(order, ['heavy', 'light'])
+
+    def test_limiter_usage(self):
+        limiter = RateLimiter(dict(weight=(100, 60)))
+
+        async def scenario():
+            await limiter.acquire('weight', 25)
+            await limiter.acquire('unlimited', 1000)
+            return limiter.usage()
+
+        usage = self.loop.run_until_complete(scenario())
+        self.assertEqual(list(usage.keys()), ['weight'])
+        self.assertAlmostEqual(usage['weight']['usage'], 0.25, places=2)
+        self.assertEqual(usage['weight']['total_weight'], 25)
+
+    def test_weight_exceed_capacity(self):
+        bucket = TokenBucket(capacity=4, period=1)
+        with self.assertRaises(ValueError):
+            self.loop.run_until_complete(bucket.acquire(5))
+
+    def test_scale_limits(self):
+        limiter = RateLimiter(dict(weight=(1200, 60)))
+        limiter.scale(0.25)
+        bucket = limiter._buckets['weight']
+        self.assertEqual(bucket.capacity, 300)
+        with self.assertRaises(ValueError):
+            self.loop.run_until_complete(limiter.acquire('weight', 301))
+
+    def test_scale_keep_heaviest_request(self):
+        limiter = RateLimiter(dict(weight=(1200, 60, 10)))
+        limiter.scale(1 / 200)
+        bucket = limiter._buckets['weight']
+        self.assertEqual(bucket.capacity, 10)
+        self.assertAlmostEqual(bucket.capacity / bucket.period, 1200 / 60 / 200)
+        self.loop.run_until_complete(limiter.acquire('weight', 10))
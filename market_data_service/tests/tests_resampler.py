@@ -0,0 +1,118 @@
+from exchanges.abstract_exchange import BaseExchange
+from exchanges.resampler import Resampler
+from exchanges import timeframes
+from unittest import TestCase
+import calendar
+import asyncio
+
+
+def unix(*date):
+    return calendar.timegm(date + (0, ) * (6 - len(date)))
+
+
+class TimeFramesTests(TestCase):
+
+    def test_align(self):
+        time = unix(2019, 3, 20, 17, 47, 12)
+        self.assertEqual(timeframes.align(time, 'M5'), unix(2019, 3, 20, 17, 45))
+        self.assertEqual(timeframes.align(time, 'H4'), unix(2019, 3, 20, 16))
+        self.assertEqual(timeframes.align(time, 'D1'), unix(2019, 3, 20))
+        # 2019-03-18 is Monday
+        self.assertEqual(timeframes.align(time, '1W'), unix(2019, 3, 18))
+        self.assertEqual(timeframes.align(time, '1M'), unix(2019, 3, 1))
+        self.assertEqual(timeframes.align(time, '1Y'), unix(2019, 1, 1))
+
+    def test_align_utc_offset(self):
+        offset = 8 * 60 * 60
+        self.assertEqual(timeframes.align(unix(2019, 3, 20, 17, 47), 'D1', offset), unix(2019, 3, 20, 16))
+        self.assertEqual(timeframes.align(unix(2019, 3, 20, 15, 47), 'D1', offset), unix(2019, 3, 19, 16))
+        self.assertEqual(timeframes.align(unix(2019, 3, 31, 17), '1M', offset), unix(2019, 3, 31, 16))
+
+
+class ResamplerTests(TestCase):
+
+    def test_build_candle_from_minutes(self):
+        resampler = Resampler('M5')
+        start = unix(2019, 3, 20, 17, 45)
+        resampler.update(('10', '11', '9', '10.5', '1', start))
+        resampler.update(('10', '12', '9', '11', '2', start))
+        candle = resampler.update(('11', '11.5', '8', '9', '3', start + 60))
+        self.assertEqual(candle, ('10', '12', '8', '9', '5', start))
+
+        candle = resampler.update(('9', '9', '9', '9', '1', start + 300))
+        self.assertEqual(candle, ('9', '9', '9', '9', '1', start + 300))
+        self.assertIsNone(resampler.update(('9', '9', '9', '9', '1', start + 240)))
+
+    def test_seed_subtract_current_minute(self):
+        resampler = Resampler('H1')
+        start = unix(2019, 3, 20, 17)
+        resampler.seed(('10', '15', '5', '12', '100', start))
+        candle = resampler.update(('12', '13', '11', '13', '4', start + 600))
+        self.assertEqual(candle, ('10', '15', '5', '13', '100', start))
+        candle = resampler.update(('13', '16', '13', '14', '1', start + 660))
+        self.assertEqual(candle, ('10', '16', '5', '14', '101', start))
+
+    def test_volume_sum_is_exact(self):
+        resampler = Resampler('M5')
+        start = unix(2019, 3, 20, 17)
+        resampler.update(('1', '1', '1', '1', '0.1', start))
+        candle = resampler.update(('1', '1', '1', '1', '0.2', start + 60))
+        self.assertEqual(candle[4], '0.3')
+
+
+class FakeExchange(BaseExchange):
+    """Exchange with M1 stream from queue"""
+
+    name = 'Fake'
+
+    def __init__(self):
+        super().__init__(None)
+        self.access_timeframes = ['M1', 'M5']
+        self.minutes = asyncio.Queue()
+        self.streams_count = 0
+        self.sent = []
+
+    async def _request_candles(self, symbol, time_frame):
+        return []
+
+    async def _subscribe_candles(self, queue_name, symbol, time_frame):
+        self.streams_count += 1
+        while True:
+            await self._send_data_in_exchange(queue_name, await self.minutes.get())
+
+    async def _send_data_in_exchange(self, queue_name, data):
+        if queue_name in self._candle_feeds_by_queue:
+            await super()._send_data_in_exchange(queue_name, data)
+        else:
+            self.sent.append((queue_name, data))
+
+
+class CandleFeedTests(TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_time_frames_share_m1_stream(self):
+        exchange = FakeExchange()
+        start = unix(2019, 3, 20, 17, 45)
+
+        async def scenario():
+            m1 = asyncio.ensure_future(exchange.subscribe_candles('m1', 'BTCUSDT', 'M1'))
+            m5 = asyncio.ensure_future(exchange.subscribe_candles('m5', 'BTCUSDT', 'M5'))
+            await asyncio.sleep(0.01)
+            exchange.minutes.put_nowait(('10', '11', '9', '10.5', '1', start + 60))
+            await asyncio.sleep(0.01)
+
+            m1.cancel()
+            m5.cancel()
+            await asyncio.gather(m1, m5, return_exceptions=True)
+
+        self.loop.run_until_complete(scenario())
+        self.assertEqual(exchange.streams_count, 1)
+        self.assertEqual(exchange._candle_feeds, {})
+        self.assertIn(('m1', ('10', '11', '9', '10.5', '1', start + 60)), exchange.sent)
+        self.assertIn(('m5', ('10', '11', '9', '10.5', '1', start)), exchange.sent)
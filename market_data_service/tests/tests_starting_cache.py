@@ -0,0 +1,112 @@
+from starting_cache import StartingCache
+from collections import namedtuple
+from controller import Controller
+from unittest import TestCase
+import asyncio
+
+Message = namedtuple('Message', ['body'])
+
+
+class FakePublisher:
+
+    def __init__(self):
+        self.published = []
+
+    async def publish(self, message, routing_key):
+        self.published.append((routing_key, message.body))
+
+
+class FakeExchange:
+    """Exchange, that answer get_starting_ticker, when test release it"""
+
+    def __init__(self, publisher):
+        self.publisher = publisher
+        self.calls = 0
+        self.released = asyncio.Event()
+
+    async def get_starting_ticker(self, routing_key, pair):
+        self.calls += 1
+        await self.released.wait()
+        await self.publisher.publish(Message(b'["1","2"]'), routing_key)
+
+
+class FakeFactory:
+
+    def __init__(self, exchange):
+        self.exchange = exchange
+
+    def create_exchange(self, name):
+        return self.exchange
+
+
+class StartingCacheTests(TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.publisher = FakePublisher()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_cache_starting_data(self):
+        cache = StartingCache(self.publisher, ttl=0.05)
+        key = 'starting.ticker.Binance.BTCUSDT'
+
+        async def scenario():
+            await cache.publish(Message(b'[1,2]'), key)
+            await cache.publish(Message(b'[3,4]'), 'update.ticker.Binance.BTCUSDT')
+            self.assertEqual(cache.get(key).body, b'[1,2]')
+            self.assertIsNone(cache.get('update.ticker.Binance.BTCUSDT'))
+
+            await asyncio.sleep(0.1)
+            self.assertIsNone(cache.get(key))
+
+        self.loop.run_until_complete(scenario())
+        self.assertEqual(len(self.publisher.published), 2)
+
+    def test_empty_data_not_cached(self):
+        cache = StartingCache(self.publisher)
+
+        async def scenario():
+            await cache.publish(Message(b'[0,0]'), 'starting.ticker.Binance.BTCUSDT')
+            await cache.publish(Message(b'[[],[]]'), 'starting.depth.Binance.BTCUSDT')
+
+        self.loop.run_until_complete(scenario())
+        self.assertIsNone(cache.get('starting.ticker.Binance.BTCUSDT'))
+        self.assertIsNone(cache.get('starting.depth.Binance.BTCUSDT'))
+        self.assertEqual(len(self.publisher.published), 2)
+
+
+class SingleFlightTests(TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.publisher = FakePublisher()
+        self.controller = Controller()
+        self.controller._publisher = self.publisher
+        self.controller._starting_cache = StartingCache(self.publisher, ttl=10)
+        self.exchange = FakeExchange(self.controller._starting_cache)
+        self.controller._factory = FakeFactory(self.exchange)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_identical_requests_share_one_call(self):
+        data_id = 'ticker.Binance.BTCUSDT'
+
+        async def scenario():
+            await self.controller._get_starting_data(data_id)
+            await asyncio.sleep(0)
+            # second request come while first is in flight
+            await self.controller._get_starting_data(data_id)
+            self.assertEqual(self.exchange.calls, 1)
+
+            self.exchange.released.set()
+            await asyncio.sleep(0.01)
+            self.assertEqual(self.controller._starting_requests, {})
+
+        self.loop.run_until_complete(scenario())
+        self.assertEqual(self.exchange.calls, 1)
+        self.assertEqual(self.publisher.published, [(f'starting.{data_id}', b'["1","2"]')])
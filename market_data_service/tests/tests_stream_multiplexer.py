@@ -0,0 +1,213 @@
+from exchanges.abstract_exchange import BaseExchange, _catch_error_decorator_factory
+from exchanges.stream_multiplexer import StreamError
+from aiohttp import WSMessage, WSMsgType
+from unittest import TestCase
+import asyncio
+import json
+
+
+class FakeWebSocket:
+    """WebSocket connection, that store sent messages and return messages from queue"""
+
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+        self.close_code = None
+        self._messages = asyncio.Queue()
+
+    async def send_json(self, data):
+        if self.closed:
+            raise ConnectionResetError('Cannot write to closing transport')
+        self.sent.append(data)
+
+    def feed(self, data):
+        self._messages.put_nowait(WSMessage(WSMsgType.TEXT, json.dumps(data), None))
+
+    def exception(self):
+        return None
+
+    async def close(self):
+        self.closed = True
+        self._messages.put_nowait(None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        message = await self._messages.get()
+        if message is None:
+            raise StopAsyncIteration
+        return message
+
+
+class FakeSession:
+
+    def __init__(self):
+        self.connections = []
+
+    async def ws_connect(self, url):
+        ws = FakeWebSocket()
+        self.connections.append(ws)
+        return ws
+
+
+class FakeExchange(BaseExchange):
+
+    name = 'Fake'
+
+    def __init__(self):
+        super().__init__(None)
+        self._root_url_ws = 'wss://fake'
+        self.ws_streams_per_connection = 2
+        self.session = FakeSession()
+        self.published = []
+
+    async def _send_data_in_exchange(self, queue_name, data):
+        self.published.append((queue_name, data))
+
+    @_catch_error_decorator_factory(empty_data=[])
+    async def subscribe_fake(self, queue_name, key):
+        async with self._streams.subscribe(key) as subscription:
+            while True:
+                await self._send_data_in_exchange(queue_name, await subscription.get())
+
+    def _get_session(self):
+        return self.session
+
+    def _ws_subscribe_message(self, key, request_id):
+        return dict(sub=key, id=request_id)
+
+    def _ws_subscribe_batch_message(self, keys, request_id):
+        return dict(sub=keys, id=request_id)
+
+    def _ws_unsubscribe_message(self, key, request_id):
+        return dict(unsub=key)
+
+    async def _ws_route(self, ws, data):
+        if 'error' in data:
+            raise ValueError(data['error'])
+        if 'reject' in data:
+            raise StreamError('rejected', request_id=data['reject'])
+        return [(data['stream'], data['data'])] if 'stream' in data else []
+
+
+class StreamMultiplexerTests(TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.exchange = FakeExchange()
+        self.streams = self.exchange._streams
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_shard_and_route(self):
+        async def scenario():
+            async with self.streams.subscribe('a') as sub_a, self.streams.subscribe('b') as sub_b, \
+                    self.streams.subscribe('c') as sub_c:
+                connections = self.exchange.session.connections
+                self.assertEqual(len(connections), 2)
+                self.assertEqual(connections[0].sent, [dict(sub='a', id=1), dict(sub='b', id=2)])
+                self.assertEqual(connections[1].sent, [dict(sub='c', id=3)])
+
+                connections[0].feed(dict(stream='b', data=1))
+                connections[0].feed(dict(result=None))
+                connections[1].feed(dict(stream='c', data=2))
+                self.assertEqual(await sub_b.get(), 1)
+                self.assertEqual(await sub_c.get(), 2)
+                self.assertTrue(sub_a._queue.empty())
+            return connections
+
+        connections = self.loop.run_until_complete(scenario())
+        self.assertEqual(connections[0].sent[-1], dict(unsub='b'))
+        self.assertTrue(all(ws.closed for ws in connections))
+        self.assertEqual(self.streams.connections_count, 0)
+
+    def test_one_stream_several_subscriptions(self):
+        async def scenario():
+            async with self.streams.subscribe('a') as first:
+                async with self.streams.subscribe('a') as second:
+                    ws = self.exchange.session.connections[0]
+                    ws.feed(dict(stream='a', data=1))
+                    self.assertEqual(await first.get(), 1)
+                    self.assertEqual(await second.get(), 1)
+                self.assertEqual(ws.sent, [dict(sub='a', id=1)])
+                self.assertFalse(ws.closed)
+
+        self.loop.run_until_complete(scenario())
+
+    def test_error_stop_subscriptions_on_connection(self):
+        async def scenario():
+            async with self.streams.subscribe('a') as sub_a, self.streams.subscribe('b') as sub_b:
+                ws = self.exchange.session.connections[0]
+                ws.feed(dict(error='bad'))
+                with self.assertRaises(ValueError):
+                    await sub_a.get()
+                with self.assertRaises(ValueError):
+                    await sub_b.get()
+                self.assertTrue(ws.closed)
+                self.assertEqual(self.streams.connections_count, 0)
+
+        self.loop.run_until_complete(scenario())
+
+    def test_rejected_stream_keep_connection(self):
+        async def scenario():
+            async with self.streams.subscribe('a') as sub_a, self.streams.subscribe('b') as sub_b:
+                ws = self.exchange.session.connections[0]
+                ws.feed(dict(reject=2))
+                with self.assertRaises(StreamError):
+                    await sub_b.get()
+                ws.feed(dict(reject=99))
+                ws.feed(dict(stream='a', data=1))
+                self.assertEqual(await sub_a.get(), 1)
+                self.assertFalse(ws.closed)
+                self.assertEqual(self.streams.connections_count, 1)
+
+        self.loop.run_until_complete(scenario())
+
+    def test_batch_subscribes(self):
+        self.exchange.ws_subscribe_batch_size = 2
+        self.exchange.ws_streams_per_connection = 10
+
+        async def scenario():
+            async def read(key):
+                async with self.streams.subscribe(key) as subscription:
+                    return await subscription.get()
+
+            tasks = [asyncio.ensure_future(read(key)) for key in 'abc']
+            await asyncio.sleep(0.01)
+            ws = self.exchange.session.connections[0]
+            self.assertEqual(ws.sent, [dict(sub=['a', 'b'], id=1), dict(sub='c', id=2)])
+            for key in 'abc':
+                ws.feed(dict(stream=key, data=key))
+            self.assertEqual(await asyncio.gather(*tasks), ['a', 'b', 'c'])
+
+        self.loop.run_until_complete(scenario())
+
+    def test_rejected_batch_fail_all_streams(self):
+        self.exchange.ws_subscribe_batch_size = 2
+        self.exchange.ws_streams_per_connection = 10
+
+        async def scenario():
+            tasks = [asyncio.ensure_future(self.exchange.subscribe_fake(f'update.{key}', key)) for key in 'abc']
+            await asyncio.sleep(0.01)
+            ws = self.exchange.session.connections[0]
+            ws.feed(dict(reject=1))
+            await asyncio.gather(tasks[0], tasks[1])
+            ws.feed(dict(stream='c', data='c'))
+            await asyncio.sleep(0.01)
+            self.assertFalse(tasks[2].done())
+            self.assertFalse(ws.closed)
+            tasks[2].cancel()
+            await asyncio.gather(tasks[2], return_exceptions=True)
+
+        self.loop.run_until_complete(scenario())
+        # rejected streams get empty data and error
+        published = self.exchange.published
+        self.assertIn(('update.a', []), published)
+        self.assertIn(('update.b', []), published)
+        self.assertIn(('update.c', 'c'), published)
+        errors = [data for _, data in published if isinstance(data, dict)]
+        self.assertEqual(sorted(error['error_place'] for error in errors), ['update.a', 'update.b'])
+        self.assertTrue(all('StreamError' in error['message'] for error in errors))
@@ -0,0 +1,66 @@
+from exchanges.backoff import Backoff
+from controller import Controller
+from unittest import TestCase
+import asyncio
+
+
+class BackoffTests(TestCase):
+
+    def test_delay_grow_to_max(self):
+        backoff = Backoff(base_delay=1, max_delay=8)
+        for attempt in range(6):
+            self.assertLessEqual(backoff.delay(), min(8, 2 ** attempt))
+        backoff.reset()
+        self.assertLessEqual(backoff.delay(), 1)
+
+
+class SupervisorTests(TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.controller = Controller()
+        self.controller.restart_base_delay = 0.01
+        self.controller.restart_max_delay = 0.02
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_restart_stopped_subscription(self):
+        calls = []
+
+        async def subscribe():
+            calls.append(1)
+            if len(calls) == 2:
+                raise RuntimeError('parse error')
+
+        async def scenario():
+            task = asyncio.ensure_future(self.controller._supervise('ticker.Binance.BTCUSDT', subscribe))
+            while len(calls) < 3:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            return task
+
+        task = self.loop.run_until_complete(scenario())
+        self.assertTrue(task.cancelled())
+
+    def test_restarts_are_limited(self):
+        self.controller.restarts_burst = 2
+        self.controller.restarts_period = 10
+        calls = []
+
+        async def subscribe():
+            calls.append(1)
+
+        async def scenario():
+            tasks = [asyncio.ensure_future(self.controller._supervise(f'ticker.Binance.{pair}', subscribe))
+                     for pair in ('BTCUSDT', 'ETHUSDT', 'LTCUSDT')]
+            await asyncio.sleep(0.2)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        self.loop.run_until_complete(scenario())
+        # 3 first starts and 2 restarts from bucket
+        self.assertEqual(len(calls), 5)
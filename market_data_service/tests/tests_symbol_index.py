@@ -0,0 +1,62 @@
+from exchanges.abstract_exchange import BaseExchange
+from exchanges.symbol_index import SymbolIndex
+from unittest import TestCase
+import asyncio
+
+
+class SymbolIndexTests(TestCase):
+
+    def test_translate(self):
+        index = SymbolIndex()
+        self.assertTrue(index.is_empty())
+        self.assertTrue(index.is_expired())
+
+        index.rebuild([('BTCUSDT', 'BTC-USDT'), ('ETHBTC', 'ETH-BTC')])
+        self.assertFalse(index.is_empty())
+        self.assertFalse(index.is_expired())
+        self.assertEqual(index.to_native('BTCUSDT'), 'BTC-USDT')
+        self.assertEqual(index.to_unified('ETH-BTC'), 'ETHBTC')
+        self.assertEqual(index.symbols(), ['BTCUSDT', 'ETHBTC'])
+        with self.assertRaises(KeyError):
+            index.to_native('LTCBTC')
+
+    def test_expired(self):
+        index = SymbolIndex(ttl=0)
+        index.rebuild([('BTCUSDT', 'BTC-USDT')])
+        self.assertTrue(index.is_expired())
+
+
+class SymbolTranslateTests(TestCase):
+
+    class FakeExchange(BaseExchange):
+
+        def __init__(self):
+            super().__init__(None)
+            self.requests_count = 0
+
+        async def _get_access_symbols(self):
+            self.requests_count += 1
+            await asyncio.sleep(0.01)
+            self._symbol_index.rebuild([('BTCUSDT', 'BTC-USDT')])
+            return self._symbol_index.symbols()
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_concurrent_translate_share_one_request(self):
+        exchange = self.FakeExchange()
+
+        async def translate_many():
+            return await asyncio.gather(*[exchange._symbol_translate('BTCUSDT') for _ in range(10)])
+
+        symbols = self.loop.run_until_complete(translate_many())
+        self.assertEqual(symbols, ['BTC-USDT'] * 10)
+        self.assertEqual(exchange.requests_count, 1)
+
+        # next calls served from index
+        self.loop.run_until_complete(exchange._symbol_translate('BTCUSDT'))
+        self.assertEqual(exchange.requests_count, 1)
@@ -0,0 +1,21 @@
+from exchanges.timestamps import iso_to_unix, iso_to_unix_many
+from datetime import datetime, timezone
+from unittest import TestCase
+
+
+class TimestampsTests(TestCase):
+
+    def test_iso_to_unix(self):
+        expected = int(datetime(2019, 3, 19, 16, 0, 5, tzinfo=timezone.utc).timestamp())
+        self.assertEqual(iso_to_unix('2019-03-19T16:00:05.123Z'), expected)
+        self.assertEqual(iso_to_unix('2019-03-19T16:00:05Z'), expected)
+        # cached minute
+        self.assertEqual(iso_to_unix('2019-03-19T16:00:07.000Z'), expected + 2)
+        self.assertEqual(iso_to_unix('2019-03-19T16:00Z'), expected - 5)
+
+    def test_iso_to_unix_many(self):
+        values = ['2017-10-20T20:00:00.000Z', '2017-10-20T20:30:00.000Z', '2020-02-29T23:59:59Z']
+        expected = [int(datetime.strptime(value[:19], '%Y-%m-%dT%H:%M:%S').replace(tzinfo=timezone.utc).timestamp())
+                    for value in values]
+        self.assertEqual(iso_to_unix_many(values), expected)
+        self.assertEqual(iso_to_unix_many(iter(values)), expected)
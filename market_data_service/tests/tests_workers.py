@@ -0,0 +1,27 @@
+from workers import WorkerPool
+from unittest import TestCase
+
+
+class WorkerPoolTests(TestCase):
+
+    def test_shard_by_exchange(self):
+        pool = WorkerPool('queue', 'exchange', ['Binance', 'Bittrex'])
+        self.assertEqual(pool.shards, ['Binance', 'Bittrex'])
+        self.assertEqual(pool.shard_of('ticker.Bittrex.BTC-ETH'), 'Bittrex')
+        self.assertEqual(pool._queue_names['Binance'], 'queue.Binance')
+
+    def test_shard_by_hash(self):
+        pool = WorkerPool('queue', '4', ['Binance', 'Bittrex'])
+        self.assertEqual(pool.shards, ['0', '1', '2', '3'])
+        # all time frames and data types of pair share worker
+        shard = pool.shard_of('candles.Binance.BTCUSDT.M1')
+        self.assertEqual(pool.shard_of('candles.Binance.BTCUSDT.H1'), shard)
+        self.assertEqual(pool.shard_of('depth.Binance.BTCUSDT'), shard)
+        shards = {pool.shard_of(f'ticker.Binance.PAIR{i}') for i in range(100)}
+        self.assertEqual(shards, set(pool.shards))
+
+    def test_not_sharded_exchange_on_one_worker(self):
+        pool = WorkerPool('queue', '4', ['Binance', 'Bittrex'], not_sharded_exchanges=['Bittrex'])
+        self.assertEqual(pool.rate_limit_share, 0.25)
+        shards = {pool.shard_of(f'ticker.Bittrex.PAIR{i}') for i in range(100)}
+        self.assertEqual(len(shards), 1)
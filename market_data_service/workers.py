@@ -0,0 +1,130 @@
+"""Process pool mode of service
+
+Front process consume QUEUE_THIS_SERVICE, validate requests, answer listing_info and route other requests in queue
+of worker, that own data_id: QUEUE_THIS_SERVICE.<shard>. Each worker is process with own event loop, connections to
+exchanges and RabbitMQ, it publish market data in EXCHANGER directly.
+
+Env variable WORKERS:
+    exchange - one worker per exchange
+    <n> - n workers, data_id are distributed by hash of exchange and pair, so all time frames of pair share one
+          worker (and one M1 stream). Exchange spans all workers, so each worker use 1/n of its REST limits.
+          Exchange, that is not sharded by pair (BaseExchange.shard_by_pair), is served by one worker with full
+          limits
+
+"""
+from listing_index import parse_data_id
+import multiprocessing
+import json_codec
+import aio_pika
+import asyncio
+import signal
+import zlib
+
+SHARD_BY_EXCHANGE = 'exchange'
+
+
+def run_worker(queue_name, rate_limit_share):
+    """Entry point of worker process"""
+    from controller import Controller
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    controller = Controller(queue_for_consume=queue_name, is_worker=True, rate_limit_share=rate_limit_share)
+
+    loop.add_signal_handler(signal.SIGTERM, loop.stop)
+    # Ctrl+C stop front, that terminate workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    loop.create_task(controller.run())
+    try:
+        loop.run_forever()
+    finally:
+        loop.run_until_complete(controller.close())
+
+
+class WorkerPool:
+    """Worker processes and routing of requests between them
+
+    Worker, that exited, is restarted and get 'sub' of all its active subscriptions again.
+
+    """
+
+    def __init__(self, queue_prefix, mode, exchanges_names, not_sharded_exchanges=()):
+        self.mode = mode
+        if mode == SHARD_BY_EXCHANGE:
+            self.shards = list(exchanges_names)
+            self.rate_limit_share = 1
+        else:
+            self.shards = [str(i) for i in range(int(mode))]
+            self.rate_limit_share = 1 / len(self.shards)
+        self._not_sharded_exchanges = frozenset(not_sharded_exchanges)
+        self._queue_names = {shard: f'{queue_prefix}.{shard}' for shard in self.shards}
+
+        self._context = multiprocessing.get_context('spawn')
+        # shard -> Process
+        self._processes = dict()
+        # shard -> set data_id with active subscriptions
+        self._subscriptions = {shard: set() for shard in self.shards}
+
+        self._channel = None
+        self._monitor = None
+        self.check_interval = 1
+
+    def shard_of(self, data_id):
+        """Return shard, that own data_id"""
+        parsed_id = parse_data_id(data_id)
+        if self.mode == SHARD_BY_EXCHANGE:
+            return parsed_id.exchange
+        if parsed_id.exchange in self._not_sharded_exchanges:
+            key = parsed_id.exchange.encode('utf-8')
+        else:
+            key = f'{parsed_id.exchange}.{parsed_id.pair}'.encode('utf-8')
+        return self.shards[zlib.crc32(key) % len(self.shards)]
+
+    async def start(self, channel):
+        """Declare queues of workers and start processes"""
+        self._channel = channel
+        for shard in self.shards:
+            # queue is declared by front too, so requests are not lost while worker is starting
+            await self._channel.declare_queue(self._queue_names[shard], auto_delete=True)
+            self._start_process(shard)
+        self._monitor = asyncio.ensure_future(self._watch())
+
+    async def route(self, data_id, action, body):
+        """Send raw request body in queue of owner worker"""
+        shard = self.shard_of(data_id)
+        if action == 'sub':
+            self._subscriptions[shard].add(data_id)
+        elif action == 'unsub':
+            self._subscriptions[shard].discard(data_id)
+        await self._channel.default_exchange.publish(aio_pika.Message(body=body),
+                                                     routing_key=self._queue_names[shard])
+
+    async def close(self):
+        """Stop processes"""
+        if self._monitor:
+            self._monitor.cancel()
+        for process in self._processes.values():
+            if process.is_alive():
+                process.terminate()
+        for process in self._processes.values():
+            await asyncio.get_event_loop().run_in_executor(None, process.join, 10)
+
+    def _start_process(self, shard):
+        process = self._context.Process(target=run_worker, args=(self._queue_names[shard], self.rate_limit_share),
+                                        name=f'worker-{shard}', daemon=True)
+        process.start()
+        self._processes[shard] = process
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            for shard, process in list(self._processes.items()):
+                if process.exitcode is None:
+                    continue
+                print(f'Worker {shard} exited with code {process.exitcode}, restart it')
+                await self._channel.declare_queue(self._queue_names[shard], auto_delete=True)
+                self._start_process(shard)
+                for data_id in self._subscriptions[shard]:
+                    body = json_codec.dumps(dict(action='sub', data_id=data_id))
+                    await self._channel.default_exchange.publish(aio_pika.Message(body=body),
+                                                                 routing_key=self._queue_names[shard])